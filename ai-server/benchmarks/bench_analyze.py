@@ -0,0 +1,294 @@
+"""
+Offline end-to-end benchmark of /analyze.
+
+    cd ai-server
+    python benchmarks/bench_analyze.py --requests 200 --concurrency 16
+    python benchmarks/bench_analyze.py --compare benchmarks/results/<earlier run>.json
+
+The app runs in-process (lifespan included) against the stand-ins in
+standins.py: canned model answers after --llm-latency-ms, and a PostgREST
+imitation over SQLite loaded from sample-file.csv after --db-latency-ms.
+No network or API keys are needed, and the same seed gives the same run.
+
+By default every request is cold: questions are made unique and the answer
+cache and chart store are bypassed, so each request runs the whole pipeline.
+--warm lets repeated questions hit the caches instead.
+
+Reports p50/p95/p99 latency, throughput, errors, the per-stage timings
+/analyze returns and model input tokens (uncached, cache reads and writes), and writes them to benchmarks/results/ as JSON. --compare
+prints the change against an earlier result file.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+AI_SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(AI_SERVER, "benchmarks", "results")
+sys.path.insert(0, AI_SERVER)
+
+from standins import SCENARIOS, TABLE, FakeAnthropic, FakePostgrest, install, load_sample  # noqa: E402
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "mean": round(sum(values) / len(values), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def git_revision():
+    try:
+        sha = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=AI_SERVER, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain"], cwd=AI_SERVER, capture_output=True, text=True).stdout
+        return sha + ("-dirty" if dirty.strip() else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def configure_environment(args):
+    """Settings main.py reads at import time"""
+    os.environ.update({
+        "ANTHROPIC_API_KEY": "offline",
+        "SUPABASE_URL": "http://postgrest.local",
+        "SUPABASE_KEY": "offline",
+        "INTENT_RULES": "true" if args.rules else "false",
+        "ROLLUPS": "true" if args.rollups else "false",
+        "LOCAL_ENGINE": "true" if args.local_engine else "false",
+        "GRAPH_WORKERS": str(args.graph_workers),
+        "CACHE_DIR": "",
+    })
+    if not args.warm:
+        os.environ["CACHE_MAX_ENTRIES"] = "0"
+    if not args.verbose:
+        os.environ["LOG_LEVEL"] = "WARNING"
+
+
+def build_requests(args):
+    rng = random.Random(args.seed)
+    requests = []
+    for i in range(args.requests):
+        scenario = rng.choice(SCENARIOS)
+        question = scenario["question"] if args.warm else f"{scenario['question']} (run {i})"
+        requests.append({
+            "question": question,
+            "table_name": TABLE,
+            "graph_engine": args.graph_engine,
+            "planner_mode": args.planner_mode,
+        })
+    return requests
+
+
+async def drive(app, requests, concurrency):
+    import httpx
+
+    queue = asyncio.Queue()
+    for body in requests:
+        queue.put_nowait(body)
+    samples = []
+
+    async def worker(n: int):
+        # Each worker connects from its own address, as admission control counts slots per client
+        transport = httpx.ASGITransport(app=app, client=(f"10.0.{n // 256}.{n % 256}", 50000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            while not queue.empty():
+                body = queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/analyze", json=body)
+                    ok = response.status_code == 200
+                    timings = (response.json().get("timings") or {}) if ok else {}
+                    error = None if ok else f"HTTP {response.status_code}"
+                except Exception as e:
+                    ok, timings, error = False, {}, type(e).__name__
+                samples.append({
+                    "ms": (time.perf_counter() - start) * 1000,
+                    "ok": ok,
+                    "error": error,
+                    "timings": timings,
+                })
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+
+async def run(args):
+    import main
+
+    anthropic = FakeAnthropic(args.llm_latency_ms, args.llm_jitter, seed=args.seed)
+    postgrest = FakePostgrest(load_sample(args.csv), latency_ms=args.db_latency_ms)
+    install(main, anthropic, postgrest)
+    if not args.warm:
+        # Every chart is rendered: pretend the content-addressed store is empty
+        main.graph_store.lookup = lambda filename: False
+
+    async with main.lifespan(main.app):
+        # Build the mirrors up front so the first requests aren't measured against a cold sync
+        if main.rollup_store is not None:
+            await main.rollup_store.sync()
+        if main.local_engine is not None:
+            await main.local_engine.sync()
+
+        if args.warmup:
+            await drive(main.app, build_requests(argparse.Namespace(**{**vars(args), "requests": args.warmup})),
+                        args.concurrency)
+        model_calls, db_requests = anthropic.calls, postgrest.requests
+        tokens = dict(anthropic.tokens)
+        samples, wall = await drive(main.app, build_requests(args), args.concurrency)
+
+    ok = [s for s in samples if s["ok"]]
+    stages = {}
+    for sample in ok:
+        for name, ms in sample["timings"].items():
+            stages.setdefault(name, []).append(ms)
+    errors = {}
+    for sample in samples:
+        if sample["error"]:
+            errors[sample["error"]] = errors.get(sample["error"], 0) + 1
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output", "verbose")},
+        },
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(ok) / wall, 2) if wall else 0.0,
+        "wall_seconds": round(wall, 3),
+        "latency_ms": summarize([s["ms"] for s in ok]),
+        "stages_ms": {name: {**summarize(values), "count": len(values)} for name, values in sorted(stages.items())},
+        "model_calls_per_request": round((anthropic.calls - model_calls) / max(len(samples), 1), 2),
+        "db_requests_per_request": round((postgrest.requests - db_requests) / max(len(samples), 1), 2),
+        "input_tokens_per_request": {
+            name: round((anthropic.tokens[name] - tokens[name]) / max(len(samples), 1), 1) for name in tokens
+        },
+    }
+
+
+def print_report(result):
+    config = result["meta"]["config"]
+    print(
+        f"{result['requests']} requests, concurrency {config['concurrency']}, planner {config['planner_mode']}, "
+        f"{'warm' if config['warm'] else 'cold'}, model {config['llm_latency_ms']:.0f}ms, "
+        f"db {config['db_latency_ms']:.0f}ms"
+    )
+    latency = result["latency_ms"] or {}
+    print(
+        f"throughput {result['throughput_rps']:.1f} req/s   latency p50 {latency.get('p50', 0):.1f}ms  "
+        f"p95 {latency.get('p95', 0):.1f}ms  p99 {latency.get('p99', 0):.1f}ms   errors {sum(result['errors'].values())}"
+    )
+    print(f"model calls/request {result['model_calls_per_request']}   "
+          f"db requests/request {result['db_requests_per_request']}")
+    tokens = result.get("input_tokens_per_request")
+    if tokens:
+        print(f"input tokens/request: uncached {tokens['input']:.0f}  cache read {tokens['cache_read']:.0f}  "
+              f"cache write {tokens['cache_write']:.0f}")
+    print()
+    print(f"{'stage':<28}{'count':>7}{'p50':>10}{'p95':>10}{'mean':>10}")
+    for name, stats in result["stages_ms"].items():
+        print(f"{name:<28}{stats['count']:>7}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['mean']:>10.1f}")
+
+
+def print_comparison(before, after):
+    """Percent change per metric; for latencies negative is better, for throughput positive is"""
+    def row(name, old, new):
+        if old is None or new is None:
+            return
+        delta = (new - old) / old * 100 if old else 0.0
+        print(f"{name:<34}{old:>12.2f}{new:>12.2f}{delta:>+10.1f}%")
+
+    print(f"\ncompared with {before['meta']['revision']} ({before['meta']['timestamp']})")
+    print(f"{'metric':<34}{'before':>12}{'after':>12}{'change':>11}")
+    row("throughput_rps", before["throughput_rps"], after["throughput_rps"])
+    for p in ("p50", "p95", "p99"):
+        row(f"latency {p}", (before["latency_ms"] or {}).get(p), (after["latency_ms"] or {}).get(p))
+    for name in sorted(set(before["stages_ms"]) & set(after["stages_ms"])):
+        row(f"{name} p50", before["stages_ms"][name]["p50"], after["stages_ms"][name]["p50"])
+    if before["meta"]["config"] != after["meta"]["config"]:
+        print("note: the runs used different settings")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=8, help="unmeasured requests sent first")
+    parser.add_argument("--llm-latency-ms", type=float, default=400.0, help="per model call")
+    parser.add_argument("--llm-jitter", type=float, default=0.2, help="+/- fraction of the model latency")
+    parser.add_argument("--db-latency-ms", type=float, default=20.0, help="per PostgREST request")
+    parser.add_argument("--planner-mode", choices=["sequential", "planner", "parallel"], default="planner")
+    parser.add_argument("--graph-engine", choices=["matplotlib", "fast"], default="matplotlib")
+    parser.add_argument("--graph-workers", type=int, default=2)
+    parser.add_argument("--warm", action="store_true", help="let repeated questions hit the caches")
+    parser.add_argument("--no-rules", dest="rules", action="store_false", help="always ask the model for intent/graph")
+    parser.add_argument("--no-rollups", dest="rollups", action="store_false")
+    parser.add_argument("--local-engine", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", default=None, help="lead rows to serve (default: sample-file.csv)")
+    parser.add_argument("--verbose", action="store_true", help="show the server's log output")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/analyze-<revision>-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+    if args.csv is None:
+        from standins import SAMPLE_CSV
+        args.csv = SAMPLE_CSV
+
+    configure_environment(args)
+    # main.py mounts ./static and writes charts to ./static/images; keep them out of the checkout
+    workdir = tempfile.mkdtemp(prefix="bench-analyze-")
+    os.makedirs(os.path.join(workdir, "static", "images"))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        # Keep stray output out of the report; the server logs go through LOG_LEVEL
+        log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with log:
+            result = asyncio.run(run(args))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"analyze-{result['meta']['revision']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nsaved {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Compare the matplotlib and fast (Pillow/NumPy) chart engines on typical /analyze payloads.
+
+    cd ai-server
+    python benchmarks/bench_graph.py --repeat 30
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SOURCES = ["LinkedIn Outreach", "Cold Call", "Referral", "Website", "Trade Show"]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+STAGES = ["New", "Contacted", "Qualified", "On Hold", "Closed Won", "Closed Lost"]
+
+PAYLOADS = {
+    "bar, 5 categories": ("bar", {
+        "title": "Leads by Source",
+        "labels": SOURCES,
+        "datasets": [{"label": "Leads", "data": [2034, 1987, 2011, 1950, 2018]}]
+    }),
+    "bar, 6 x 3 grouped": ("bar", {
+        "title": "Deal Stage by Owner",
+        "labels": STAGES,
+        "datasets": [
+            {"label": owner, "data": [120 + i * 7 + j * 13 for j in range(len(STAGES))]}
+            for i, owner in enumerate(["Selena Doyle", "Kelsey Mosley", "Jaime Hayes"])
+        ]
+    }),
+    "line, 12 points": ("line", {
+        "title": "Leads per Month",
+        "labels": MONTHS,
+        "datasets": [{"label": "Leads", "data": [812, 845, 790, 901, 870, 855, 820, 880, 910, 860, 840, 830]}]
+    }),
+    "pie, 6 slices": ("pie", {
+        "title": "Deal Stage Share",
+        "labels": STAGES,
+        "datasets": [{"label": "Leads", "data": [1650, 1700, 1660, 1690, 1640, 1660]}]
+    }),
+}
+
+
+def time_engine(render, graph_type, graph_data, repeat):
+    render(graph_data, BytesIO(), graph_type, 800, 600)  # first call loads fonts/styles
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render(graph_data, BytesIO(), graph_type, 800, 600)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), statistics.mean(samples)
+
+
+def import_time(statement):
+    """Cold import time in a fresh interpreter, in milliseconds"""
+    code = f"import time; s = time.perf_counter(); {statement}; print((time.perf_counter() - s) * 1000)"
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.style
+    from services.graph_service import GRAPH_STYLE, _save_matplotlib_graph
+    from services.fast_chart import render_fast_chart
+    matplotlib.style.use(GRAPH_STYLE)
+
+    print(f"{'payload':<22}{'matplotlib p50':>16}{'fast p50':>12}{'speed-up':>10}")
+    for name, (graph_type, graph_data) in PAYLOADS.items():
+        mpl_p50, _ = time_engine(_save_matplotlib_graph, graph_type, graph_data, args.repeat)
+        fast_p50, _ = time_engine(render_fast_chart, graph_type, graph_data, args.repeat)
+        print(f"{name:<22}{mpl_p50:>14.1f}ms{fast_p50:>10.1f}ms{mpl_p50 / fast_p50:>9.1f}x")
+
+    mpl_import = import_time(
+        "import matplotlib; matplotlib.use('Agg'); import matplotlib.figure, matplotlib.backends.backend_agg"
+    )
+    fast_import = import_time("import services.fast_chart")
+    print(f"\ncold import: matplotlib {mpl_import:.0f}ms, fast engine {fast_import:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
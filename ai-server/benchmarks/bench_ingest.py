@@ -0,0 +1,188 @@
+"""
+Throughput of CSV ingestion (/upload) against a local Postgres + PostgREST.
+
+    cd ai-server/local-db && docker compose up -d && cd ..
+    python benchmarks/bench_ingest.py --url http://localhost:3000 --rows 100000
+    python benchmarks/bench_ingest.py --batch-rows 250,1000,5000 --in-flight 1,4,8
+
+The file is sample-file.csv, repeated until it has --rows rows, streamed to
+CsvIngestor in --chunk-kb chunks. Every batch size x in-flight combination
+ingests the file into a new table. Without --url the PostgREST stand-in from
+standins.py is used, with --db-latency-ms added to every request, so runs can
+be done offline.
+
+--baseline also times the frontend's old path: one insert carrying every row.
+Reports rows/s, batches and peak Python memory per run, and writes them to
+benchmarks/results/ as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+AI_SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(AI_SERVER, "benchmarks", "results")
+sys.path.insert(0, AI_SERVER)
+
+from standins import SAMPLE_CSV, FakePostgrest  # noqa: E402
+
+
+def build_csv(path: str, rows: int) -> bytes:
+    """The CSV at path with its data rows repeated until there are `rows` of them"""
+    with open(path, "rb") as f:
+        header, *lines = f.read().splitlines(keepends=True)
+    lines = [line if line.endswith(b"\n") else line + b"\n" for line in lines if line.strip()]
+    body = [lines[i % len(lines)] for i in range(rows)]
+    return header + b"".join(body)
+
+
+async def chunked(data: bytes, chunk_size: int):
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+def query_service_for(args):
+    import httpx
+    from services.query_service import QueryService
+
+    if args.url:
+        return QueryService(args.url, args.key, rest_path=args.rest_path, timeout=120)
+    service = QueryService("http://postgrest.local", None, rest_path="/rest/v1", timeout=120)
+    service.client = httpx.AsyncClient(
+        transport=FakePostgrest(rows=[], latency_ms=args.db_latency_ms).transport(),
+        base_url="http://postgrest.local/rest/v1"
+    )
+    return service
+
+
+async def run_ingest(query_service, data: bytes, batch_rows: int, in_flight: int, chunk_size: int):
+    from services.ingest_service import CsvIngestor
+
+    ingestor = CsvIngestor(query_service, batch_size=batch_rows, max_in_flight=in_flight)
+    tracemalloc.start()
+    progress = await ingestor.ingest(chunked(data, chunk_size), "bench.csv")
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "batch_rows": batch_rows,
+        "in_flight": in_flight,
+        "status": progress["status"],
+        "error": progress["error"],
+        "rows": progress["rows_inserted"],
+        "batches": progress["batches"],
+        "seconds": round(progress["elapsed_ms"] / 1000, 3),
+        "rows_per_second": progress["rows_per_second"],
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+        "table_name": progress["table_name"],
+    }
+
+
+async def run_baseline(query_service, data: bytes):
+    """The old browser flow: parse everything, then insert every row in one request"""
+    from services.ingest_service import INSERT_COLUMNS, CsvIngestor, CsvRecordStream, normalize_header
+
+    table_name = f"leads_{time.time_ns() // 1_000_000}"
+    tracemalloc.start()
+    start = time.perf_counter()
+    records = CsvRecordStream().feed(data, final=True)
+    header = [normalize_header(name) for name in records[0]]
+    counters = {"invalid_dates": 0}
+    rows = []
+    for number, record in enumerate(records[1:], 1):
+        row = CsvIngestor._row(header, record, counters)
+        if row is not None:
+            row["id"] = f"00000000-0000-0000-0000-{number:012d}"
+            rows.append(row)
+    error = None
+    try:
+        await query_service.create_leads_table(table_name)
+        await query_service.insert_rows(table_name, rows, INSERT_COLUMNS)
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "batch_rows": len(rows),
+        "in_flight": 1,
+        "status": "failed" if error else "complete",
+        "error": error,
+        "rows": 0 if error else len(rows),
+        "batches": 1,
+        "seconds": round(seconds, 3),
+        "rows_per_second": None if error else round(len(rows) / seconds, 1),
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+        "table_name": table_name,
+    }
+
+
+async def run(args):
+    data = build_csv(args.csv, args.rows)
+    query_service = query_service_for(args)
+    runs = []
+    try:
+        if args.baseline:
+            runs.append({"mode": "single request", **await run_baseline(query_service, data)})
+        for batch_rows in args.batch_rows:
+            for in_flight in args.in_flight:
+                runs.append({
+                    "mode": "streamed",
+                    **await run_ingest(query_service, data, batch_rows, in_flight, args.chunk_kb * 1024)
+                })
+    finally:
+        await query_service.aclose()
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "backend": args.url or f"stand-in ({args.db_latency_ms:g}ms per request)",
+            "rows": args.rows,
+            "bytes": len(data),
+            "chunk_kb": args.chunk_kb,
+        },
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="PostgREST base URL (default: the offline stand-in)")
+    parser.add_argument("--rest-path", default="", help="path of the REST API under --url (Supabase: /rest/v1)")
+    parser.add_argument("--key", default=None, help="API key, for Supabase")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--csv", default=SAMPLE_CSV)
+    parser.add_argument("--batch-rows", type=lambda v: [int(x) for x in v.split(",")], default=[1000])
+    parser.add_argument("--in-flight", type=lambda v: [int(x) for x in v.split(",")], default=[1, 4])
+    parser.add_argument("--chunk-kb", type=int, default=64, help="size of the body chunks fed to the parser")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0, help="stand-in only")
+    parser.add_argument("--baseline", action="store_true", help="also time one insert carrying every row")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/ingest-<time>.json)")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    meta = result["meta"]
+    print(f"{meta['rows']} rows ({meta['bytes'] / 1024 / 1024:.1f} MB) into {meta['backend']}\n")
+    print(f"{'mode':<16}{'batch':>8}{'flight':>8}{'batches':>9}{'seconds':>10}{'rows/s':>11}{'peak MB':>9}")
+    for r in result["runs"]:
+        rate = f"{r['rows_per_second']:.0f}" if r["rows_per_second"] else r["status"]
+        print(f"{r['mode']:<16}{r['batch_rows']:>8}{r['in_flight']:>8}{r['batches']:>9}"
+              f"{r['seconds']:>10.2f}{rate:>11}{r['peak_memory_mb']:>9.1f}")
+        if r["error"]:
+            print(f"  error: {r['error'][:200]}")
+    if args.url:
+        print("\nthe benchmark tables are left in place (and registered in master_uploads):")
+        print("  " + " ".join(r["table_name"] for r in result["runs"]))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"ingest-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nsaved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Time typical generated queries on the local SQLite engine, loaded from sample-file.csv.
+
+    cd ai-server
+    python benchmarks/bench_local_engine.py --repeat 200
+
+With --remote-table leads_<id> (and SUPABASE_URL/SUPABASE_KEY set), the same
+queries are also timed through the execute_readonly_query RPC for comparison.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from standins import SAMPLE_CSV, TABLE, load_sample  # noqa: E402
+
+QUERIES = {
+    "count": "SELECT COUNT(*) AS total_leads FROM {table}",
+    "by source": "SELECT source, COUNT(*) AS count FROM {table} GROUP BY source ORDER BY count DESC",
+    "stage share": (
+        "SELECT deal_stage, COUNT(*) AS count, ROUND(COUNT(*) * 100.0 / (SELECT COUNT(*) FROM {table}), 1) AS pct "
+        "FROM {table} GROUP BY deal_stage ORDER BY count DESC"
+    ),
+    "won by owner": (
+        "SELECT lead_owner, COUNT(*) FILTER (WHERE deal_stage = 'Closed Won') AS won FROM {table} "
+        "GROUP BY lead_owner ORDER BY won DESC LIMIT 10"
+    ),
+    "date range": "SELECT MIN(date) AS first, MAX(date) AS last FROM {table} WHERE date >= '2025-03-01'",
+    "like": "SELECT COUNT(*) AS count FROM {table} WHERE company LIKE '%LLC'",
+    # Postgres-only syntax: the engine declines and /analyze falls back to Supabase
+    "by month (pg)": "SELECT DATE_TRUNC('month', date) AS month, COUNT(*) FROM {table} GROUP BY 1 ORDER BY 1",
+}
+
+
+async def time_queries(run, repeat):
+    results = {}
+    for name, sql in QUERIES.items():
+        samples = []
+        try:
+            await run(sql)
+            for _ in range(repeat):
+                start = time.perf_counter()
+                await run(sql)
+                samples.append((time.perf_counter() - start) * 1000)
+        except Exception as e:
+            results[name] = type(e).__name__
+            continue
+        samples.sort()
+        results[name] = (statistics.median(samples), samples[int(len(samples) * 0.95) - 1])
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--csv", default=SAMPLE_CSV)
+    parser.add_argument("--remote-table", help="also time the queries against this Supabase table")
+    args = parser.parse_args()
+
+    from services.local_engine import LEADS_COLUMNS, LocalEngine
+
+    rows = load_sample(args.csv)
+    engine = LocalEngine(query_service=None, catalog=None)
+    start = time.perf_counter()
+    engine.load_table(TABLE, "benchmark", LEADS_COLUMNS, rows)
+    print(f"loaded {len(rows)} rows in {(time.perf_counter() - start) * 1000:.0f}ms\n")
+
+    local = await time_queries(lambda sql: engine.execute(sql.format(table=TABLE), TABLE, "benchmark"), args.repeat)
+
+    remote = {}
+    if args.remote_table:
+        from dotenv import load_dotenv
+        from services.query_service import QueryService
+        load_dotenv()
+        query_service = QueryService(
+            os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"),
+            rest_path=os.getenv("SUPABASE_REST_PATH", "/rest/v1")
+        )
+        remote = await time_queries(
+            lambda sql: query_service.execute_query(sql.format(table=args.remote_table)),
+            max(1, args.repeat // 10)
+        )
+        await query_service.aclose()
+
+    def cell(result):
+        if result is None:
+            return f"{'-':>20}"
+        if isinstance(result, str):
+            return f"{result:>20}"
+        return f"{result[0]:>8.3f} / {result[1]:>7.3f}ms"
+
+    print(f"{'query':<16}{'local p50 / p95':>20}{'remote p50 / p95':>22}")
+    for name in QUERIES:
+        print(f"{name:<16}{cell(local[name])}  {cell(remote.get(name))}")
+    print(f"\nlocal engine: {engine.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
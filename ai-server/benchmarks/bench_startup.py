@@ -0,0 +1,138 @@
+"""
+Cold start of the AI server: import, startup warm-up, and the first requests.
+
+    cd ai-server
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --warm-up-only --graph-workers 4
+
+Every run is a fresh interpreter, as after a deploy or a worker restart. It
+times `import main`, the lifespan startup (which warms up the render
+workers, the model client and the table catalog unless WARM_UP=false), and
+then the first and second /analyze with a chart, against the stand-ins in
+standins.py. By default each run is done with the warm-up and without it,
+so the two can be compared: without it the first request pays for the
+startup work instead.
+
+Reports the median of each timing, and writes the runs to
+benchmarks/results/ as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+AI_SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(AI_SERVER, "benchmarks", "results")
+
+QUESTIONS = ["Show me leads by source", "Show me leads by status"]
+
+
+async def child(args) -> dict:
+    """One cold start, in this (fresh) interpreter"""
+    sys.path.insert(0, AI_SERVER)
+    sys.path.insert(0, os.path.join(AI_SERVER, "benchmarks"))
+    start = time.perf_counter()
+    import main
+    import_ms = (time.perf_counter() - start) * 1000
+
+    import httpx
+    from standins import TABLE, FakeAnthropic, FakePostgrest, SAMPLE_CSV, install, load_sample
+    install(
+        main,
+        FakeAnthropic(args.llm_latency_ms, jitter=0.0),
+        FakePostgrest(load_sample(SAMPLE_CSV), latency_ms=args.db_latency_ms)
+    )
+    result = {"import_ms": round(import_ms, 1)}
+    start = time.perf_counter()
+    async with main.lifespan(main.app):
+        result["startup_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            for n, question in enumerate(QUESTIONS, 1):
+                start = time.perf_counter()
+                response = await client.post("/analyze", json={
+                    "question": question, "table_name": TABLE, "include_graph": True
+                })
+                response.raise_for_status()
+                result[f"request_{n}_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        result["warm_up_ms"] = main.warm_state["steps_ms"]
+    return result
+
+
+def run_once(args, warm_up: bool) -> dict:
+    env = {
+        **os.environ,
+        "ANTHROPIC_API_KEY": "offline",
+        "SUPABASE_URL": "http://postgrest.local",
+        "SUPABASE_KEY": "offline",
+        "CACHE_DIR": "",
+        # Both requests run the whole pipeline, so the second shows what the first would cost warm
+        "CACHE_MAX_ENTRIES": "0",
+        "GRAPH_WORKERS": str(args.graph_workers),
+        "WARM_UP": "true" if warm_up else "false",
+    }
+    # main.py writes charts to ./static/images; keep them out of the checkout
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as workdir:
+        os.makedirs(os.path.join(workdir, "static", "images"))
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child",
+             "--llm-latency-ms", str(args.llm_latency_ms), "--db-latency-ms", str(args.db_latency_ms)],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True
+        )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per mode")
+    parser.add_argument("--llm-latency-ms", type=float, default=400.0, help="per model call")
+    parser.add_argument("--db-latency-ms", type=float, default=20.0, help="per PostgREST request")
+    parser.add_argument("--graph-workers", type=int, default=2)
+    parser.add_argument("--warm-up-only", dest="compare", action="store_false",
+                        help="skip the runs with WARM_UP=false")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/startup-<time>.json)")
+    args = parser.parse_args()
+
+    if args.child:
+        # The parent reads the last line of stdout only
+        print(json.dumps(asyncio.run(child(args))))
+        return
+
+    modes = {"warm_up": True, "no_warm_up": False} if args.compare else {"warm_up": True}
+    result = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("child", "output")},
+        },
+        "modes": {},
+    }
+    print(f"{'mode':<14}{'import':>10}{'startup':>10}{'request 1':>12}{'request 2':>12}   (median ms)")
+    for mode, warm_up in modes.items():
+        runs = [run_once(args, warm_up) for _ in range(args.runs)]
+        medians = {
+            key: round(statistics.median(run[key] for run in runs), 1)
+            for key in ("import_ms", "startup_ms", "request_1_ms", "request_2_ms")
+        }
+        result["modes"][mode] = {"median_ms": medians, "runs": runs}
+        print(f"{mode:<14}{medians['import_ms']:>10.0f}{medians['startup_ms']:>10.0f}"
+              f"{medians['request_1_ms']:>12.0f}{medians['request_2_ms']:>12.0f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"startup-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nsaved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Evaluate the rule-based intent and graph fast path against a labeled question set.
+
+    cd ai-server
+    python benchmarks/eval_intent.py
+    python benchmarks/eval_intent.py --show-misses
+
+Reports, for intent and for the graph decision: coverage (how many questions the
+rules decide without the model), accuracy on the questions they decide, and
+per-decision latency. With --with-claude (and ANTHROPIC_API_KEY set) the
+questions the rules leave undecided are also sent to the model, to compare
+end-to-end accuracy and latency.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intent_questions.jsonl")
+
+
+def load(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def timed(fn, question, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(question)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return result, statistics.median(samples)
+
+
+def graph_matches(decision, label):
+    if decision["include_graph"] != label["include_graph"]:
+        return False
+    return not label["include_graph"] or decision["graph_type"] == label["graph_type"]
+
+
+def report(name, rows, total):
+    decided = [row for row in rows if row["decision"] is not None]
+    correct = [row for row in decided if row["correct"]]
+    latencies = sorted(row["us"] for row in rows)
+    coverage = len(decided) / total
+    accuracy = len(correct) / len(decided) if decided else float("nan")
+    print(
+        f"{name:<8} coverage {len(decided):>3}/{total} ({coverage:6.1%})   "
+        f"accuracy when decided {len(correct):>3}/{len(decided)} ({accuracy:6.1%})   "
+        f"latency p50 {statistics.median(latencies):5.1f}us  p99 {latencies[int(len(latencies) * 0.99) - 1]:5.1f}us"
+    )
+
+
+async def with_claude(rules, questions):
+    from dotenv import load_dotenv
+    from services.claude_service import ClaudeService
+    load_dotenv()
+    claude = ClaudeService(os.getenv("ANTHROPIC_API_KEY"))
+    intent_ok = graph_ok = 0
+    latencies = []
+    for label in questions:
+        start = time.perf_counter()
+        intent = rules.classify_intent(label["question"]) or await claude.classify_intent(label["question"])
+        intent_ok += intent["classification"] == label["classification"]
+        if label["classification"] == "analyze":
+            graph = rules.graph_decision(label["question"]) or await claude.should_generate_graph(label["question"])
+            graph_ok += graph_matches(graph, label)
+        latencies.append((time.perf_counter() - start) * 1000)
+    await claude.aclose()
+    analyze = sum(1 for q in questions if q["classification"] == "analyze")
+    print(
+        f"\nrules + model fallback: intent {intent_ok}/{len(questions)}, graph {graph_ok}/{analyze}, "
+        f"latency p50 {statistics.median(latencies):.1f}ms, mean {statistics.mean(latencies):.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DATA)
+    parser.add_argument("--repeat", type=int, default=200, help="timing repetitions per question")
+    parser.add_argument("--show-misses", action="store_true", help="print wrong and undecided questions")
+    parser.add_argument("--with-claude", action="store_true", help="send undecided questions to the model")
+    args = parser.parse_args()
+
+    from services.intent_rules import RuleClassifier
+    rules = RuleClassifier()
+    questions = load(args.data)
+
+    intent_rows, graph_rows = [], []
+    for label in questions:
+        decision, us = timed(rules.classify_intent, label["question"], args.repeat)
+        intent_rows.append({
+            "label": label, "decision": decision, "us": us,
+            "correct": decision is not None and decision["classification"] == label["classification"]
+        })
+        if label["classification"] != "analyze":
+            continue
+        decision, us = timed(rules.graph_decision, label["question"], args.repeat)
+        graph_rows.append({
+            "label": label, "decision": decision, "us": us,
+            "correct": decision is not None and graph_matches(decision, label)
+        })
+
+    print(f"{len(questions)} labeled questions ({len(graph_rows)} analyze)\n")
+    report("intent", intent_rows, len(intent_rows))
+    report("graph", graph_rows, len(graph_rows))
+
+    if args.show_misses:
+        for name, rows, describe in (
+            ("intent", intent_rows, lambda d: d["classification"]),
+            ("graph", graph_rows, lambda d: f"{d['include_graph']}/{d['graph_type']}"),
+        ):
+            print(f"\n{name} misses:")
+            for row in rows:
+                if row["decision"] is not None and not row["correct"]:
+                    print(f"  WRONG    {row['label']['question']!r}: got {describe(row['decision'])}, "
+                          f"expected {describe(row['label'])}")
+            for row in rows:
+                if row["decision"] is None:
+                    print(f"  UNSURE   {row['label']['question']!r}")
+
+    if args.with_claude:
+        asyncio.run(with_claude(rules, questions))
+
+
+if __name__ == "__main__":
+    main()
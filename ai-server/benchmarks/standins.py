@@ -0,0 +1,459 @@
+"""
+Deterministic local stand-ins for the Anthropic API and Supabase/PostgREST, so the
+/analyze pipeline can be benchmarked offline.
+
+- FakeAnthropic answers every prompt ClaudeService sends (planner, intent, graph,
+  SQL, analysis, streaming) with a canned call to the requested tool after a
+  configurable latency. It rejects requests the API would reject (malformed system
+  blocks or cache_control, too many cache breakpoints), and imitates prompt caching
+  so usage reports cache reads and writes.
+- FakePostgrest serves master_uploads, table pages and the execute_readonly_query
+  and execute_governed_query RPCs from an in-memory SQLite copy of sample-file.csv.
+  It also takes the writes /upload makes: create_leads_table, bulk inserts and new
+  master_uploads rows.
+"""
+import asyncio
+import csv
+import json
+import os
+import random
+import re
+import sqlite3
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SAMPLE_CSV = os.path.join(ROOT, "sample-file.csv")
+UPLOAD_ID = "00000000-0000-0000-0000-000000000001"
+TABLE_SUFFIX = "sample"
+TABLE = f"leads_{TABLE_SUFFIX}"
+
+# Questions with the SQL and graph decision the model would produce for them.
+# The SQL is valid in both Postgres and SQLite.
+SCENARIOS: List[Dict[str, Any]] = [
+    {"question": "How many leads do we have?", "graph": (False, "none"),
+     "sql": ["SELECT COUNT(*) AS total_leads FROM {table}"]},
+    {"question": "Show me leads by source", "graph": (True, "bar"),
+     "sql": ["SELECT source, COUNT(*) AS count FROM {table} GROUP BY source ORDER BY count DESC"]},
+    {"question": "Breakdown of deals per stage", "graph": (True, "bar"),
+     "sql": ["SELECT deal_stage, COUNT(*) AS count FROM {table} GROUP BY deal_stage ORDER BY count DESC"]},
+    {"question": "Leads per month", "graph": (True, "line"),
+     "sql": ["SELECT SUBSTR(CAST(date AS TEXT), 1, 7) AS month, COUNT(*) AS count FROM {table} GROUP BY 1 ORDER BY 1"]},
+    {"question": "Top 10 owners by closed won deals", "graph": (True, "bar"),
+     "sql": ["SELECT lead_owner, COUNT(*) AS won FROM {table} WHERE deal_stage = 'Closed Won' "
+             "GROUP BY lead_owner ORDER BY won DESC, lead_owner LIMIT 10"]},
+    {"question": "What percentage of leads are qualified, and how many are closed won?", "graph": (False, "none"),
+     "sql": ["SELECT ROUND(100.0 * SUM(CASE WHEN deal_stage = 'Qualified' THEN 1 ELSE 0 END) / COUNT(*), 1) "
+             "AS qualified_pct FROM {table}",
+             "SELECT COUNT(*) AS closed_won FROM {table} WHERE deal_stage = 'Closed Won'"]},
+    {"question": "List all deals in Proposal Sent", "graph": (False, "none"),
+     "sql": ["SELECT first_name, last_name, company, lead_owner, date FROM {table} "
+             "WHERE deal_stage = 'Proposal Sent' ORDER BY date"]},
+    {"question": "Of those sources, which brought in more than 500 leads?", "graph": (False, "none"),
+     "sql": ["SELECT source, COUNT(*) AS count FROM {table} GROUP BY source HAVING COUNT(*) > 500 ORDER BY count DESC"],
+     # With a session, the earlier "leads by source" result is re-filtered instead
+     "followup_sql": ["SELECT source, count FROM {previous} WHERE count > 500 ORDER BY count DESC"]},
+    {"question": "hello", "chat": True},
+]
+
+
+def load_sample(path: str = SAMPLE_CSV) -> List[Dict[str, Any]]:
+    """sample-file.csv rows in the leads table schema (ISO dates, snake_case columns)"""
+    rows = []
+    with open(path, newline="") as f:
+        for record in csv.DictReader(f):
+            rows.append({
+                "id": str(uuid.UUID(int=len(rows) + 1)),
+                "date": datetime.strptime(record["Date"], "%m/%d/%Y").date().isoformat(),
+                **{key.lower().replace(" ", "_"): value for key, value in record.items() if key != "Date"}
+            })
+    return rows
+
+
+def scenario_for(text: str) -> Dict[str, Any]:
+    """The scenario whose question appears in a prompt (longest match wins)"""
+    matches = [s for s in SCENARIOS if s["question"].lower() in text.lower()]
+    return max(matches, key=lambda s: len(s["question"])) if matches else SCENARIOS[1]
+
+
+class _Block:
+    def __init__(self, text: str):
+        self.type = "text"
+        self.text = text
+
+
+class _ToolUse:
+    def __init__(self, name: str, input: Dict[str, Any]):
+        self.type = "tool_use"
+        self.id = f"toolu_{uuid.uuid4().hex[:24]}"
+        self.name = name
+        self.input = input
+
+
+class _Delta:
+    def __init__(self, partial_json: str):
+        self.type = "input_json_delta"
+        self.partial_json = partial_json
+
+
+class _Event:
+    def __init__(self, type: str, delta: _Delta | None = None):
+        self.type = type
+        self.delta = delta
+
+
+class _Usage:
+    def __init__(self, input_tokens: int, output_tokens: int, cache_read: int = 0, cache_write: int = 0):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cache_creation_input_tokens = cache_write
+        self.cache_read_input_tokens = cache_read
+
+
+class _Message:
+    def __init__(self, text: str, usage: Dict[str, int], tool: str | None = None):
+        self.content = [_ToolUse(tool, json.loads(text))] if tool else [_Block(text)]
+        self.usage = _Usage(output_tokens=(len(text) + 3) // 4, **usage)
+        self.stop_reason = "tool_use" if tool else "end_turn"
+
+
+class _Stream:
+    def __init__(self, fake: "FakeAnthropic", kwargs: Dict[str, Any]):
+        self.fake = fake
+        self.kwargs = kwargs
+        self.message = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def __aiter__(self):
+        usage = self.fake.check(self.kwargs)
+        text = self.fake.respond(self.kwargs)
+        await asyncio.sleep(self.fake.first_token_delay())
+        chunks = [text[i:i + 16] for i in range(0, len(text), 16)]
+        per_chunk = self.fake.delay() * 0.5 / max(len(chunks), 1)
+        for chunk in chunks:
+            await asyncio.sleep(per_chunk)
+            yield _Event("content_block_delta", _Delta(chunk))
+        self.message = _Message(text, usage, tool_name(self.kwargs))
+
+    async def get_final_message(self):
+        return self.message
+
+
+def tool_name(kwargs: Dict[str, Any]) -> str | None:
+    """The tool a request forces, if any"""
+    tools = kwargs.get("tools") or []
+    return tools[0]["name"] if tools else None
+
+
+class _Messages:
+    def __init__(self, fake: "FakeAnthropic"):
+        self.fake = fake
+
+    async def create(self, timeout: float | None = None, **kwargs):
+        self.fake.calls += 1
+        usage = self.fake.check(kwargs)
+        text = self.fake.respond(kwargs)
+        await asyncio.sleep(self.fake.delay())
+        return _Message(text, usage, tool_name(kwargs))
+
+    def stream(self, timeout: float | None = None, **kwargs):
+        self.fake.calls += 1
+        return _Stream(self.fake, kwargs)
+
+
+class _Models:
+    def __init__(self, fake: "FakeAnthropic"):
+        self.fake = fake
+
+    async def list(self, limit: int | None = None, timeout: float | None = None):
+        """The warm-up ping: one round trip, no model call"""
+        await asyncio.sleep(self.fake.delay() * 0.1)
+        return []
+
+
+class FakeAnthropic:
+    """
+    Drop-in for anthropic.AsyncAnthropic as used by ClaudeService.
+    Each call sleeps latency_ms +/- jitter (seeded, so runs are repeatable).
+    """
+
+    def __init__(self, latency_ms: float = 400.0, jitter: float = 0.2, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.messages = _Messages(self)
+        self.models = _Models(self)
+        # Prompt prefixes written to the imitation cache, by model
+        self.cached: set = set()
+        self.tokens = {"input": 0, "cache_read": 0, "cache_write": 0}
+
+    def delay(self) -> float:
+        spread = 1 + self.random.uniform(-self.jitter, self.jitter)
+        return max(0.0, self.latency_ms * spread / 1000)
+
+    def first_token_delay(self) -> float:
+        return self.delay() * 0.5
+
+    async def close(self) -> None:
+        pass
+
+    def check(self, kwargs: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Validate a request's shape the way the API does, and return its usage: input
+        tokens past the longest cached prefix, and the prefix read from or written to the cache.
+        Prefixes end at blocks marked cache_control and count the tools before the system blocks;
+        like the API, prefixes under the model's minimum (1024 tokens, 2048 for Haiku) aren't cached.
+        """
+        system = kwargs.get("system") or []
+        blocks = [{"type": "text", "text": system}] if isinstance(system, str) else system
+        marked = 0
+        for block in blocks:
+            if block.get("type") != "text" or not isinstance(block.get("text"), str) or not block["text"]:
+                raise ValueError(f"system blocks must be non-empty text blocks, got {block!r}")
+            if "cache_control" in block:
+                if block["cache_control"] != {"type": "ephemeral"}:
+                    raise ValueError(f"unsupported cache_control {block['cache_control']!r}")
+                marked += 1
+        messages = kwargs.get("messages") or []
+        if not messages or messages[0].get("role") != "user":
+            raise ValueError("messages must start with a user turn")
+        for message in messages:
+            content = message.get("content")
+            if not content or not isinstance(content, (str, list)):
+                raise ValueError("every message needs non-empty content")
+            if isinstance(content, list):
+                marked += sum("cache_control" in block for block in content)
+        marked += sum("cache_control" in tool for tool in kwargs.get("tools") or [])
+        if marked > 4:
+            raise ValueError(f"at most 4 blocks may have cache_control, got {marked}")
+
+        model = kwargs.get("model", "")
+        minimum = 2048 if "haiku" in model else 1024
+        prefix = json.dumps(kwargs.get("tools") or [])
+        breakpoints = []
+        for block in blocks:
+            prefix += block["text"]
+            if "cache_control" in block:
+                breakpoints.append(prefix)
+        total = (len(prefix) + len(json.dumps(messages)) + 3) // 4
+        read = write = 0
+        for text in breakpoints:
+            tokens = (len(text) + 3) // 4
+            key = (model, hash(text))
+            if tokens < minimum:
+                continue
+            if key in self.cached:
+                read = tokens
+            else:
+                self.cached.add(key)
+                write = tokens - read
+        usage = {"input_tokens": total - read - write, "cache_read": read, "cache_write": write}
+        for name, n in zip(self.tokens, usage.values()):
+            self.tokens[name] += n
+        return usage
+
+    def respond(self, kwargs: Dict[str, Any]) -> str:
+        system = kwargs.get("system") or ""
+        system = system if isinstance(system, str) else "\n".join(block["text"] for block in system)
+        content = kwargs["messages"][0]["content"]
+        content = content if isinstance(content, str) else json.dumps(content)
+
+        tool = tool_name(kwargs)
+
+        if tool == "analysis" or "Query results" in content:
+            include_graph = "graph_data" in json.dumps(kwargs.get("tools") or [])
+            return json.dumps(self._analysis(content, include_graph))
+        if tool == "plans":
+            questions = re.findall(r'^\s*(\d+)\. "(.*)"$', content, re.MULTILINE)
+            plans = [
+                {"index": int(index), **json.loads(self.respond({
+                    "system": system,
+                    "tools": [{"name": "plan"}],
+                    "messages": [{"content": f'Question: "{question}"'}]
+                }))}
+                for index, question in questions
+            ]
+            return json.dumps({"plans": plans})
+
+        scenario = scenario_for(content)
+        # The table and the session's earlier results are described in the system blocks
+        context = f"{system}\n{content}"
+        table = re.search(r"Table name: (\w+)", context)
+        table = table.group(1) if table else TABLE
+        # Earlier results of the conversation, as listed by SessionStore.schema_context
+        previous = re.findall(r"- (turn\d+_\d+) \(", context)
+        sqls = scenario["followup_sql"] if previous and "followup_sql" in scenario else scenario.get("sql", [])
+        queries = [
+            {
+                "sql": sql.format(table=table, previous=previous[-1] if previous else table),
+                "description": "Canned query",
+                "metric_name": f"Metric {i + 1}"
+            }
+            for i, sql in enumerate(sqls)
+        ]
+        include_graph, graph_type = scenario.get("graph", (False, "none"))
+        chat = scenario.get("chat", False)
+        intent = {
+            "classification": "chat" if chat else "analyze",
+            "response": "Hello! Ask me about your leads." if chat else None
+        }
+        graph = {"include_graph": include_graph, "graph_type": graph_type, "reasoning": "Canned decision"}
+
+        if tool == "plan":
+            return json.dumps({**intent, **graph, "queries": [] if chat else queries})
+        if tool == "classify_intent":
+            return json.dumps(intent)
+        if tool == "graph_decision":
+            return json.dumps(graph)
+        return json.dumps({"queries": queries})
+
+    @staticmethod
+    def _analysis(content: str, include_graph: bool) -> Dict[str, Any]:
+        analysis = {
+            "summary": "Based on the data, Referral and Cold Call bring the most leads, "
+                       "each with a little over 500 of the 10,000 total.",
+            "statistics": [{"metric_name": "Total Leads", "value": 10000, "unit": "leads", "breakdown": {}}]
+        }
+        if include_graph:
+            graph_type = re.search(r"Graph data for (\w+) chart", content)
+            analysis["graph_data"] = {
+                "type": graph_type.group(1) if graph_type else "bar",
+                "labels": ["Referral", "Cold Call", "Website Form", "Chatbot", "Podcast"],
+                "datasets": [{"label": "Leads", "data": [530, 520, 475, 516, 490]}]
+            }
+        return analysis
+
+
+class FakePostgrest:
+    """
+    httpx transport handler imitating the PostgREST endpoints QueryService uses,
+    backed by SQLite, with latency_ms added to every request.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]] | None = None, latency_ms: float = 20.0):
+        from services.local_engine import LEADS_COLUMNS, _postgres_column_name
+
+        self.latency_ms = latency_ms
+        self.requests = 0
+        self._column_name = _postgres_column_name
+        self.columns = LEADS_COLUMNS
+        self.db = sqlite3.connect(":memory:", check_same_thread=False)
+        self.db.execute("PRAGMA case_sensitive_like = ON")
+        self.db.execute(f'CREATE TABLE "{TABLE}" ({", ".join(name for name, _ in LEADS_COLUMNS)})')
+        rows = load_sample() if rows is None else rows
+        self.db.executemany(
+            f'INSERT INTO "{TABLE}" VALUES ({", ".join("?" for _ in LEADS_COLUMNS)})',
+            [tuple(row.get(name) for name, _ in LEADS_COLUMNS) for row in rows]
+        )
+        self.uploads = [{
+            "id": UPLOAD_ID, "filename": "sample-file.csv",
+            "table_name": TABLE_SUFFIX, "created_at": "2025-01-01T00:00:00+00:00"
+        }]
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        path = request.url.path.rsplit("/", 1)[-1]
+        if path == "master_uploads" and request.method == "POST":
+            self.uploads.append({
+                "id": str(uuid.uuid4()), **json.loads(request.content),
+                "created_at": datetime.utcnow().isoformat() + "+00:00"
+            })
+            return httpx.Response(201)
+        if path == "master_uploads":
+            after = request.url.params.get("created_at", "")
+            uploads = [u for u in self.uploads if not after.startswith("gt.") or u["created_at"] > after[3:]]
+            return httpx.Response(200, json=uploads)
+        if request.method == "GET":
+            offset = int(request.url.params.get("offset", 0))
+            limit = int(request.url.params.get("limit", 1000))
+            return httpx.Response(200, json=self._query(
+                f'SELECT * FROM "{path}" ORDER BY id LIMIT {limit} OFFSET {offset}'
+            ))
+
+        if path == "create_leads_table":
+            table = json.loads(request.content)["table_name"]
+            self.db.execute(
+                f'CREATE TABLE "{table}" (id PRIMARY KEY, {", ".join(name for name, _ in self.columns[1:])})'
+            )
+            return httpx.Response(204)
+        if "/rpc/" not in request.url.path:
+            return self._insert(path, request)
+
+        body = json.loads(request.content)
+        sql = body["query"]
+        if path == "execute_governed_query":
+            try:
+                cost = self._cost(sql)
+                rejected = body.get("max_cost") is not None and cost > body["max_cost"]
+                rows = [] if rejected else self._query(sql)
+            except sqlite3.Error as e:
+                return httpx.Response(400, json={"message": str(e)})
+            return httpx.Response(200, json={"cost": cost, "rejected": rejected, "rows": rows})
+        if "information_schema.columns" in sql:
+            tables = [name for (name,) in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            return httpx.Response(200, json=[
+                {"table_name": table, "column_name": name, "data_type": pg_type}
+                for table in tables if f"'{table}'" in sql
+                for name, pg_type in self.columns
+            ])
+        try:
+            return httpx.Response(200, json=self._query(sql))
+        except sqlite3.Error as e:
+            return httpx.Response(400, json={"message": str(e)})
+
+    def _insert(self, table: str, request: httpx.Request) -> httpx.Response:
+        """Bulk insert; rows whose id exists are skipped (Prefer: resolution=ignore-duplicates)"""
+        columns = request.url.params["columns"].split(",")
+        rows = json.loads(request.content)
+        try:
+            self.db.executemany(
+                f'INSERT OR IGNORE INTO "{table}" ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})',
+                [tuple(row.get(name) for name in columns) for row in rows]
+            )
+        except sqlite3.OperationalError as e:
+            status = 404 if "no such table" in str(e) else 400
+            return httpx.Response(status, json={"message": str(e)})
+        return httpx.Response(201)
+
+    def _cost(self, sql: str) -> float:
+        """
+        Rough stand-in for Postgres' planner cost: the rows of the largest table to the power
+        of the full scans nested in one loop, so a cross join costs rows squared
+        """
+        plan = self.db.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        rows = max(
+            self.db.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+            for (name,) in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        )
+        materialized = {detail.split()[-1] for _, _, _, detail in plan if detail.startswith(("MATERIALIZE", "CO-ROUTINE"))}
+        scans: Dict[int, int] = {}
+        for _, parent, _, detail in plan:
+            if detail.startswith("SCAN ") and detail.split()[1] not in materialized:
+                scans[parent] = scans.get(parent, 0) + 1
+        return float(sum(max(rows, 1) ** count for count in scans.values()) or 1)
+
+    def _query(self, sql: str) -> List[Dict[str, Any]]:
+        cursor = self.db.execute(sql)
+        names = [self._column_name(d[0]) for d in cursor.description or []]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def install(main_module, anthropic: FakeAnthropic, postgrest: FakePostgrest) -> None:
+    """Point a freshly imported main's services at the stand-ins"""
+    main_module.claude_service.client = anthropic
+    main_module.query_service.client = httpx.AsyncClient(
+        transport=postgrest.transport(), base_url="http://postgrest.local/rest/v1"
+    )
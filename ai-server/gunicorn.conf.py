@@ -0,0 +1,21 @@
+# Multi-worker deployment: gunicorn -c gunicorn.conf.py main:app
+#
+# The master imports main.py and its heavy libraries once (preload_app, main.preload)
+# and forks the workers from it, so each starts with them already imported. Clients,
+# connections and render processes are never created before the fork; every worker
+# creates its own in its startup warm-up and only then accepts connections.
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Worker startup includes the warm-up: render processes, model API connection, table catalog
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    import main
+    main.preload()
@@ -0,0 +1,9 @@
+-- Roles and extensions that Supabase provides out of the box
+
+create extension if not exists "uuid-ossp";
+
+create role anon nologin;
+grant usage on schema public to anon;
+
+-- Lead tables are created later by create_leads_table (owned by postgres)
+alter default privileges in schema public grant select, insert, update, delete on tables to anon;
@@ -1,21 +1,108 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Dict, Any, Literal
+from typing import AsyncIterator, List, Dict, Any, Literal, Tuple
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import importlib
+import ipaddress
+import json
+import logging
 import os
+import time
 from dotenv import load_dotenv
 
-from services.claude_service import ClaudeService
+from services.admission import CapacityPool, Overloaded
+from services.claude_service import DEFAULT_MODEL, FAST_MODEL, ClaudeService
+from services.structured_output import StructuredOutputError
+from services.intent_rules import RuleClassifier
 from services.query_service import QueryService
-from services.validation_service import ValidationService
-from services.graph_service import GraphService
+from services.validation_service import UnsafeQuery, ValidationService
+from services.graph_service import GraphService, RenderUnavailable
+from services.graph_store import CachedStaticFiles, GraphStore
+from services.ingest_service import CsvIngestor, IngestError
+from services.result_compactor import ResultCompactor
+from services.local_engine import LocalEngine, LocalUnsupported
+from services.rollups import RollupStore
+from services.session_store import SessionStore
+from services.table_catalog import TableCatalog
+from services.cache_service import AnswerCache, MISSING, cache_key, normalize_question
+from services.singleflight import SingleFlight
+from services.telemetry import registry, result_rows, tracer
 
 load_dotenv()
 
-app = FastAPI(title="Lead Analytics AI API")
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger("ai-server")
+# httpx logs every request at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+# Clients, connections and worker processes are created lazily; warm_up() creates them before readiness
+warm_state: Dict[str, Any] = {"ready": False, "warmed": False, "steps_ms": {}}
+
+
+def preload() -> None:
+    """
+    Import the heavy libraries without opening clients, connections or processes, so it
+    is safe before a fork: the gunicorn master calls it (gunicorn.conf.py) and every
+    worker starts with them imported.
+    """
+    claude_service.preload()
+    importlib.import_module("services.fast_chart")
+
 
-app = FastAPI(title="Lead Analytics AI API")
+async def warm_up() -> None:
+    """
+    Everything the first request would otherwise pay for, concurrently: the render workers
+    (matplotlib, fonts and a throwaway chart), the model SDK with a pooled API connection,
+    and the table catalog over a pooled PostgREST connection. A failed step only logs.
+    """
+    async def step(name: str, coro) -> None:
+        start = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e)
+        warm_state["steps_ms"][name] = round((time.perf_counter() - start) * 1000, 1)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        step("render_workers", graph_service.warm_up()),
+        step("llm_client", claude_service.warm_up()),
+        step("catalog", table_catalog.refresh())
+    )
+    warm_state["warmed"] = True
+    warm_state["steps_ms"]["total"] = round((time.perf_counter() - start) * 1000, 1)
+    logger.info("Warmed up in %.0fms: %s", warm_state["steps_ms"]["total"], warm_state["steps_ms"])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Uvicorn takes traffic only once startup completes, so the first request finds everything warm
+    if WARM_UP:
+        await warm_up()
+    warm_state["ready"] = True
+    background = [asyncio.create_task(graph_store.run_sweeper())]
+    if local_engine is not None:
+        background.append(asyncio.create_task(local_engine.run_sync_loop()))
+    if rollup_store is not None:
+        background.append(asyncio.create_task(rollup_store.run_sync_loop()))
+    yield
+    warm_state["ready"] = False
+    for task in background:
+        task.cancel()
+    # Release pooled connections on shutdown
+    await claude_service.aclose()
+    await query_service.aclose()
+    graph_service.shutdown()
+
+
+app = FastAPI(title="Lead Analytics AI API", lifespan=lifespan)
 
 # CORS for your Vite dev server
 app.add_middleware(
@@ -26,17 +113,116 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Mount static files; content-addressed charts are served as immutable with a hash ETag
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 # Initialize services
-claude_service = ClaudeService(os.getenv("ANTHROPIC_API_KEY"))
+claude_service = ClaudeService(
+    os.getenv("ANTHROPIC_API_KEY"),
+    max_concurrency=int(os.getenv("CLAUDE_MAX_CONCURRENCY", "16")),
+    timeout=float(os.getenv("CLAUDE_TIMEOUT_SECONDS", "60")),
+    max_retries=int(os.getenv("CLAUDE_MAX_RETRIES", "3")),
+    rules=RuleClassifier() if os.getenv("INTENT_RULES", "true").lower() in ("1", "true", "yes") else None,
+    model=os.getenv("CLAUDE_MODEL", DEFAULT_MODEL),
+    fast_model=os.getenv("CLAUDE_FAST_MODEL", FAST_MODEL),
+    # "operation=model,..." e.g. "sql_generation=claude-haiku-4-5,analysis=claude-sonnet-4-20250514"
+    stage_models=dict(
+        pair.strip().split("=", 1) for pair in os.getenv("CLAUDE_STAGE_MODELS", "").split(",") if "=" in pair
+    ),
+    max_repairs=int(os.getenv("CLAUDE_MAX_REPAIRS", "1")),
+    # Model calls allowed to wait for a slot (0: no limit; calls still fail fast past their timeout)
+    max_queue=int(os.getenv("CLAUDE_MAX_QUEUE", "0")) or None,
+    # Input tokens per model call; query results and schema context are trimmed to fit (0: no budget)
+    max_input_tokens=int(os.getenv("CLAUDE_MAX_INPUT_TOKENS", "30000")) or None
+)
 query_service = QueryService(
     os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_KEY")
+    os.getenv("SUPABASE_KEY"),
+    rest_path=os.getenv("SUPABASE_REST_PATH", "/rest/v1"),
+    max_concurrency=int(os.getenv("QUERY_MAX_CONCURRENCY", "8")),
+    timeout=float(os.getenv("QUERY_TIMEOUT_SECONDS", "15"))
 )
-validation_service = ValidationService()
-graph_service = GraphService()
+table_catalog = TableCatalog(
+    query_service,
+    ttl=float(os.getenv("CATALOG_TTL_SECONDS", "60"))
+)
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "1000")),
+    max_bytes=int(float(os.getenv("CACHE_MAX_MB", "64")) * 1024 * 1024),
+    cache_dir=os.getenv("CACHE_DIR") or None
+)
+# Optional in-process SQLite mirror of the lead tables; queries it can't run go to Supabase
+local_engine = LocalEngine(
+    query_service,
+    table_catalog,
+    max_table_rows=int(os.getenv("LOCAL_ENGINE_MAX_ROWS", "200000")),
+    sync_interval=float(os.getenv("LOCAL_ENGINE_SYNC_SECONDS", "30"))
+) if os.getenv("LOCAL_ENGINE", "false").lower() in ("1", "true", "yes") else None
+# Count cubes per upload that answer group-by-and-count queries without SQL
+rollup_store = RollupStore(
+    query_service,
+    table_catalog,
+    sync_interval=float(os.getenv("ROLLUPS_SYNC_SECONDS", "30"))
+) if os.getenv("ROLLUPS", "true").lower() in ("1", "true", "yes") else None
+# Generated SQL: outer LIMIT ceiling, and the EXPLAIN cost budget (0: no budget)
+validation_service = ValidationService(
+    max_rows=int(os.getenv("SQL_MAX_ROWS", "10000")),
+    max_cost=float(os.getenv("SQL_MAX_COST", "1000000")) or None
+)
+# /upload: rows per insert, and inserts in flight per upload before reading the body pauses
+ingestor = CsvIngestor(
+    query_service,
+    batch_size=int(os.getenv("UPLOAD_BATCH_ROWS", "1000")),
+    max_in_flight=int(os.getenv("UPLOAD_MAX_IN_FLIGHT", "4"))
+)
+result_compactor = ResultCompactor(
+    max_rows=int(os.getenv("RESULT_MAX_ROWS", "50")),
+    max_cell_chars=int(os.getenv("RESULT_MAX_CELL_CHARS", "200")),
+    top_k=int(os.getenv("RESULT_TOP_K", "5"))
+)
+# Follow-up questions (requests with a session_id): conversations kept, memory for their results,
+# turns kept per conversation, and how long an idle conversation is kept
+session_store = SessionStore(
+    max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "1000")),
+    max_bytes=int(float(os.getenv("SESSION_MAX_MB", "64")) * 1024 * 1024),
+    max_turns=int(os.getenv("SESSION_MAX_TURNS", "5")),
+    ttl=float(os.getenv("SESSION_TTL_SECONDS", "1800")),
+    max_result_rows=validation_service.max_rows
+) if os.getenv("SESSIONS", "true").lower() in ("1", "true", "yes") else None
+analysis_flight = SingleFlight("analyze")
+# Admission for /analyze, /analyze/stream and /analyze/batch: analyses running at once, how many may wait
+# and for how long, and the slots one client may hold or wait for; past that, 429/503 with Retry-After
+admission = CapacityPool(
+    "analyze",
+    int(os.getenv("ANALYZE_MAX_CONCURRENCY", "32")),
+    max_queue=int(os.getenv("ANALYZE_MAX_QUEUE", "64")),
+    max_wait=float(os.getenv("ANALYZE_MAX_WAIT_SECONDS", "10")),
+    per_key=int(os.getenv("ANALYZE_MAX_PER_CLIENT", "8")) or None
+)
+# Peers whose X-Real-IP / X-Forwarded-For name the client (nginx); anyone else is keyed on its own address
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in os.getenv("TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if entry.strip()
+]
+# /analyze/batch: questions per request, and questions analysed or rendered at once across all batches
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "100"))
+batch_semaphore = asyncio.Semaphore(int(os.getenv("BATCH_CONCURRENCY", "8")))
+# Requests slower than this log their full stage timeline (unset: off)
+tracer.slow_request_ms = float(os.getenv("SLOW_REQUEST_MS")) if os.getenv("SLOW_REQUEST_MS") else None
+graph_store = GraphStore(
+    "static/images",
+    max_bytes=int(float(os.getenv("GRAPH_CACHE_MAX_MB", "512")) * 1024 * 1024),
+    max_age=float(os.getenv("GRAPH_CACHE_MAX_AGE_HOURS", "168")) * 3600,
+    sweep_interval=float(os.getenv("GRAPH_SWEEP_INTERVAL_SECONDS", "600"))
+)
+graph_service = GraphService(
+    workers=int(os.getenv("GRAPH_WORKERS", "2")),
+    max_queue=int(os.getenv("GRAPH_MAX_QUEUE", "32")),
+    render_timeout=float(os.getenv("GRAPH_TIMEOUT_SECONDS", "30")),
+    store=graph_store
+)
+# Create clients, connections and render workers at startup rather than on the first request
+WARM_UP = os.getenv("WARM_UP", "true").lower() in ("1", "true", "yes")
 
 
 class AnalysisRequest(BaseModel):
@@ -44,9 +230,14 @@ class AnalysisRequest(BaseModel):
     table_name: str
     include_graph: bool = False 
     graph_type: str = "auto"
-    graph_engine: Literal["matplotlib"] = "matplotlib"
+    graph_engine: Literal["matplotlib", "fast"] = "matplotlib"
     image_width: int = 800
     image_height: int = 600
+    # "sequential": one model call per step, "planner": intent + graph + SQL in one call,
+    # "parallel": the three independent calls run concurrently
+    planner_mode: Literal["sequential", "planner", "parallel"] = "planner"
+    # Set by a client that asks follow-up questions; their queries may reuse this conversation's results
+    session_id: str | None = None
 
 
 class StatisticResult(BaseModel):
@@ -56,15 +247,504 @@ class StatisticResult(BaseModel):
     breakdown: Dict[str, Any] | None = None
 
 
+class QueryErrorDetail(BaseModel):
+    sql: str
+    error: str
+
+
+class QueryRewrite(BaseModel):
+    original_sql: str
+    sql: str  # what ran
+    rewrites: List[str]
+
+
+class SessionInfo(BaseModel):
+    session_id: str
+    turn: int
+    reused: int  # queries answered from the conversation's earlier results, without the database
+    saved_ms: float  # estimated database time those saved
+
+
 class AnalysisResponse(BaseModel):
     summary: str
     statistics: List[StatisticResult]
     graph_url: str | None = None
     sql_queries: List[str]
     graph_type: str | None = None
+    planner_mode: str | None = None
+    query_errors: List[QueryErrorDetail] | None = None  # queries that failed; the analysis uses the rest
+    query_rewrites: List[QueryRewrite] | None = None  # queries the SQL governor changed before running them
+    cache_hits: List[str] | None = None  # cache layers that answered: plan, session, results, analysis
+    timings: Dict[str, float] | None = None  # milliseconds per pipeline stage
+    session: SessionInfo | None = None
+
+
+class StageTimer:
+    """Collects wall-clock milliseconds per pipeline stage, and traces each stage as a span"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        stage_start = time.perf_counter()
+        try:
+            with tracer.span("stage", name) as span:
+                yield span
+        finally:
+            self.timings[name] = round((time.perf_counter() - stage_start) * 1000, 2)
+
+    def add(self, name: str, ms: float) -> None:
+        self.timings[name] = round(ms, 2)
+        # Sub-timings of a traced stage; their calls already have spans of their own
+        tracer.record("stage", name, ms, timeline=False)
+
+    def finish(self) -> Dict[str, float]:
+        self.timings["total"] = round((time.perf_counter() - self.start) * 1000, 2)
+        return self.timings
+
+
+async def execute_queries(
+    queries: List[Dict[str, Any]],
+    table_name: str,
+    version: str,
+    timer: StageTimer,
+    cache_hits: List[str],
+    session: Dict[str, Any] | None = None
+) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Run a plan's queries through the cheapest tier that can answer each one: the
+    conversation's earlier results, the result cache, the rollups, the local engine,
+    then Supabase (concurrently).
+    Yields (index, {"query", "data", "error", "elapsed_ms"}) as each query finishes.
+
+    With session ({"session_id", "reused", "saved_ms"}), a query that reads earlier
+    results runs on them in-process; if it can't, the later tiers get it with those
+    results' SQL inlined. reused and saved_ms are added to.
+    """
+    originals = queries
+    reused = set()
+    if session is not None and session_store is not None \
+            and session_store.results(session['session_id'], table_name, version):
+        queries = list(queries)
+        with timer.stage("session"):
+            for i, query in enumerate(originals):
+                if not session_store.references(session['session_id'], table_name, version, query['sql']):
+                    session_store.count("sql")
+                    continue
+                start = time.perf_counter()
+                rows = await session_store.answer(session['session_id'], table_name, version, query['sql'])
+                if rows is None:
+                    queries[i] = {
+                        **query, 'sql': session_store.inline(session['session_id'], table_name, version, query['sql'])
+                    }
+                    session_store.count("inlined")
+                    continue
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                session['reused'] += 1
+                session['saved_ms'] += session_store.count("local", elapsed_ms)
+                result_rows.observe(len(rows), source="session")
+                reused.add(i)
+                yield i, {'query': query, 'data': rows, 'error': None, 'elapsed_ms': round(elapsed_ms, 2)}
+        if reused:
+            cache_hits.append("session")
 
+    pending = []
+    cached = False
+    for i, query in enumerate(queries):
+        if i in reused:
+            continue
+        rows = answer_cache.results.get(answer_cache.result_key(query['sql'], table_name, version))
+        if rows is MISSING:
+            pending.append(i)
+        else:
+            cached = True
+            yield i, {'query': originals[i], 'data': rows, 'error': None, 'elapsed_ms': 0.0}
+    if cached:
+        cache_hits.append("results")
+    if rollup_store is not None and pending:
+        # Group-by-and-count queries are answered from the upload's precomputed cubes
+        with timer.stage("rollups"):
+            answered = len(pending)
+            for i in list(pending):
+                start = time.perf_counter()
+                rows = rollup_store.answer(queries[i]['sql'], table_name, version)
+                if rows is None:
+                    continue
+                result_rows.observe(len(rows), source="rollups")
+                pending.remove(i)
+                yield i, {
+                    'query': originals[i],
+                    'data': rows,
+                    'error': None,
+                    'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+                }
+        if len(pending) < answered:
+            cache_hits.append("rollups")
+    if local_engine is not None and pending:
+        with timer.stage("local_execution"):
+            for i in list(pending):
+                start = time.perf_counter()
+                try:
+                    rows = await local_engine.execute(queries[i]['sql'], table_name, version)
+                except LocalUnsupported as e:
+                    logger.debug("Local engine fallback: %s", e)
+                    continue
+                result_rows.observe(len(rows), source="local")
+                pending.remove(i)
+                yield i, {
+                    'query': originals[i],
+                    'data': rows,
+                    'error': None,
+                    'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+                }
+    if pending:
+        with timer.stage("execution"):
+            async for j, result in query_service.iter_many(
+                [queries[i] for i in pending], max_cost=validation_service.max_cost
+            ):
+                if result['error'] is None:
+                    answer_cache.results.set(
+                        answer_cache.result_key(result['query']['sql'], table_name, version),
+                        result['data'],
+                        tag=table_name
+                    )
+                    if session_store is not None:
+                        session_store.observe_remote(result['elapsed_ms'])
+                yield pending[j], {**result, 'query': originals[pending[j]]}
 
 
+async def analyse_results(
+    query_results: List[Dict[str, Any]],
+    graph_type: str,
+    include_graph: bool,
+    table_name: str,
+    version: str,
+    timer: StageTimer,
+    cache_hits: List[str],
+    stream_summary: bool = False
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Compact the results and analyse them, reusing a previous analysis of the identical result set.
+    Yields ("summary_delta", text) while streaming, then ("analysis", dict).
+    """
+    # Cap rows and summarise columns so large results don't blow up the prompt, within the model's input budget
+    table_overview = rollup_store.overview(table_name, version) if rollup_store is not None else None
+    with timer.stage("compaction") as span:
+        query_results, compaction = result_compactor.compact(
+            query_results, max_tokens=claude_service.results_budget(include_graph, table_overview)
+        )
+        span.update(compaction)
+    analysis_key = answer_cache.analysis_key(
+        query_results,
+        graph_type=graph_type,
+        include_graph=include_graph,
+        table_overview=table_overview
+    )
+    cached_analysis = answer_cache.analyses.get(analysis_key)
+    if cached_analysis is not MISSING:
+        analysis = cached_analysis['analysis']
+        cache_hits.append("analysis")
+        if stream_summary:
+            yield "summary_delta", analysis['summary']
+    elif stream_summary:
+        with timer.stage("analysis"):
+            async for kind, payload in claude_service.stream_analysis(
+                query_results=query_results,
+                graph_type=graph_type,
+                include_graph=include_graph,
+                table_overview=table_overview
+            ):
+                if kind == "summary_delta":
+                    yield "summary_delta", payload
+                else:
+                    analysis = payload
+    else:
+        with timer.stage("analysis"):
+            analysis = await claude_service.generate_analysis(
+                query_results=query_results,
+                graph_type=graph_type,
+                include_graph=include_graph,
+                table_overview=table_overview
+            )
+    if cached_analysis is MISSING:
+        answer_cache.analyses.set(analysis_key, {'analysis': analysis}, tag=table_name)
+    yield "analysis", analysis
+
+
+async def render_graph(
+    analysis: Dict[str, Any],
+    graph_type: str,
+    request: "AnalysisRequest | BatchAnalysisRequest",
+    base_url: str,
+    timer: StageTimer
+) -> str | None:
+    """
+    Render the analysis' chart and return its URL, or None when the render pool can't take it.
+    Images are content-addressed, so an identical chart is served from disk without rendering.
+    """
+    try:
+        with timer.stage("render"):
+            filename = await graph_service.render(
+                graph_data=analysis['graph_data'],
+                graph_type=graph_type,
+                engine=request.graph_engine,
+                width=request.image_width,
+                height=request.image_height
+            )
+    except RenderUnavailable as e:
+        # The summary and statistics are still worth returning without the chart
+        logger.warning("Graph skipped: %s", e)
+        return None
+    return f"{base_url}static/images/{filename}"
+
+
+async def analysis_events(
+    request: AnalysisRequest,
+    base_url: str,
+    stream_summary: bool = False
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    The /analyze pipeline: plan, validate, execute, analyse and render.
+
+    Yields (event, payload) as each stage completes: intent, graph_decision, sql,
+    query_result (one per query, in completion order), summary_delta (only with
+    stream_summary), analysis, graph, and finally result with the AnalysisResponse.
+    """
+    timer = StageTimer()
+
+    # Step 1: Look up the table in the in-process catalog (a dict read unless the catalog is stale)
+    with timer.stage("table_validation"):
+        table_info = await table_catalog.get(request.table_name)
+    schema = table_catalog.schema_context(request.table_name)
+    # A follow-up question sees the conversation's earlier results; its plan then depends on them, so isn't cached
+    session = None
+    session_context = None
+    if request.session_id and session_store is not None and table_info is not None:
+        session = {"session_id": request.session_id, "reused": 0, "saved_ms": 0.0}
+        session_context = session_store.schema_context(request.session_id, request.table_name, table_info['version'])
+        if session_context:
+            schema = f"{schema or f'Table {request.table_name}'}\n{session_context}"
+
+    # Answers are cached per upload version, so a new upload never sees stale plans or rows
+    cache_hits = []
+    plan = None
+    plan_key = None
+    if table_info is not None and session_context is None:
+        plan_key = answer_cache.plan_key(request.question, request.table_name, table_info['version'])
+        cached_plan = answer_cache.plans.get(plan_key)
+        if cached_plan is not MISSING:
+            plan = cached_plan
+            cache_hits.append("plan")
+
+    if plan is not None:
+        intent = plan["intent"]
+    elif request.planner_mode == "sequential":
+        # Check intent - skip analysis if just chat
+        with timer.stage("intent"):
+            intent = await claude_service.classify_intent(request.question)
+    else:
+        # Intent, graph decision and SQL only depend on the question, so plan them together
+        with timer.stage("plan"):
+            plan = await claude_service.plan_analysis(
+                question=request.question,
+                table_name=request.table_name,
+                mode=request.planner_mode,
+                schema=schema
+            )
+        for name, ms in plan.pop("timings").items():
+            timer.add(f"plan.{name}", ms)
+        plan.pop("mode")
+        intent = plan["intent"]
+    logger.debug("Intent classified as: %s", intent['classification'])
+    yield "intent", intent
+    
+    if intent['classification'] == 'chat':
+        if plan_key and "plan" not in cache_hits:
+            answer_cache.plans.set(
+                plan_key,
+                {"intent": intent, "graph_decision": None, "queries": []},
+                tag=request.table_name
+            )
+        yield "result", AnalysisResponse(
+            summary=intent['response'],
+            statistics=[],
+            sql_queries=[],
+            graph_url=None,
+            planner_mode=request.planner_mode,
+            cache_hits=cache_hits or None,
+            timings=timer.finish()
+        )
+        return
+
+    if table_info is None:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Table {request.table_name} not found"
+        )
+
+    # Step 1.5: Auto-detect if graph should be generated (if not explicitly set)
+    # should_include_graph = request.include_graph
+    graph_type_to_use = request.graph_type
+
+    # if request.include_graph is None:  # Auto-detect mode
+    if plan is not None:
+        graph_decision = plan["graph_decision"]
+    else:
+        with timer.stage("graph_decision"):
+            graph_decision = await claude_service.should_generate_graph(request.question)
+    should_include_graph = graph_decision['include_graph']
+    if graph_decision['graph_type'] != 'none':
+        graph_type_to_use = graph_decision['graph_type']
+
+    logger.debug(
+        "Graph decision: %s %s (%s)",
+        graph_decision['include_graph'], graph_decision['graph_type'], graph_decision['reasoning']
+    )
+    yield "graph_decision", graph_decision
+
+    # Step 2: Generate SQL queries
+    if plan is not None:
+        queries = plan["queries"]
+    else:
+        with timer.stage("sql_generation"):
+            queries = await claude_service.generate_queries(
+                question=request.question,
+                table_name=request.table_name,
+                schema=schema
+            )
+    
+    # Step 3: Validate queries and bound them (row limit, this table only); the plan cache keeps the originals
+    extra_tables = frozenset(
+        session_store.results(request.session_id, request.table_name, table_info['version'])
+    ) if session_context else frozenset()
+    with timer.stage("validation"):
+        try:
+            governed = [validation_service.govern(q['sql'], request.table_name, extra_tables) for q in queries]
+        except UnsafeQuery as e:
+            raise HTTPException(status_code=400, detail=f"Unsafe query detected: {e}")
+    query_rewrites = [QueryRewrite(**g) for g in governed if g['rewrites']]
+    runnable = [{**q, 'sql': g['sql']} for q, g in zip(queries, governed)]
+    yield "sql", {"queries": runnable, "rewrites": [r.model_dump() for r in query_rewrites]}
+    
+    # Step 4: Execute queries concurrently, skipping any whose rows are cached;
+    # failures are reported, not fatal
+    version = table_info['version']
+    executed = [None] * len(runnable)
+    async for i, result in execute_queries(runnable, request.table_name, version, timer, cache_hits, session):
+        executed[i] = result
+        yield "query_result", {'index': i, **result}
+    query_results = [
+        {'query': r['query'], 'data': r['data']} for r in executed if r['error'] is None
+    ]
+    query_errors = [
+        QueryErrorDetail(sql=r['query']['sql'], error=r['error']) for r in executed if r['error'] is not None
+    ]
+    if queries and not query_results:
+        raise HTTPException(
+            status_code=502,
+            detail=f"All queries failed: {query_errors[0].error}"
+        )
+    if plan_key and "plan" not in cache_hits:
+        answer_cache.plans.set(
+            plan_key,
+            {"intent": intent, "graph_decision": graph_decision, "queries": queries},
+            tag=request.table_name
+        )
+    
+    # Steps 4.5 and 5: compact the rows, then generate statistics (always) and graph data (conditional)
+    include_render = should_include_graph and graph_type_to_use != 'none'
+    async for kind, payload in analyse_results(
+        query_results, graph_type_to_use, should_include_graph,
+        request.table_name, version, timer, cache_hits, stream_summary=stream_summary
+    ):
+        if kind == "summary_delta":
+            yield "summary_delta", {"text": payload}
+        else:
+            analysis = payload
+    yield "analysis", {"summary": analysis['summary'], "statistics": analysis['statistics']}
+    
+    # Step 6: Generate graph file ONLY if requested.
+    # Images are content-addressed, so an identical chart is served from disk without rendering
+    graph_url = None
+    if include_render:
+        graph_url = await render_graph(analysis, graph_type_to_use, request, base_url, timer)
+        if graph_url:
+            yield "graph", {"graph_url": graph_url, "graph_type": graph_type_to_use}
+    
+    session_info = None
+    if session is not None:
+        # Keep this turn's results for the next question, with their SQL self-contained;
+        # only now, so a turn that failed (all queries, the analysis) is never reused
+        turn = session_store.record(request.session_id, request.question, request.table_name, version, [
+            {
+                'sql': session_store.inline(request.session_id, request.table_name, version, r['query']['sql']),
+                'data': r['data'] if r['error'] is None else None
+            }
+            for r in executed
+        ])
+        session_info = SessionInfo(
+            session_id=request.session_id,
+            turn=turn,
+            reused=session['reused'],
+            saved_ms=round(session['saved_ms'], 1)
+        )
+
+    yield "result", AnalysisResponse(
+        summary=analysis['summary'],
+        statistics=analysis['statistics'],
+        graph_url=graph_url,  # Will be None if not requested
+        sql_queries=[q['sql'] for q in runnable],
+        graph_type=graph_type_to_use,  # Will be None if not requested
+        planner_mode=request.planner_mode,
+        query_errors=query_errors or None,
+        query_rewrites=query_rewrites or None,
+        cache_hits=cache_hits or None,
+        timings=timer.finish(),
+        session=session_info
+    )
+
+
+def trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_key(raw_request: Request) -> str:
+    """
+    The client an admission slot is charged to. Forwarding headers are client-supplied, so
+    they count only when the peer is a trusted proxy: then X-Real-IP, else the nearest
+    X-Forwarded-For address that isn't a trusted proxy itself. Otherwise the peer's address.
+    """
+    peer = raw_request.client.host if raw_request.client else "unknown"
+    if not trusted_proxy(peer):
+        return peer
+    real_ip = raw_request.headers.get("x-real-ip", "").strip()
+    if real_ip:
+        return real_ip
+    forwarded = [a.strip() for a in raw_request.headers.get("x-forwarded-for", "").split(",") if a.strip()]
+    for address in reversed(forwarded):
+        if not trusted_proxy(address):
+            return address
+    return forwarded[0] if forwarded else peer
+
+
+def overloaded_error(e: Overloaded) -> HTTPException:
+    """429 or 503 with Retry-After, for work a capacity pool turned away"""
+    logger.info("Shed load: %s pool, %s: %s", e.pool, e.reason, e)
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+async def run_analysis(request: AnalysisRequest, base_url: str) -> AnalysisResponse:
+    """Run the pipeline to completion and return only the final response"""
+    async for event, payload in analysis_events(request, base_url):
+        if event == "result":
+            return payload
+
 
 @app.post("/analyze", response_model=AnalysisResponse)
 @app.post("/api/analyze", response_model=AnalysisResponse)
@@ -80,100 +760,558 @@ async def analyze_leads(request: AnalysisRequest, raw_request: Request):
                 graph_url=None
             )
 
-        # Check intent - skip analysis if just chat
-        intent = await claude_service.classify_intent(request.question)
-        print(f"Intent classified as: {intent['classification']}")
-        
-        if intent['classification'] == 'chat':
-            return AnalysisResponse(
-                summary=intent['response'],
-                statistics=[],
-                sql_queries=[],
-                graph_url=None
-            )
-
-        # Step 1: Validate table exists
-        available_tables = query_service.get_available_tables()
-        if request.table_name not in available_tables:
-            raise HTTPException(
-                status_code=404, 
-                detail=f"Table {request.table_name} not found"
-            )
-        
-        print("Table exists")
-        # Step 1.5: Auto-detect if graph should be generated (if not explicitly set)
-        # should_include_graph = request.include_graph
-        graph_type_to_use = request.graph_type
-        # print("Graph auto-detect: ", request.include_graph)
-        # print("Graph type: ", request.graph_type)
-
-        # if request.include_graph is None:  # Auto-detect mode
-        graph_decision = await claude_service.should_generate_graph(request.question)
-        should_include_graph = graph_decision['include_graph']
-        if graph_decision['graph_type'] != 'none':
-            graph_type_to_use = graph_decision['graph_type']
-
-        print("Graph auto-decision: ", graph_decision['include_graph'], graph_decision['graph_type'])
-        print("Reasoning: ", graph_decision['reasoning'])
-
-        # Step 2: Generate SQL queries
-        queries = await claude_service.generate_queries(
-            question=request.question,
-            table_name=request.table_name
-        )
-        
-        # Step 3: Validate queries
-        for query in queries:
-            if not validation_service.is_safe_query(query['sql']):
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Unsafe query detected"
-                )
-        
-        # Step 4: Execute queries
-        query_results = []
-        for query in queries:
-            result = query_service.execute_query(query['sql'])
-            query_results.append({
-                'query': query,
-                'data': result
-            })
-        
-        # Step 5: Generate statistics (always) and graph data (conditional)
-        analysis = await claude_service.generate_analysis(
-            query_results=query_results,
-            graph_type=graph_type_to_use,
-            include_graph=should_include_graph
+        # Identical requests arriving while one is running attach to it and share its result
+        base_url = str(raw_request.base_url)
+        key = cache_key(
+            normalize_question(request.question),
+            request.model_dump(exclude={"question"}),
+            base_url
         )
-        
-        # Step 6: Generate graph file ONLY if requested
-        graph_url = None
-        if should_include_graph and graph_type_to_use != 'none':
-            filename = graph_service.generate_graph_file(
-                graph_data=analysis['graph_data'],
-                graph_type=graph_type_to_use,
-                engine=request.graph_engine,
-                width=request.image_width,
-                height=request.image_height
-            )
-            graph_url = f"{str(raw_request.base_url)}static/images/{filename}"
-        
-        return AnalysisResponse(
-            summary=analysis['summary'],
-            statistics=analysis['statistics'],
-            graph_url=graph_url,  # Will be None if not requested
-            sql_queries=[q['sql'] for q in queries],
-            graph_type=graph_type_to_use  # Will be None if not requested
-        )
-        
+        async def admitted() -> AnalysisResponse:
+            # Only the request that does the work takes a slot; identical ones wait on its result
+            async with admission.slot(client_key(raw_request)):
+                return await run_analysis(request, base_url)
+
+        with tracer.trace("analyze", table=request.table_name, planner_mode=request.planner_mode):
+            return await analysis_flight.do(key, admitted)
+
     except HTTPException:
         raise
+    except Overloaded as e:
+        raise overloaded_error(e)
+    except StructuredOutputError as e:
+        # The model's answer was still malformed after the repair attempts
+        logger.warning("Analysis failed: %s", e)
+        raise HTTPException(status_code=502, detail=f"Model answer unusable: {e}")
     except Exception as e:
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Analysis failed")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def sse_event(event: str, payload: Any) -> str:
+    """Format one server-sent event"""
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump()
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    A streaming response that holds an admission slot for its whole lifetime. The slot is
+    released when the response ends however it ends, including a client that disconnects
+    before the body starts, when the generator's own finally would never run.
+    """
+
+    def __init__(self, content, key: str, started: float | None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.key = key
+        self.started = started
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.started is not None:
+                started, self.started = self.started, None
+                admission.release(self.key, started)
+
+
+@app.post("/analyze/stream")
+@app.post("/api/analyze/stream")
+async def analyze_leads_stream(request: AnalysisRequest, raw_request: Request):
+    """
+    Streaming variant of /analyze: sends server-sent events as each stage completes,
+    including the summary as the model writes it. If the client disconnects, the
+    response task is cancelled, which cancels the outstanding model and database calls.
+    """
+    base_url = str(raw_request.base_url)
+    ping = request.question.strip().lower() == "ping"
+    # Admitted before the response starts, so an overloaded server answers with a plain 429/503
+    key = client_key(raw_request)
+    try:
+        started = None if ping else await admission.acquire(key)
+    except Overloaded as e:
+        raise overloaded_error(e)
+
+    async def events():
+        if ping:
+            yield sse_event("result", AnalysisResponse(summary="Pong", statistics=[], sql_queries=[]))
+            return
+        with tracer.trace("analyze_stream", table=request.table_name, planner_mode=request.planner_mode) as trace:
+            try:
+                async for event, payload in analysis_events(request, base_url, stream_summary=True):
+                    yield sse_event(event, payload)
+            except HTTPException as e:
+                trace.status = e.status_code
+                yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+            except Overloaded as e:
+                trace.status = e.status_code
+                yield sse_event("error", {"status_code": e.status_code, "detail": str(e), "retry_after": e.retry_after})
+            except StructuredOutputError as e:
+                trace.status = 502
+                logger.warning("Streaming analysis failed: %s", e)
+                yield sse_event("error", {"status_code": 502, "detail": f"Model answer unusable: {e}"})
+            except Exception as e:
+                trace.status = 500
+                logger.exception("Streaming analysis failed")
+                yield sse_event("error", {"status_code": 500, "detail": str(e)})
+
+    return AdmittedStreamingResponse(
+        events(),
+        key,
+        started,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+class BatchAnalysisRequest(BaseModel):
+    questions: List[str]
+    table_name: str
+    graph_engine: Literal["matplotlib", "fast"] = "matplotlib"
+    image_width: int = 800
+    image_height: int = 600
+
+
+class BatchItemError(BaseModel):
+    status_code: int
+    detail: str
+
+
+class BatchItemResult(BaseModel):
+    index: int  # position in the request's questions
+    question: str
+    result: AnalysisResponse | None = None
+    error: BatchItemError | None = None
+
+
+class BatchAnalysisResponse(BaseModel):
+    table_name: str
+    results: List[BatchItemResult]
+    queries_planned: int  # queries across all plans
+    queries_executed: int  # distinct SQL actually run
+    cache_hits: List[str] | None = None  # layers that answered queries for the batch: results, rollups
+    timings: Dict[str, float] | None = None  # batch-wide stages; each result has its own
+
+
+async def batch_events(request: BatchAnalysisRequest, base_url: str) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    The batch pipeline: validate the table once, plan all questions together, run each
+    distinct SQL once, then analyse and render the questions concurrently.
+    Repeated questions are answered once. Yields ("result", BatchItemResult) as each
+    question finishes, then ("done", summary).
+    """
+    if not request.questions or len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {BATCH_MAX_QUESTIONS} questions")
+    timer = StageTimer()
+    questions = request.questions
+
+    with timer.stage("table_validation"):
+        table_info = await table_catalog.get(request.table_name)
+    if table_info is None:
+        raise HTTPException(status_code=404, detail=f"Table {request.table_name} not found")
+    schema = table_catalog.schema_context(request.table_name)
+    version = table_info['version']
+
+    # Each distinct question is answered once, by the first of its copies
+    copies: Dict[str, List[int]] = {}
+    for i, question in enumerate(questions):
+        copies.setdefault(normalize_question(question), []).append(i)
+    firsts = [indexes[0] for indexes in copies.values()]
+    copies_of = {indexes[0]: indexes for indexes in copies.values()}
+
+    # Step 1: reuse cached plans, plan the rest in as few model calls as possible
+    plan_keys = {i: answer_cache.plan_key(questions[i], request.table_name, version) for i in firsts}
+    plans = {i: answer_cache.plans.get(plan_keys[i]) for i in firsts}
+    item_hits = {i: ["plan"] if plans[i] is not MISSING else [] for i in firsts}
+    todo = [i for i in firsts if plans[i] is MISSING]
+    if todo:
+        with timer.stage("plan"):
+            planned = await claude_service.plan_batch([questions[i] for i in todo], request.table_name, schema)
+        plans.update(zip(todo, planned))
+
+    # Step 2: validate, then collect the distinct SQL across questions
+    distinct: Dict[str, Dict[str, Any]] = {}
+    governed: Dict[int, List[Dict[str, Any]]] = {}
+    failed: Dict[int, BatchItemError] = {}
+    chats = []
+    queries_planned = 0
+    for i in firsts:
+        plan = plans[i]
+        if plan["intent"]["classification"] == "chat":
+            chats.append(i)
+            continue
+        try:
+            governed[i] = [validation_service.govern(q['sql'], request.table_name) for q in plan["queries"]]
+        except UnsafeQuery as e:
+            failed[i] = BatchItemError(status_code=400, detail=f"Unsafe query detected: {e}")
+            continue
+        queries_planned += len(plan["queries"]) * len(copies_of[i])
+        for query, g in zip(plan["queries"], governed[i]):
+            distinct.setdefault(sql_key(g['sql']), {**query, 'sql': g['sql']})
+
+    keys = list(distinct)
+    loop = asyncio.get_running_loop()
+    futures = {key: loop.create_future() for key in keys}
+    batch_hits: List[str] = []
+
+    async def run_queries():
+        try:
+            async for j, result in execute_queries(
+                [distinct[key] for key in keys], request.table_name, version, timer, batch_hits
+            ):
+                futures[keys[j]].set_result(result)
+        except Exception as e:
+            # The questions waiting on these rows report the failure
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+
+    def items(i: int, **fields) -> List[BatchItemResult]:
+        """The answer to question i, for it and each of its copies"""
+        return [BatchItemResult(index=j, question=questions[j], **fields) for j in copies_of[i]]
+
+    async def answer(i: int) -> List[BatchItemResult]:
+        plan = plans[i]
+        item_timer = StageTimer()
+        runnable = [{**q, 'sql': g['sql']} for q, g in zip(plan["queries"], governed[i])]
+        executed = []
+        for query in runnable:
+            result = await futures[sql_key(query['sql'])]
+            executed.append({**result, 'query': query})
+        query_results = [{'query': r['query'], 'data': r['data']} for r in executed if r['error'] is None]
+        query_errors = [
+            QueryErrorDetail(sql=r['query']['sql'], error=r['error']) for r in executed if r['error'] is not None
+        ]
+        if runnable and not query_results:
+            return items(i, error=BatchItemError(status_code=502, detail=f"All queries failed: {query_errors[0].error}"))
+        if "plan" not in item_hits[i]:
+            answer_cache.plans.set(plan_keys[i], plan, tag=request.table_name)
+
+        graph_decision = plan["graph_decision"]
+        # As in /analyze: the planner's chart type, or "auto" when it names none; include_graph decides
+        graph_type = graph_decision['graph_type'] if graph_decision['graph_type'] != 'none' else "auto"
+        # Analyses and renders share the model semaphore and the render pool with /analyze;
+        # the batch limit keeps batches from filling the render queue on their own
+        async with batch_semaphore:
+            async for kind, payload in analyse_results(
+                query_results, graph_type, graph_decision['include_graph'],
+                request.table_name, version, item_timer, item_hits[i]
+            ):
+                analysis = payload
+            graph_url = None
+            if graph_decision['include_graph']:
+                graph_url = await render_graph(analysis, graph_type, request, base_url, item_timer)
+        return items(i, result=AnalysisResponse(
+            summary=analysis['summary'],
+            statistics=analysis['statistics'],
+            graph_url=graph_url,
+            sql_queries=[q['sql'] for q in runnable],
+            graph_type=graph_type,
+            planner_mode="batch",
+            query_errors=query_errors or None,
+            query_rewrites=[QueryRewrite(**g) for g in governed[i] if g['rewrites']] or None,
+            cache_hits=item_hits[i] or None,
+            timings=item_timer.finish()
+        ))
+
+    async def guarded(i: int) -> List[BatchItemResult]:
+        """One question's failure is reported in its result, not raised for the batch"""
+        try:
+            return await answer(i)
+        except HTTPException as e:
+            return items(i, error=BatchItemError(status_code=e.status_code, detail=str(e.detail)))
+        except StructuredOutputError as e:
+            return items(i, error=BatchItemError(status_code=502, detail=f"Model answer unusable: {e}"))
+        except Overloaded as e:
+            return items(i, error=BatchItemError(status_code=e.status_code, detail=str(e)))
+        except Exception as e:
+            logger.exception("Batch question %d failed", i)
+            return items(i, error=BatchItemError(status_code=500, detail=str(e)))
+
+    for i, error in failed.items():
+        for result in items(i, error=error):
+            yield "result", result
+    for i in chats:
+        if "plan" not in item_hits[i]:
+            answer_cache.plans.set(plan_keys[i], plans[i], tag=request.table_name)
+        for result in items(i, result=AnalysisResponse(
+            summary=plans[i]["intent"]["response"],
+            statistics=[],
+            sql_queries=[],
+            planner_mode="batch",
+            cache_hits=item_hits[i] or None
+        )):
+            yield "result", result
+
+    # Step 3: run the queries once, and answer each question as soon as its rows are in
+    runner = asyncio.ensure_future(run_queries())
+    tasks = [asyncio.ensure_future(guarded(i)) for i in firsts if i not in failed and i not in chats]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                yield "result", result
+    finally:
+        for task in tasks + [runner]:
+            task.cancel()
+
+    yield "done", {
+        "table_name": request.table_name,
+        "queries_planned": queries_planned,
+        "queries_executed": len(keys),
+        "cache_hits": batch_hits or None,
+        "timings": timer.finish()
+    }
+
+
+def sql_key(sql: str) -> str:
+    """Whitespace-insensitive identity of a query, for deduplication across questions"""
+    return " ".join(sql.split())
+
+
+@app.post("/analyze/batch", response_model=BatchAnalysisResponse)
+@app.post("/api/analyze/batch", response_model=BatchAnalysisResponse)
+async def analyze_batch(request: BatchAnalysisRequest, raw_request: Request):
+    """Answer many questions about one table; results come back in question order"""
+    results = []
+    try:
+        with tracer.trace("analyze_batch", table=request.table_name, questions=len(request.questions)):
+            # A batch takes one admission slot; batch_semaphore bounds its questions' analyses and renders
+            async with admission.slot(client_key(raw_request)):
+                async for event, payload in batch_events(request, str(raw_request.base_url)):
+                    if event == "result":
+                        results.append(payload)
+                    else:
+                        summary = payload
+    except Overloaded as e:
+        raise overloaded_error(e)
+    return BatchAnalysisResponse(results=sorted(results, key=lambda r: r.index), **summary)
+
+
+@app.post("/analyze/batch/stream")
+@app.post("/api/analyze/batch/stream")
+async def analyze_batch_stream(request: BatchAnalysisRequest, raw_request: Request):
+    """
+    Streaming variant of /analyze/batch: one "result" server-sent event per question,
+    in completion order, then "done" with the batch counters and timings.
+    """
+    base_url = str(raw_request.base_url)
+    key = client_key(raw_request)
+    try:
+        started = await admission.acquire(key)
+    except Overloaded as e:
+        raise overloaded_error(e)
+
+    async def events():
+        with tracer.trace("analyze_batch_stream", table=request.table_name, questions=len(request.questions)) as trace:
+            try:
+                async for event, payload in batch_events(request, base_url):
+                    yield sse_event(event, payload)
+            except HTTPException as e:
+                trace.status = e.status_code
+                yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+            except Overloaded as e:
+                trace.status = e.status_code
+                yield sse_event("error", {"status_code": e.status_code, "detail": str(e), "retry_after": e.retry_after})
+            except Exception as e:
+                trace.status = 500
+                logger.exception("Batch analysis failed")
+                yield sse_event("error", {"status_code": 500, "detail": str(e)})
+
+    return AdmittedStreamingResponse(
+        events(),
+        key,
+        started,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/upload")
+@app.post("/api/upload")
+async def upload_csv(
+    raw_request: Request,
+    filename: str = "upload.csv",
+    upload_id: str | None = None,
+    resume: bool = False
+):
+    """
+    Stream a CSV request body into a new lead table and register it in master_uploads.
+    To continue a failed upload, send the same file again with its upload_id and resume=true.
+    """
+    with tracer.trace("upload", filename=filename) as trace:
+        try:
+            progress = await ingestor.ingest(raw_request.stream(), filename, upload_id=upload_id, resume=resume)
+        except IngestError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if progress["status"] != "complete":
+            trace.status = 502
+            raise HTTPException(status_code=502, detail=progress)
+    table_catalog.invalidate(progress["table_name"])
+    return progress
+
+
+@app.get("/ready")
+@app.get("/api/ready")
+async def ready():
+    """503 until startup (and its warm-up) has finished; then the time each warm-up step took"""
+    if not warm_state["ready"]:
+        raise HTTPException(status_code=503, detail="Starting up")
+    return {"ready": True, "warmed_up": warm_state["warmed"], "warm_up_ms": warm_state["steps_ms"]}
+
+
+@app.get("/upload/stats")
+async def upload_stats():
+    """Upload counts by status and the latest uploads' progress"""
+    return ingestor.stats()
+
+
+@app.get("/upload/{upload_id}")
+@app.get("/api/upload/{upload_id}")
+async def upload_progress(upload_id: str):
+    """Rows read, inserted and committed so far, and throughput, for a running or finished upload"""
+    progress = ingestor.progress(upload_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"Upload {upload_id} not found")
+    return progress
+
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """Model per pipeline stage, with each stage's calls, mean latency, tokens, estimated cost and repairs"""
+    return claude_service.stats()
+
+
+@app.get("/sql/stats")
+async def sql_stats():
+    """SQL governor limits, validation cache counters, outcomes by rule, and EXPLAIN budget rejections"""
+    return {**validation_service.stats(), "budget": query_service.stats()}
+
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """
+    Capacity pools: analyses admitted at once, and the LLM, DB and render slots under them.
+    Each reports capacity, active and queued work, mean wait and hold times, and rejections by reason.
+    """
+    return {
+        "analyze": admission.stats(),
+        "llm": claude_service.pool.stats(),
+        "db": query_service.pool.stats(),
+        "render": graph_service.pool.stats()
+    }
+
+
+@app.get("/session/stats")
+async def session_stats():
+    """Conversations and result memory held, follow-up queries by outcome, reuse rate and database time saved"""
+    if session_store is None:
+        return {"enabled": False}
+    return session_store.stats()
+
+
+@app.delete("/session/{session_id}")
+@app.delete("/api/session/{session_id}")
+async def forget_session(session_id: str):
+    """Drop a conversation's kept results, e.g. when the user starts over"""
+    if session_store is None or not session_store.forget(session_id):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return {"forgotten": session_id}
+
+
+@app.get("/render/stats")
+async def render_stats():
+    """Render pool size, queue depth and outcome counters"""
+    return graph_service.stats()
+
+
+class CatalogInvalidateRequest(BaseModel):
+    table_name: str | None = None  # None drops the whole catalog
+
+
+@app.post("/catalog/invalidate")
+async def invalidate_catalog(request: CatalogInvalidateRequest):
+    """Force the table catalog and answer cache to reload, e.g. after rows were edited or an upload was removed"""
+    table_catalog.invalidate(request.table_name)
+    if local_engine is not None:
+        local_engine.invalidate(request.table_name)
+    if rollup_store is not None:
+        rollup_store.invalidate(request.table_name)
+    if request.table_name:
+        answer_cache.invalidate_table(request.table_name)
+    else:
+        answer_cache.clear()
+    return {"invalidated": request.table_name or "all"}
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for each answer cache layer, the table catalog and request coalescing"""
+    return {
+        "answers": answer_cache.stats(),
+        "catalog": table_catalog.stats(),
+        "local_engine": local_engine.stats() if local_engine is not None else None,
+        "rollups": rollup_store.stats() if rollup_store is not None else None,
+        "coalescing": {
+            flight.name: flight.stats()
+            for flight in (analysis_flight, query_service.flight, graph_service.flight)
+        }
+    }
+
+
+def service_metrics():
+    """Cache, coalescing and capacity-pool counters, read from the services at scrape time"""
+    answers = answer_cache.stats()
+    pools = (admission, claude_service.pool, query_service.pool, graph_service.pool)
+    families = [
+        ("cache_hits_total", "counter", "Answer cache hits by layer",
+         [({"cache": name}, layer['hits']) for name, layer in answers.items()]
+         + [({"cache": "charts"}, graph_store.hits)]),
+        ("cache_misses_total", "counter", "Answer cache misses by layer",
+         [({"cache": name}, layer['misses']) for name, layer in answers.items()]
+         + [({"cache": "charts"}, graph_store.misses)]),
+        ("cache_entries", "gauge", "Entries held in memory by each answer cache layer",
+         [({"cache": name}, layer['entries']) for name, layer in answers.items()]),
+        ("coalesced_total", "counter", "Calls that joined an identical call already in flight",
+         [({"flight": f.name}, f.coalesced) for f in (analysis_flight, query_service.flight, graph_service.flight)]),
+        ("render_queue_depth", "gauge", "Charts waiting for a render worker",
+         [({}, graph_service.stats()['queue_depth'])]),
+        ("pool_capacity", "gauge", "Slots in each capacity pool", [({"pool": p.name}, p.capacity) for p in pools]),
+        ("pool_active", "gauge", "Slots in use in each capacity pool", [({"pool": p.name}, p.active) for p in pools]),
+        ("pool_queued", "gauge", "Work waiting for a slot in each capacity pool",
+         [({"pool": p.name}, p.queued) for p in pools]),
+    ]
+    if rollup_store is not None:
+        stats = rollup_store.stats()
+        families.append(("rollup_answers_total", "counter", "Queries answered from rollups, or passed on to SQL",
+                         [({"outcome": "precomputed"}, stats['precomputed_hits']),
+                          ({"outcome": "computed"}, stats['computed_hits'])]
+                         + [({"outcome": reason}, n) for reason, n in stats['fallthrough'].items()]))
+    if local_engine is not None:
+        stats = local_engine.stats()
+        families.append(("local_engine_queries_total", "counter", "Queries run on the local engine or passed on",
+                         [({"outcome": "hit"}, stats['hits']), ({"outcome": "fallback"}, stats['fallbacks'])]))
+    if session_store is not None:
+        families.append(("session_bytes", "gauge", "Memory held by kept conversation results",
+                         [({}, session_store.stats()['bytes'])]))
+    return families
+
+
+registry.add_collector(service_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: request and span latency histograms, token and row counts, cache hit counters"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/slow")
+async def slow_request_log():
+    """Stage timelines of the most recent requests slower than SLOW_REQUEST_MS"""
+    return {"threshold_ms": tracer.slow_request_ms, "requests": list(tracer.recent_slow)}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -23,4 +23,42 @@ BEGIN
   -- Return empty array if no results
   RETURN COALESCE(result, '[]'::json);
 END;
-$$;
\ No newline at end of file
+$$;
+
+-- The executor the AI server uses for generated queries: EXPLAIN first, and refuse
+-- the query when the planner's total cost estimate is over max_cost.
+-- PostgREST (v12+) applies the function's statement_timeout to each call.
+CREATE OR REPLACE FUNCTION execute_governed_query(query text, max_cost float8 DEFAULT NULL)
+RETURNS json
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET statement_timeout = '15s'
+AS $$
+DECLARE
+  plan json;
+  cost float8;
+  result json;
+BEGIN
+  -- Validate: must be a SELECT, optionally with CTEs
+  IF query !~* '^\s*(select|with)\M' THEN
+    RAISE EXCEPTION 'Only SELECT queries allowed';
+  END IF;
+
+  -- Prevent destructive keywords
+  IF query ~* '\m(insert|update|delete|merge|drop|create|alter|truncate|grant|revoke|copy)\M' THEN
+    RAISE EXCEPTION 'Destructive operations not allowed';
+  END IF;
+
+  -- Plan without running it
+  EXECUTE 'EXPLAIN (FORMAT JSON) ' || query INTO plan;
+  cost := (plan -> 0 -> 'Plan' ->> 'Total Cost')::float8;
+
+  IF max_cost IS NOT NULL AND cost > max_cost THEN
+    RETURN json_build_object('cost', cost, 'rejected', true, 'rows', '[]'::json);
+  END IF;
+
+  EXECUTE format('SELECT json_agg(t) FROM (%s) t', query) INTO result;
+
+  RETURN json_build_object('cost', cost, 'rejected', false, 'rows', COALESCE(result, '[]'::json));
+END;
+$$;
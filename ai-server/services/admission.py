@@ -0,0 +1,175 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+
+from services.telemetry import pool_rejections, pool_wait
+
+
+class Overloaded(Exception):
+    """
+    Raised when a pool can't take more work in time.
+    status_code is 429 (this client has too much in flight) or 503 (the pool is saturated);
+    retry_after is the suggested pause in whole seconds.
+    """
+
+    def __init__(self, pool: str, reason: str, status_code: int, retry_after: float, message: str):
+        super().__init__(message)
+        self.pool = pool
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class CapacityPool:
+    """
+    A concurrency limit with a bounded FIFO wait queue.
+
+    At most capacity holders run at once. Others wait in arrival order, unless the
+    queue already holds max_queue waiters, or the expected wait (queue position x mean
+    hold time / capacity) runs past max_wait: then Overloaded is raised at once rather
+    than after waiting. A waiter that still isn't served after max_wait gives up.
+    With per_key, one key (a client) may hold or wait for at most that many slots.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        capacity: int,
+        max_queue: int | None = None,
+        max_wait: float | None = None,
+        per_key: int | None = None
+    ):
+        self.name = name
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.per_key = per_key
+        self.active = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self._keys: Dict[str, int] = {}
+        # Mean seconds a slot is held, smoothed; None until the first release
+        self.mean_hold: float | None = None
+        self.admitted = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.rejected: Dict[str, int] = {}
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def expected_wait(self, position: int | None = None) -> float:
+        """Seconds until a newcomer at position (default: the back of the queue) gets a slot"""
+        position = self.queued if position is None else position
+        return (position + 1) * (self.mean_hold or 0.0) / self.capacity
+
+    @asynccontextmanager
+    async def slot(self, key: str | None = None, timeout: float | None = None) -> AsyncIterator[None]:
+        started = await self.acquire(key, timeout)
+        try:
+            yield
+        finally:
+            self.release(key, started)
+
+    async def acquire(self, key: str | None = None, timeout: float | None = None) -> float:
+        """Wait for a slot; returns the time it was granted, to pass to release()"""
+        timeout = min((t for t in (timeout, self.max_wait) if t is not None), default=None)
+        if self.per_key is not None and key is not None and self._keys.get(key, 0) >= self.per_key:
+            self._reject(
+                "per_client", 429, self.mean_hold or 1.0,
+                f"Too many concurrent requests from this client (max {self.per_key})"
+            )
+
+        if self.active < self.capacity and not self._waiters:
+            return self._grant(key)
+        if self.max_queue is not None and self.queued >= self.max_queue:
+            self._reject(
+                "queue_full", 503, self.expected_wait(), f"The {self.name} queue is full ({self.max_queue} waiting)"
+            )
+        if timeout is not None and self.expected_wait() > timeout:
+            self._reject(
+                "deadline", 503, self.expected_wait(),
+                f"The {self.name} queue is {self.expected_wait():.1f}s long, over the {timeout:g}s limit"
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._hold_key(key, 1)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._leave_queue(future, key)
+            self._reject("timeout", 503, self.expected_wait(), f"Waited {timeout:g}s for a {self.name} slot")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the waiter went away; pass it on
+                self.release(key, time.perf_counter())
+            else:
+                self._leave_queue(future, key)
+            raise
+        waited = time.perf_counter() - start
+        self.waited += 1
+        self.wait_seconds += waited
+        pool_wait.observe(waited, pool=self.name)
+        self.admitted += 1
+        return time.perf_counter()
+
+    def release(self, key: str | None, started: float) -> None:
+        """Free a slot, handing it straight to the first waiter if there is one"""
+        held = time.perf_counter() - started
+        self.mean_hold = held if self.mean_hold is None else 0.8 * self.mean_hold + 0.2 * held
+        self._hold_key(key, -1)
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _grant(self, key: str | None) -> float:
+        self.active += 1
+        self.admitted += 1
+        self._hold_key(key, 1)
+        pool_wait.observe(0.0, pool=self.name)
+        return time.perf_counter()
+
+    def _leave_queue(self, future: asyncio.Future, key: str | None) -> None:
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+        self._hold_key(key, -1)
+
+    def _hold_key(self, key: str | None, delta: int) -> None:
+        if key is None:
+            return
+        count = self._keys.get(key, 0) + delta
+        if count > 0:
+            self._keys[key] = count
+        else:
+            self._keys.pop(key, None)
+
+    def _reject(self, reason: str, status_code: int, retry_after: float, message: str) -> None:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        pool_rejections.inc(pool=self.name, reason=reason)
+        raise Overloaded(self.name, reason, status_code, retry_after, message)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "active": self.active,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "max_wait_seconds": self.max_wait,
+            "per_client": self.per_key,
+            "clients": len(self._keys),
+            "admitted": self.admitted,
+            "waited": self.waited,
+            "mean_wait_ms": round(self.wait_seconds / self.waited * 1000, 2) if self.waited else 0.0,
+            "mean_hold_ms": round(self.mean_hold * 1000, 2) if self.mean_hold is not None else None,
+            "rejected": dict(self.rejected),
+        }
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple
+
+
+MISSING = object()
+
+
+def cache_key(*parts: Any) -> str:
+    """Stable hash of JSON-serialisable key parts"""
+    raw = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def normalize_question(question: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip(" ?.!")
+
+
+class LRUCache:
+    """
+    In-memory LRU cache bounded by entry count and approximate size in bytes,
+    with an optional SQLite file behind it that survives restarts.
+
+    Values must be JSON-serialisable. Every entry carries a tag (the table name)
+    so everything derived from one table can be dropped at once.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        disk_path: str | None = None,
+        max_disk_entries: int = 10000
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_entries = max_disk_entries
+        self._entries: "OrderedDict[str, Tuple[Any, int, str | None]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        # The disk layer is opened on first use, so a process that forks workers holds no connection
+        self.disk_path = disk_path
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def _db(self) -> sqlite3.Connection | None:
+        """The on-disk layer, or None without a disk_path. Callers hold _lock."""
+        if self._conn is None and self.disk_path:
+            os.makedirs(os.path.dirname(self.disk_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.disk_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, tag TEXT, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_tag ON cache (tag)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str) -> Any:
+        """Return the cached value or MISSING"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, tag FROM cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    value = json.loads(row[0])
+                    self._put_memory(key, value, len(row[0]), row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return MISSING
+
+    def set(self, key: str, value: Any, tag: str | None = None) -> None:
+        encoded = json.dumps(value, default=str, separators=(",", ":"))
+        with self._lock:
+            self._put_memory(key, value, len(encoded), tag)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, tag, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, encoded, tag, time.time())
+                )
+                self._db.execute(
+                    "DELETE FROM cache WHERE key IN ("
+                    "SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+                self._db.commit()
+
+    def invalidate_tag(self, tag: str) -> int:
+        """Drop every entry carrying the tag; returns how many were in memory"""
+        with self._lock:
+            keys = [key for key, (_, _, entry_tag) in self._entries.items() if entry_tag == tag]
+            for key in keys:
+                self._drop(key)
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache WHERE tag = ?", (tag,))
+                self._db.commit()
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'disk_hits': self.disk_hits,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None
+        }
+
+    def _put_memory(self, key: str, value: Any, size: int, tag: str | None) -> None:
+        if key in self._entries:
+            self._drop(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size, tag)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+class AnswerCache:
+    """
+    Layered cache for the /analyze pipeline, versioned by the table's upload:
+
+    - plans:    (normalized question, table, version) -> intent, graph decision and SQL
+    - results:  (table, version, SQL text) -> result rows
+    - analyses: (query results, graph options) -> analysis (charts are cached by GraphStore)
+
+    A new upload gets a new version, so answers for the old one are never served.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        cache_dir: str | None = None
+    ):
+        def layer(name: str) -> LRUCache:
+            disk_path = os.path.join(cache_dir, f"{name}.sqlite3") if cache_dir else None
+            return LRUCache(name, max_entries=max_entries, max_bytes=max_bytes, disk_path=disk_path)
+
+        self.plans = layer("plans")
+        self.results = layer("results")
+        self.analyses = layer("analyses")
+
+    @staticmethod
+    def plan_key(question: str, table_name: str, version: str) -> str:
+        return cache_key("plan", normalize_question(question), table_name, version)
+
+    @staticmethod
+    def result_key(sql: str, table_name: str, version: str) -> str:
+        return cache_key("result", " ".join(sql.split()), table_name, version)
+
+    @staticmethod
+    def analysis_key(query_results: List[Dict], **graph_options: Any) -> str:
+        return cache_key("analysis", query_results, graph_options)
+
+    def invalidate_table(self, table_name: str) -> None:
+        for layer in (self.plans, self.results, self.analyses):
+            layer.invalidate_tag(table_name)
+
+    def clear(self) -> None:
+        for layer in (self.plans, self.results, self.analyses):
+            layer.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {layer.name: layer.stats() for layer in (self.plans, self.results, self.analyses)}
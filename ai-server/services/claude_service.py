@@ -1,15 +1,181 @@
-import anthropic
+import asyncio
+import functools
+import httpx
 import json
-from typing import List, Dict, Any
+import logging
+import random
+import re
+import time
+from typing import AsyncIterator, List, Dict, Any, Tuple
+
+from services.admission import CapacityPool
+from services.intent_rules import RuleClassifier
+from services.result_compactor import compact_json, estimate_tokens
+from services.structured_output import (
+    BATCH_PLAN_TOOL,
+    GRAPH_TOOL,
+    INTENT_TOOL,
+    PLAN_TOOL,
+    QUERIES_TOOL,
+    StructuredOutputError,
+    analysis_tool,
+    tool_input,
+)
+from services.telemetry import llm_cost, llm_structured, record_usage, tracer
+
+logger = logging.getLogger(__name__)
+
+
+@functools.cache
+def retryable_errors() -> Tuple[type, ...]:
+    """Errors worth retrying: the request never reached the model, or the API asked us to back off"""
+    import anthropic  # imported on first use; the SDK takes about a second to import
+
+    return (
+        anthropic.APITimeoutError,
+        anthropic.APIConnectionError,
+        anthropic.RateLimitError,
+        anthropic.InternalServerError,
+        asyncio.TimeoutError,
+    )
+
+
+DEFAULT_MODEL = "claude-sonnet-4-20250514"
+FAST_MODEL = "claude-3-5-haiku-20241022"
+# Operations the fast model answers unless configured otherwise: short classifications and output repairs
+FAST_OPERATIONS = ("intent", "graph_decision", "repair")
+
+# USD per million (input, output) tokens, matched by model id prefix.
+# Cache reads are billed at 10% of the input price, cache writes at 125%.
+MODEL_PRICES = {
+    "claude-opus-4": (15.0, 75.0),
+    "claude-sonnet-4": (3.0, 15.0),
+    "claude-3-7-sonnet": (3.0, 15.0),
+    "claude-haiku-4-5": (1.0, 5.0),
+    "claude-3-5-haiku": (0.8, 4.0),
+    "claude-3-haiku": (0.25, 1.25),
+}
+
+
+def usage_cost(model: str, tokens: Dict[str, int]) -> float | None:
+    """Estimated USD cost of one call from its token counts, or None for a model without a known price"""
+    prices = next((p for prefix, p in MODEL_PRICES.items() if model.startswith(prefix)), None)
+    if prices is None:
+        return None
+    input_price, output_price = prices
+    return (
+        tokens.get("input_tokens", 0) * input_price
+        + tokens.get("cache_read_tokens", 0) * input_price * 0.1
+        + tokens.get("cache_write_tokens", 0) * input_price * 1.25
+        + tokens.get("output_tokens", 0) * output_price
+    ) / 1_000_000
+
+
+# Query results arrive compacted by ResultCompactor
+RESULTS_NOTE = (
+    "Each result gives row_count, columns and rows (one array per row). "
+    "If truncated is true only the first rows are shown; use column_summaries, "
+    "which cover every row, for totals and distributions."
+)
+
+
+class JsonStringExtractor:
+    """
+    Incrementally pulls the value of one top-level string field out of streamed JSON,
+    so the text can be forwarded while the rest of the object is still being written.
+    """
+
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self, field: str):
+        self.marker = f'"{field}"'
+        self.buffer = ""
+        self.pos = None  # index of the next unread character of the value
+        self.done = False
+
+    def feed(self, text: str) -> str:
+        """Add a chunk of streamed text and return any newly complete characters of the value"""
+        self.buffer += text
+        if self.done:
+            return ""
+        if self.pos is None:
+            match = re.search(re.escape(self.marker) + r'\s*:\s*"', self.buffer)
+            if not match:
+                return ""
+            self.pos = match.end()
+
+        out = []
+        while self.pos < len(self.buffer):
+            char = self.buffer[self.pos]
+            if char == '"':
+                self.done = True
+                break
+            if char != '\\':
+                out.append(char)
+                self.pos += 1
+                continue
+            # Escape sequence: wait until it is complete
+            if self.pos + 1 >= len(self.buffer):
+                break
+            code = self.buffer[self.pos + 1]
+            if code == 'u':
+                if self.pos + 6 > len(self.buffer):
+                    break
+                out.append(chr(int(self.buffer[self.pos + 2:self.pos + 6], 16)))
+                self.pos += 6
+            else:
+                out.append(self.ESCAPES.get(code, code))
+                self.pos += 2
+        return "".join(out)
+
 
 class ClaudeService:
-    def __init__(self, api_key: str):
-        self.client = anthropic.Anthropic(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        max_concurrency: int = 16,
+        timeout: float = 60.0,
+        max_retries: int = 3,
+        max_connections: int = 32,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        rules: RuleClassifier | None = None,
+        model: str = DEFAULT_MODEL,
+        fast_model: str = FAST_MODEL,
+        stage_models: Dict[str, str] | None = None,
+        max_repairs: int = 1,
+        max_queue: int | None = None,
+        max_input_tokens: int | None = None
+    ):
+        # The SDK client is created on first use (see client), so importing the server stays cheap
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self._client = None
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Local fast path for intent and graph decisions; the model is asked only when it's unsure
+        self.rules = rules
+        # Model per operation: the fast tier for classifications and repairs, `model` for the rest.
+        # stage_models overrides single operations, e.g. {"sql_generation": "claude-haiku-4-5"}
+        self.default_model = model
+        self.models = {operation: fast_model for operation in FAST_OPERATIONS}
+        self.models.update(stage_models or {})
+        # Times a malformed answer is sent back for repair before the call fails
+        self.max_repairs = max_repairs
+        # Input tokens one call may send; query results and schema context are trimmed to fit
+        self.max_input_tokens = max_input_tokens
+        # Per-operation calls, latency, tokens, cost and structured-output outcomes, for /llm/stats
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        # Caps the number of in-flight model calls; extra calls wait here instead of piling onto the API,
+        # and fail fast (Overloaded) when the wait would outlast the call's own timeout
+        self.pool = CapacityPool("llm", max_concurrency, max_queue=max_queue, max_wait=timeout)
         self.system_prompt = """You are a data analyst for a lead generation system.
 
             Database Schema:
-            - Dynamic lead tables with columns: id, date, lead_owner, source, deal_stage, 
-            account_id, first_name, last_name, company
+            - Dynamic lead tables, one per upload. The exact columns and row count of
+            the table being queried are given with each question.
 
             RULES:
             1. Return SPECIFIC NUMBERS only, never vague descriptions
@@ -18,60 +184,419 @@ class ClaudeService:
             4. Always return valid JSON
             5. No destructive operations (INSERT/UPDATE/DELETE)
         """
-    
-    async def generate_queries(self, question: str, table_name: str) -> List[Dict]:
+        self.graph_prompt = """You are an expert at understanding data visualization needs.
+            
+            Analyze questions to determine if a graph/chart would be helpful.
+
+            Rules:
+            - Generate graph if: question asks to "show", "visualize", "compare", "trend", "over time", "breakdown", "distribution"
+            - Generate graph if: comparing multiple categories, showing trends, or analyzing proportions
+            - DON'T generate graph if: asking for single number, count, or simple yes/no
+            - DON'T generate graph if: asking for list of items, specific records, or detailed breakdowns with many categories
+
+            Choose appropriate graph type:
+            - "bar": comparing categories, showing distribution
+            - "line": trends over time, growth patterns
+            - "pie": proportions, percentage breakdown (max 5-7 categories)
+            - "scatter": correlation between two variables
+            - "none": no graph needed"""
+        self.intent_prompt = """You are an intelligent assistant for a lead generation analytics system. 
+            Your job is to distinguish between data analysis requests and normal conversation.
+
+            Rules:
+            1. "analyze": If the user asks for data from the database, leads, statistics, counts, lists, checking records, filtered data, or anything related to the lead tables. Examples: "How many leads?", "Show me leads from Google", "Who is the top owner?", "List all deals".
+            2. "chat": If the user is just greeting ("hello", "hi"), asking general questions not about the data ("how are you", "what can you do"), or asking something unrelated to the database.
+
+            Response format for "analyze":
+            {
+                "classification": "analyze",
+                "response": null
+            }
+
+            Response format for "chat":
+            {
+                "classification": "chat",
+                "response": "[A polite response to the user's chat, followed by a sentence guiding them to ask specific data analysis questions]"
+            }
+            example for chat: 
+            "Hello! I'm doing great. I'm here to help you analyze your lead data. You can ask me questions like 'How many qualified leads do we have?' or 'Show me the trend of leads over the last month'."
+            """
+
+    @property
+    def client(self) -> Any:
+        """
+        One pooled async client shared by every request on this worker, created on first use.
+        SDK-level retries are disabled so that retries and backoff go through _create.
+        """
+        if self._client is None:
+            import anthropic
+
+            self._client = anthropic.AsyncAnthropic(
+                api_key=self.api_key,
+                max_retries=0,
+                timeout=self.timeout,
+                http_client=anthropic.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections,
+                        keepalive_expiry=30.0,
+                    ),
+                    timeout=self.timeout,
+                ),
+            )
+        return self._client
+
+    @client.setter
+    def client(self, client: Any) -> None:
+        self._client = client
+
+    @staticmethod
+    def preload() -> None:
+        """Import the SDK without creating a client: safe in a process that will fork"""
+        retryable_errors()
+
+    async def warm_up(self) -> None:
+        """
+        Import the SDK and create the client off the event loop, then open a pooled
+        connection to the API with a models listing (no tokens), so the first question
+        doesn't pay for the import or the TLS handshake. A failed request only logs.
+        """
+        await asyncio.to_thread(lambda: (self.preload(), self.client))
+        try:
+            await asyncio.wait_for(self.client.models.list(limit=1), timeout=self.timeout)
+        except Exception as e:
+            logger.warning("Could not open a connection to the model API during warm-up: %s", e)
+
+    async def aclose(self) -> None:
+        """Close the pooled HTTP connections"""
+        if self._client is not None:
+            await self._client.close()
+
+    def model_for(self, operation: str) -> str:
+        return self.models.get(operation, self.default_model)
+
+    def _entry(self, operation: str) -> Dict[str, Any]:
+        return self._stats.setdefault(operation, {
+            "calls": 0, "errors": 0, "total_ms": 0.0, "input_tokens": 0, "output_tokens": 0,
+            "cache_read_tokens": 0, "cache_write_tokens": 0, "schema_trimmed": 0,
+            "cost_usd": 0.0, "ok": 0, "repaired": 0, "failed": 0, "models": {}
+        })
+
+    def _account(self, operation: str, model: str, start: float, response: Any | None) -> Dict[str, Any]:
+        """Record one call's latency, tokens and cost; returns the attributes for its span"""
+        entry = self._entry(operation)
+        entry["calls"] += 1
+        entry["total_ms"] += (time.perf_counter() - start) * 1000
+        entry["models"][model] = entry["models"].get(model, 0) + 1
+        if response is None:
+            entry["errors"] += 1
+            return {}
+        tokens = record_usage(operation, getattr(response, "usage", None))
+        for name in ("input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens"):
+            entry[name] += tokens.get(name, 0)
+        cost = usage_cost(model, tokens)
+        if cost is None:
+            return tokens
+        entry["cost_usd"] += cost
+        llm_cost.inc(cost, operation=operation, model=model)
+        return {**tokens, "cost_usd": round(cost, 6)}
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Model per operation, and each operation's calls, mean latency, tokens, cost and repairs.
+        cache_hit_rate is the share of input tokens read from the prompt cache.
+        """
+        operations = {}
+        for operation, entry in sorted(self._stats.items()):
+            prompt_tokens = entry["input_tokens"] + entry["cache_read_tokens"] + entry["cache_write_tokens"]
+            operations[operation] = {
+                **{k: v for k, v in entry.items() if k != "total_ms"},
+                "mean_ms": round(entry["total_ms"] / entry["calls"], 2) if entry["calls"] else None,
+                "cost_usd": round(entry["cost_usd"], 6),
+                "cache_hit_rate": round(entry["cache_read_tokens"] / prompt_tokens, 3) if prompt_tokens else None,
+            }
+        return {
+            "default_model": self.default_model,
+            "models": dict(self.models),
+            "max_repairs": self.max_repairs,
+            "max_input_tokens": self.max_input_tokens,
+            "operations": operations
+        }
+
+    async def _create(self, operation: str, timeout: float | None = None, **kwargs) -> Any:
+        """
+        Call messages.create under the concurrency cap with a per-call timeout.
+        The model defaults to the operation's tier.
+        Transient failures are retried with full-jitter exponential backoff.
+        The call is traced as an "llm" span named after the operation, with its token usage and cost.
+        """
+        kwargs.setdefault("model", self.model_for(operation))
+        start = time.perf_counter()
+        with tracer.span("llm", operation, model=kwargs["model"]) as span:
+            try:
+                response = await self._create_with_retries(timeout, span, **kwargs)
+            except BaseException:
+                self._account(operation, kwargs["model"], start, None)
+                raise
+            span.update(self._account(operation, kwargs["model"], start, response))
+            return response
+
+    async def _structured(self, operation: str, tool: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        """
+        Call the model with the tool forced, so the answer arrives as JSON shaped by the
+        tool's input schema, and return that input once it validates.
+        """
+        request = dict(kwargs, tools=[tool], tool_choice={"type": "tool", "name": tool["name"]})
+        response = await self._create(operation, **request)
+        return await self._checked(operation, tool, request, response)
+
+    async def _checked(
+        self,
+        operation: str,
+        tool: Dict[str, Any],
+        request: Dict[str, Any],
+        response: Any
+    ) -> Dict[str, Any]:
+        """
+        Validate a structured answer. A malformed one is handed back to the repair model
+        with the validation error, up to max_repairs times, before StructuredOutputError is raised.
+        """
+        entry = self._entry(operation)
+        repairs = 0
+        while True:
+            try:
+                value = tool_input(response, tool)
+            except StructuredOutputError as e:
+                if repairs >= self.max_repairs:
+                    entry["failed"] += 1
+                    llm_structured.inc(operation=operation, outcome="failed")
+                    raise
+                repairs += 1
+                logger.warning("%s answer malformed (%s), asking for a repair", operation, e)
+                response = await self._create("repair", **self._repair_request(request, response, e))
+                continue
+            outcome = "repaired" if repairs else "ok"
+            entry[outcome] += 1
+            llm_structured.inc(operation=operation, outcome=outcome)
+            return value
+
+    def _repair_request(self, request: Dict[str, Any], response: Any, error: Exception) -> Dict[str, Any]:
+        """The original request followed by the bad answer and the error, asking for the tool call again"""
+        answer = []
+        tool_use_id = None
+        for block in response.content:
+            if getattr(block, "type", None) == "tool_use":
+                answer.append({"type": "tool_use", "id": block.id, "name": block.name, "input": block.input})
+                tool_use_id = block.id
+            elif getattr(block, "text", ""):
+                answer.append({"type": "text", "text": block.text})
+        name = request["tools"][0]["name"]
+        feedback = f"That answer can't be used: {error}. Call {name} again with complete, corrected input."
+        return dict(
+            request,
+            model=self.model_for("repair"),
+            messages=request["messages"] + [
+                {"role": "assistant", "content": answer or [{"type": "text", "text": "(empty answer)"}]},
+                {
+                    "role": "user",
+                    "content": [{"type": "tool_result", "tool_use_id": tool_use_id, "is_error": True, "content": feedback}]
+                    if tool_use_id else feedback
+                }
+            ]
+        )
+
+    async def _create_with_retries(self, timeout: float | None, span: Dict[str, Any], **kwargs) -> Any:
+        timeout = timeout or self.timeout
+        attempt = 0
+        while True:
+            try:
+                async with self.pool.slot(timeout=timeout):
+                    return await asyncio.wait_for(
+                        self.client.messages.create(timeout=timeout, **kwargs),
+                        timeout=timeout
+                    )
+            except retryable_errors() as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                # Honour the server's Retry-After when it asks for a longer pause
+                retry_after = getattr(getattr(e, 'response', None), 'headers', {}).get('retry-after')
+                if retry_after:
+                    try:
+                        delay = max(delay, min(float(retry_after), self.backoff_max))
+                    except ValueError:
+                        pass
+                attempt += 1
+                span["retries"] = attempt
+                logger.warning(
+                    "Claude call failed (%s), retry %d/%d in %.2fs", type(e).__name__, attempt, self.max_retries, delay
+                )
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _schema_line(table_name: str, schema: str | None) -> str:
+        """Schema context for the user message, with the fixed upload schema as fallback"""
+        return schema or (
+            f"Table {table_name} with columns: id, date, lead_owner, source, deal_stage, "
+            "account_id, first_name, last_name, company"
+        )
+
+    @staticmethod
+    def _system(*blocks: str | None) -> List[Dict[str, Any]]:
+        """
+        System prompt blocks, each ending a prompt-cache prefix: the static instructions
+        first, then the per-table context. A call whose tools and system blocks match an
+        earlier one's up to a block reads that prefix from the cache instead of
+        reprocessing it (prefixes under the model's minimum length are never cached).
+        """
+        return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}} for text in blocks if text]
+
+    def _schema_block(self, operation: str, table_name: str, schema: str | None) -> str:
+        """
+        The table's name and schema, as one cached system block shared by every question
+        about the table. It may take up to half the input budget; past that the oldest
+        lines after the table's own (earlier session results) are dropped.
+        """
+        block = f"Table name: {table_name}\nSchema: {self._schema_line(table_name, schema)}"
+        if self.max_input_tokens is None or estimate_tokens(block) <= self.max_input_tokens // 2:
+            return block
+        self._entry(operation)["schema_trimmed"] += 1
+        lines = block.split("\n")
+        head, tail = lines[:3], lines[3:]
+        while tail and estimate_tokens("\n".join(head + tail)) > self.max_input_tokens // 2:
+            tail.pop(0)
+        return "\n".join(head + tail)[:self.max_input_tokens * 2]
+
+    async def generate_queries(self, question: str, table_name: str, schema: str | None = None) -> List[Dict]:
         """Generate SQL queries to answer the question"""
         
-        response = self.client.messages.create(
-            model="claude-sonnet-4-20250514",
+        answer = await self._structured(
+            "sql_generation",
+            QUERIES_TOOL,
             max_tokens=2000,
-            system=self.system_prompt,
-            messages=[{
-                "role": "user",
-                "content": f"""Table name: {table_name}
-                Question: {question}
-
-                Generate SQL queries to answer with SPECIFIC NUMBERS.
-                Return JSON array format:
-                [
+            system=self._system(
+                f"""{self.system_prompt}
+                Generate SQL queries to answer each question with SPECIFIC NUMBERS.
+                Record them with the sql_queries tool, for example:
                 {{
+                "queries": [
+                    {{
                     "sql": "SELECT ...",
                     "description": "What this calculates",
                     "metric_name": "Total Leads"
-                }}
-                ]"""
-            }]
+                    }}
+                ]
+                }}""",
+                self._schema_block("sql_generation", table_name, schema)
+            ),
+            messages=[{"role": "user", "content": f"Question: {question}"}]
         )
         
-        # Parse response
-        content = response.content[0].text
-        # Handle markdown code blocks if present
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        
-        return json.loads(content)
+        return answer["queries"]
     
     async def generate_analysis(
         self, 
         query_results: List[Dict], 
         graph_type: str = "auto",
-        include_graph: bool = False
+        include_graph: bool = False,
+        table_overview: Dict[str, Any] | None = None
     ) -> Dict[str, Any]:
-        """Generate statistics and optionally graph data from query results"""
-        
-        # Build the prompt based on whether graph is needed
+        """
+        Generate statistics and optionally graph data from query results.
+        table_overview: precomputed whole-table counts (RollupStore.overview) for context
+        """
+
+        request = self._analysis_request(query_results, graph_type, include_graph, table_overview)
+        response = await self._create("analysis", **request)
+
+        return await self._checked("analysis", request["tools"][0], request, response)
+
+    async def stream_analysis(
+        self,
+        query_results: List[Dict],
+        graph_type: str = "auto",
+        include_graph: bool = False,
+        table_overview: Dict[str, Any] | None = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Same as generate_analysis, but streamed.
+        Yields ("summary_delta", text) as the summary is written, then ("analysis", dict).
+        """
+        extractor = JsonStringExtractor("summary")
+        start = time.perf_counter()
+        request = self._analysis_request(query_results, graph_type, include_graph, table_overview)
+        model = request["model"]
+        with tracer.span("llm", "analysis_stream", model=model) as span:
+            try:
+                async with self.pool.slot():
+                    async with self.client.messages.stream(timeout=self.timeout, **request) as stream:
+                        async for event in stream:
+                            # The tool input arrives as partial JSON (plain text if the model ignores the tool)
+                            if event.type != "content_block_delta":
+                                continue
+                            text = getattr(event.delta, "partial_json", None) or getattr(event.delta, "text", None)
+                            if not text:
+                                continue
+                            if "first_token_ms" not in span:
+                                span["first_token_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                            delta = extractor.feed(text)
+                            if delta:
+                                yield "summary_delta", delta
+                        response = await stream.get_final_message()
+            except BaseException:
+                self._account("analysis_stream", model, start, None)
+                raise
+            span.update(self._account("analysis_stream", model, start, response))
+
+        yield "analysis", await self._checked("analysis_stream", request["tools"][0], request, response)
+
+    def _analysis_request(
+        self,
+        query_results: List[Dict],
+        graph_type: str,
+        include_graph: bool,
+        table_overview: Dict[str, Any] | None = None
+    ) -> Dict[str, Any]:
+        """
+        messages.create arguments for generate_analysis / stream_analysis, with the analysis tool forced.
+        The instructions are a cached system block; only the results (and chart type) vary.
+        """
+        results_json = json.dumps(query_results, default=str, separators=(",", ":"))
+        if table_overview:
+            overview_json = json.dumps(table_overview, default=str, separators=(",", ":"))
+            results_json += f"\nWhole-table counts (exact, for context): {overview_json}"
+        prompt_content = f"Query results: {results_json}"
+        if include_graph:
+            prompt_content += f"\nGraph data for {graph_type} chart."
+
+        tool = analysis_tool(include_graph)
+        return dict(
+            model=self.model_for("analysis"),
+            max_tokens=2000 if not include_graph else 3000,  # Less tokens needed without graph
+            tools=[tool],
+            tool_choice={"type": "tool", "name": tool["name"]},
+            system=self._system(self._analysis_prompt(include_graph)),
+            messages=[{
+                "role": "user",
+                "content": prompt_content
+            }]
+        )
+
+    def _analysis_prompt(self, include_graph: bool) -> str:
+        """The analysis instructions and example, with or without chart data"""
         if include_graph:
-            prompt_content = f"""Query results: {json.dumps(query_results, indent=2)}
+            return f"""{self.system_prompt}
+            {RESULTS_NOTE}
 
-            Generate:
+            For the query results you are given, generate:
             1. A natural language summary presenting the key insights (2-3 sentences)
             2. Specific numeric statistics
-            3. Graph data for {graph_type} chart
+            3. Graph data for the chart type named after the results
 
             IMPORTANT: Write the summary as if you're a data analyst presenting findings to a colleague.
             Use actual numbers and be specific. Sound natural and conversational.
 
-            Return JSON:
+            Record them with the analysis tool, for example:
             {{
             "summary": "Based on the data, you have 1,010 qualified deals in your pipeline. This represents a strong conversion funnel with qualified leads making up about 18.6% of your total leads. The majority of your leads are currently in the qualification stage.",
             "statistics": [
@@ -90,20 +615,20 @@ class ClaudeService:
                 "data": [1010]
                 }}]
             }}
-            }}"""                
-            
-        else:
-            # Simpler prompt when no graph needed
-            prompt_content = f"""Query results: {json.dumps(query_results, indent=2)}
+            }}"""
 
-            Generate:
+        # Simpler prompt when no graph needed
+        return f"""{self.system_prompt}
+            {RESULTS_NOTE}
+
+            For the query results you are given, generate:
             1. A natural language summary presenting the key insights (2-3 sentences)
             2. Specific numeric statistics
 
             IMPORTANT: Write the summary as if you're a data analyst presenting findings to a colleague.
             Use actual numbers and be specific. Sound natural and conversational.
 
-            Return JSON:
+            Record them with the analysis tool, for example:
             {{
             "summary": "Based on the data, you have 1,010 qualified deals in your pipeline. This represents a strong conversion funnel with qualified leads making up about 18.6% of your total leads.",
             "statistics": [
@@ -115,56 +640,36 @@ class ClaudeService:
                 }}
             ]
             }}"""
-        
-        response = self.client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000 if not include_graph else 3000,  # Less tokens needed without graph
-            system=self.system_prompt,
-            messages=[{
-                "role": "user",
-                "content": prompt_content
-            }]
-        )
-        
-        content = response.content[0].text
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        
-        return json.loads(content)
 
+    def results_budget(self, include_graph: bool, table_overview: Dict[str, Any] | None = None) -> int | None:
+        """
+        Tokens the query results may take in the analysis prompt: the input budget less the
+        instructions, tool and overview. None without a budget. ResultCompactor trims to it.
+        """
+        if self.max_input_tokens is None:
+            return None
+        fixed = estimate_tokens(self._analysis_prompt(include_graph)) \
+            + estimate_tokens(compact_json(analysis_tool(include_graph))) \
+            + (estimate_tokens(compact_json(table_overview)) if table_overview else 0)
+        return max(self.max_input_tokens - fixed, 0)
 
     async def should_generate_graph(self, question: str) -> Dict[str, Any]:
         """
         Analyze the question to determine if a graph would be helpful
         Returns: {"include_graph": bool, "graph_type": str, "reasoning": str}
         """
+        decision = self.rules.graph_decision(question) if self.rules else None
+        if decision is not None:
+            return decision
         
-        response = self.client.messages.create(
-            model="claude-sonnet-4-20250514",
+        return await self._structured(
+            "graph_decision",
+            GRAPH_TOOL,
             max_tokens=300,
-            system="""You are an expert at understanding data visualization needs.
-            
-            Analyze questions to determine if a graph/chart would be helpful.
-
-            Rules:
-            - Generate graph if: question asks to "show", "visualize", "compare", "trend", "over time", "breakdown", "distribution"
-            - Generate graph if: comparing multiple categories, showing trends, or analyzing proportions
-            - DON'T generate graph if: asking for single number, count, or simple yes/no
-            - DON'T generate graph if: asking for list of items, specific records, or detailed breakdowns with many categories
+            system=self._system(f"""{self.graph_prompt}
 
-            Choose appropriate graph type:
-            - "bar": comparing categories, showing distribution
-            - "line": trends over time, growth patterns
-            - "pie": proportions, percentage breakdown (max 5-7 categories)
-            - "scatter": correlation between two variables
-            - "none": no graph needed""",
-            messages=[{
-                "role": "user",
-                "content": f"""Question: "{question}"
-
-            Should we generate a graph for this question?
-
-            Return JSON:
+            For each question, decide whether we should generate a graph.
+            Record the decision with the graph_decision tool, for example:
             {{
             "include_graph": true,
             "graph_type": "bar",
@@ -177,55 +682,286 @@ class ClaudeService:
             "include_graph": false,
             "graph_type": "none",
             "reasoning": "User just wants a single count number"
-            }}"""
-            }
-        ]
+            }}"""),
+            messages=[{"role": "user", "content": f'Question: "{question}"'}]
         )
-        
-        content = response.content[0].text
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        
-        return json.loads(content)
 
     async def classify_intent(self, question: str) -> Dict[str, Any]:
         """
         Determine if the user's question requires analysis (SQL/Queries) or is just a normal chat.
         Returns: {"classification": "analyze" | "chat", "response": str (if chat)}
         """
+        decision = self.rules.classify_intent(question) if self.rules else None
+        if decision is not None:
+            return decision
         
-        response = self.client.messages.create(
-            model="claude-sonnet-4-20250514",
+        return await self._structured(
+            "intent",
+            INTENT_TOOL,
             max_tokens=300,
-            system="""You are an intelligent assistant for a lead generation analytics system. 
-            Your job is to distinguish between data analysis requests and normal conversation.
+            system=self._system(f"{self.intent_prompt}\nRecord the classification with the classify_intent tool."),
+            messages=[{"role": "user", "content": f'Question: "{question}"'}]
+        )
 
-            Rules:
-            1. "analyze": If the user asks for data from the database, leads, statistics, counts, lists, checking records, filtered data, or anything related to the lead tables. Examples: "How many leads?", "Show me leads from Google", "Who is the top owner?", "List all deals".
-            2. "chat": If the user is just greeting ("hello", "hi"), asking general questions not about the data ("how are you", "what can you do"), or asking something unrelated to the database.
+    async def plan_analysis(
+        self,
+        question: str,
+        table_name: str,
+        mode: str = "planner",
+        schema: str | None = None
+    ) -> Dict[str, Any]:
+        """
+        Decide intent, graph and SQL for a question without four sequential round trips.
 
-            Response format for "analyze":
-            {
+        mode="planner" asks for everything in one structured call and falls back to
+        mode="parallel" (the three independent calls run concurrently) if the
+        combined answer can't be parsed. When the local rules settle intent and graph,
+        only SQL generation goes to the model (mode "rules"); a chat needs no call at all.
+        Returns: {"intent": {...}, "graph_decision": {...}, "queries": [...], "mode": str, "timings": {...}}
+        """
+        if self.rules:
+            start = time.perf_counter()
+            intent = self.rules.classify_intent(question)
+            graph_decision = self.rules.graph_decision(question)
+            timings = {"rules": (time.perf_counter() - start) * 1000}
+            if intent is not None and intent["classification"] == "chat":
+                return {"intent": intent, "graph_decision": None, "queries": [], "mode": "rules", "timings": timings}
+            if intent is not None and graph_decision is not None:
+                start = time.perf_counter()
+                queries = await self.generate_queries(question=question, table_name=table_name, schema=schema)
+                timings["sql_generation"] = (time.perf_counter() - start) * 1000
+                return {
+                    "intent": intent,
+                    "graph_decision": graph_decision,
+                    "queries": queries,
+                    "mode": "rules",
+                    "timings": timings
+                }
+
+        if mode == "planner":
+            start = time.perf_counter()
+            try:
+                plan = await self._plan_single_call(question, table_name, schema)
+                plan["mode"] = "planner"
+                plan["timings"] = {"planner_call": (time.perf_counter() - start) * 1000}
+                return plan
+            except (StructuredOutputError, KeyError, TypeError) as e:
+                logger.warning("Planner output unusable (%s: %s), falling back to parallel calls", type(e).__name__, e)
+
+        return await self._plan_parallel(question, table_name, schema)
+
+    async def _plan_single_call(self, question: str, table_name: str, schema: str | None = None) -> Dict[str, Any]:
+        """One model call returning intent, graph decision and queries together"""
+
+        plan = await self._structured(
+            "planner",
+            PLAN_TOOL,
+            max_tokens=2500,
+            system=self._system(
+                f"""{self.system_prompt}
+
+                You also act as the request planner. For every question decide, in a single answer:
+
+                A. INTENT
+                {self.intent_prompt}
+
+                B. GRAPH DECISION
+                {self.graph_prompt}
+
+                C. SQL QUERIES (only when classification is "analyze")
+                Generate SQL queries to answer with SPECIFIC NUMBERS.
+
+                Record the plan with the plan tool, for example:
+                {{
                 "classification": "analyze",
-                "response": null
+                "response": null,
+                "include_graph": true,
+                "graph_type": "bar",
+                "reasoning": "User asked to 'show' leads by source, which is perfect for a bar chart comparison",
+                "queries": [
+                    {{
+                    "sql": "SELECT ...",
+                    "description": "What this calculates",
+                    "metric_name": "Total Leads"
+                    }}
+                ]
+                }}
+
+                For "chat", set "include_graph" to false, "graph_type" to "none" and "queries" to [].""",
+                self._schema_block("planner", table_name, schema)
+            ),
+            messages=[{"role": "user", "content": f'Question: "{question}"'}]
+        )
+
+        return self._plan_from_json(plan)
+
+    @staticmethod
+    def _plan_from_json(plan: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate one planner answer and split it into intent, graph decision and queries"""
+        queries = plan.get("queries") or []
+        if not isinstance(queries, list) or any("sql" not in q for q in queries):
+            raise TypeError("queries must be a list of objects with an 'sql' key")
+        if plan["classification"] == "analyze" and not queries:
+            raise KeyError("queries")
+
+        return {
+            "intent": {
+                "classification": plan["classification"],
+                "response": plan.get("response")
+            },
+            "graph_decision": {
+                "include_graph": bool(plan.get("include_graph", False)),
+                "graph_type": plan.get("graph_type") or "none",
+                "reasoning": plan.get("reasoning", "")
+            },
+            "queries": queries
+        }
+
+    async def plan_batch(
+        self,
+        questions: List[str],
+        table_name: str,
+        schema: str | None = None,
+        chunk_size: int = 10
+    ) -> List[Dict[str, Any]]:
+        """
+        Plan many questions about one table with one planner call per chunk of questions,
+        the chunks running concurrently. Questions the local rules settle as chat need no
+        call; a question missing from, or malformed in, a chunk's answer is planned on its own.
+        Returns one {"intent", "graph_decision", "queries"} per question, in input order.
+        """
+        plans: List[Dict[str, Any] | None] = [None] * len(questions)
+        decided: Dict[int, Tuple[Dict[str, Any] | None, Dict[str, Any] | None]] = {}
+        pending = []
+        for i, question in enumerate(questions):
+            intent = self.rules.classify_intent(question) if self.rules else None
+            if intent is not None and intent["classification"] == "chat":
+                plans[i] = {"intent": intent, "graph_decision": None, "queries": []}
+                continue
+            decided[i] = (intent, self.rules.graph_decision(question) if self.rules else None)
+            pending.append(i)
+
+        async def plan_chunk(indexes: List[int]) -> None:
+            try:
+                answers = await self._plan_batch_call([questions[i] for i in indexes], table_name, schema)
+            except StructuredOutputError as e:
+                logger.warning("Batch planner output unusable (%s: %s), planning questions one by one", type(e).__name__, e)
+                answers = {}
+            for position, i in enumerate(indexes):
+                # The rules agree with the model on clear-cut questions; keep them authoritative.
+                # The intent is applied before validation, so a model "chat" the rules call
+                # "analyze" has no queries and is planned on its own.
+                intent, graph_decision = decided[i]
+                try:
+                    answer = answers[position]
+                    if intent is not None:
+                        answer = {**answer, "classification": intent["classification"], "response": intent.get("response")}
+                    plan = self._plan_from_json(answer)
+                except (KeyError, TypeError, IndexError, AttributeError):
+                    plan = await self.plan_analysis(questions[i], table_name, mode="parallel", schema=schema)
+                    plan.pop("mode")
+                    plan.pop("timings")
+                plan["intent"] = intent or plan["intent"]
+                plan["graph_decision"] = graph_decision or plan["graph_decision"]
+                plans[i] = plan
+
+        await asyncio.gather(*(
+            plan_chunk(pending[start:start + chunk_size]) for start in range(0, len(pending), chunk_size)
+        ))
+        return plans
+
+    async def _plan_batch_call(self, questions: List[str], table_name: str, schema: str | None) -> Dict[int, Any]:
+        """One planner call for a numbered list of questions; returns the answers by position"""
+        numbered = "\n".join(f'{i}. "{question}"' for i, question in enumerate(questions))
+        answer = await self._structured(
+            "batch_planner",
+            BATCH_PLAN_TOOL,
+            max_tokens=min(8000, 600 * len(questions) + 500),
+            system=self._system(
+                f"""{self.system_prompt}
+
+                You also act as the request planner. For every question decide:
+
+                A. INTENT
+                {self.intent_prompt}
+
+                B. GRAPH DECISION
+                {self.graph_prompt}
+
+                C. SQL QUERIES (only when classification is "analyze")
+                Generate SQL queries to answer with SPECIFIC NUMBERS.
+
+                Record one plan per question, in the same order, with the plans tool, for example:
+                {{
+                "plans": [
+                {{
+                "index": 0,
+                "classification": "analyze",
+                "response": null,
+                "include_graph": true,
+                "graph_type": "bar",
+                "reasoning": "User asked to 'show' leads by source, which is perfect for a bar chart comparison",
+                "queries": [
+                    {{
+                    "sql": "SELECT ...",
+                    "description": "What this calculates",
+                    "metric_name": "Total Leads"
+                    }}
+                ]
+                }}
+                ]
+                }}
+
+                For "chat", set "include_graph" to false, "graph_type" to "none" and "queries" to [].""",
+                self._schema_block("batch_planner", table_name, schema)
+            ),
+            messages=[{"role": "user", "content": f"Questions:\n{numbered}"}]
+        )
+
+        return {plan["index"]: plan for plan in answer["plans"]}
+
+    async def _plan_parallel(self, question: str, table_name: str, schema: str | None = None) -> Dict[str, Any]:
+        """
+        Run classify_intent, should_generate_graph and generate_queries concurrently.
+        For a chat question the graph decision and queries, or their errors, are dropped.
+        """
+
+        async def timed(coro):
+            start = time.perf_counter()
+            result = await coro
+            return result, (time.perf_counter() - start) * 1000
+
+        intent_result, graph_result, queries_result = await asyncio.gather(
+            timed(self.classify_intent(question)),
+            timed(self.should_generate_graph(question)),
+            timed(self.generate_queries(question=question, table_name=table_name, schema=schema)),
+            return_exceptions=True
+        )
+        if isinstance(intent_result, BaseException):
+            raise intent_result
+        intent, intent_ms = intent_result
+        if intent["classification"] == "chat":
+            # The graph and SQL calls were speculative; a greeting may yield no valid queries at all
+            return {
+                "intent": intent,
+                "graph_decision": None,
+                "queries": [],
+                "mode": "parallel",
+                "timings": {"intent": intent_ms}
             }
+        for result in (graph_result, queries_result):
+            if isinstance(result, BaseException):
+                raise result
+        (graph_decision, graph_ms), (queries, queries_ms) = graph_result, queries_result
 
-            Response format for "chat":
-            {
-                "classification": "chat",
-                "response": "[A polite response to the user's chat, followed by a sentence guiding them to ask specific data analysis questions]"
+        return {
+            "intent": intent,
+            "graph_decision": graph_decision,
+            "queries": queries,
+            "mode": "parallel",
+            "timings": {
+                "intent": intent_ms,
+                "graph_decision": graph_ms,
+                "sql_generation": queries_ms
             }
-            example for chat: 
-            "Hello! I'm doing great. I'm here to help you analyze your lead data. You can ask me questions like 'How many qualified leads do we have?' or 'Show me the trend of leads over the last month'."
-            """,
-            messages=[{
-                "role": "user",
-                "content": f"""Question: "{question}"\n\nReturn JSON classification."""
-            }]
-        )
-        
-        content = response.content[0].text
-        if "```json" in content:
-            content = content.split("```json")[1].split("```")[0].strip()
-        
-        return json.loads(content)
\ No newline at end of file
+        }
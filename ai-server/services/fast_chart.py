@@ -0,0 +1,227 @@
+import math
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# matplotlib's default (tab10) cycle, so both engines colour series the same way
+PALETTE = [
+    (31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40), (148, 103, 189),
+    (140, 86, 75), (227, 119, 194), (127, 127, 127), (188, 189, 34), (23, 190, 207),
+]
+BACKGROUND = (255, 255, 255)
+PLOT_BACKGROUND = (234, 234, 242)
+GRID = (255, 255, 255)
+TEXT = (38, 38, 38)
+
+
+@lru_cache(maxsize=8)
+def _font(size: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def _text_size(draw: ImageDraw.ImageDraw, text: str, font) -> Tuple[int, int]:
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    return right - left, bottom - top
+
+
+def _nice_ticks(low: float, high: float, count: int = 5) -> np.ndarray:
+    """Round tick positions covering [low, high]"""
+    if high == low:
+        high = low + 1
+    raw_step = (high - low) / count
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(m * magnitude for m in (1, 2, 2.5, 5, 10) if m * magnitude >= raw_step)
+    start = math.floor(low / step) * step
+    stop = math.ceil(high / step) * step
+    return np.arange(start, stop + step / 2, step)
+
+
+def _format_tick(value: float) -> str:
+    if abs(value) >= 1000 and float(value).is_integer():
+        return f"{int(value):,}"
+    return f"{value:g}"
+
+
+def _series(datasets: List[Dict]) -> List[Tuple[str, np.ndarray]]:
+    series = []
+    for i, dataset in enumerate(datasets):
+        values = np.array([v if isinstance(v, (int, float)) else np.nan for v in dataset.get('data', [])], dtype=float)
+        series.append((str(dataset.get('label', f'Dataset {i+1}')), values))
+    return series
+
+
+def _draw_rotated(image: Image.Image, text: str, font, anchor_xy: Tuple[int, int]) -> None:
+    """Draw text rotated 45 degrees with its top-right corner at anchor_xy (under a tick)"""
+    probe = ImageDraw.Draw(image)
+    w, h = _text_size(probe, text, font)
+    label = Image.new('RGBA', (w + 4, h + 6), (0, 0, 0, 0))
+    ImageDraw.Draw(label).text((2, 0), text, font=font, fill=TEXT)
+    rotated = label.rotate(45, expand=True, resample=Image.BICUBIC)
+    x, y = anchor_xy
+    image.paste(rotated, (x - rotated.width, y), rotated)
+
+
+def _draw_axes(
+    image: Image.Image,
+    draw: ImageDraw.ImageDraw,
+    labels: List[str],
+    series: List[Tuple[str, np.ndarray]],
+    width: int,
+    height: int,
+    title_height: int
+) -> Tuple[Tuple[int, int, int, int], Any, np.ndarray]:
+    """Plot area, grid and y axis; returns the plot box, a value -> y mapper and the x tick centres"""
+    font = _font(12)
+    values = np.concatenate([s[1] for s in series]) if series else np.array([0.0])
+    values = values[~np.isnan(values)]
+    low = min(0.0, float(values.min())) if values.size else 0.0
+    high = max(0.0, float(values.max())) if values.size else 1.0
+    high += (high - low) * 0.05  # headroom so the tallest bar doesn't touch the frame
+    ticks = _nice_ticks(low, high)
+
+    tick_labels = [_format_tick(t) for t in ticks]
+    y_label_width = max(_text_size(draw, t, font)[0] for t in tick_labels)
+
+    # Room for x labels: straight if they fit their slot, rotated otherwise
+    slot = (width - y_label_width - 40) / max(len(labels), 1)
+    label_sizes = [_text_size(draw, str(label), font) for label in labels]
+    rotate = any(w > slot - 4 for w, _ in label_sizes)
+    longest = max((w for w, _ in label_sizes), default=0)
+    bottom_margin = int(longest * 0.72) + 24 if rotate else 28
+
+    box = (y_label_width + 16, title_height + 10, width - 20, height - bottom_margin)
+    left, top, right, bottom = box
+    draw.rectangle(box, fill=PLOT_BACKGROUND)
+
+    span = ticks[-1] - ticks[0]
+    to_y = lambda v: bottom - (np.asarray(v, dtype=float) - ticks[0]) / span * (bottom - top)
+
+    for tick, text in zip(ticks, tick_labels):
+        y = float(to_y(tick))
+        draw.line([(left, y), (right, y)], fill=GRID, width=1)
+        tw, th = _text_size(draw, text, font)
+        draw.text((left - tw - 6, y - th / 2 - 2), text, font=font, fill=TEXT)
+
+    centres = left + (np.arange(len(labels)) + 0.5) * (right - left) / max(len(labels), 1)
+    for x, label, (tw, _) in zip(centres, labels, label_sizes):
+        if rotate:
+            _draw_rotated(image, str(label), font, (int(x) + 4, bottom + 4))
+        else:
+            draw.text((x - tw / 2, bottom + 6), str(label), font=font, fill=TEXT)
+
+    return box, to_y, centres
+
+
+def _draw_legend(draw: ImageDraw.ImageDraw, names: List[str], box: Tuple[int, int, int, int]) -> None:
+    font = _font(12)
+    x_right, y = box[2] - 8, box[1] + 8
+    width = max(_text_size(draw, name, font)[0] for name in names) + 26
+    draw.rectangle((x_right - width - 6, y - 4, x_right, y + 18 * len(names)), fill=(255, 255, 255))
+    for i, name in enumerate(names):
+        colour = PALETTE[i % len(PALETTE)]
+        draw.rectangle((x_right - width, y + 3, x_right - width + 14, y + 13), fill=colour)
+        draw.text((x_right - width + 20, y), name, font=font, fill=TEXT)
+        y += 18
+
+
+def _bar(image, draw, labels, series, width, height, title_height) -> None:
+    box, to_y, centres = _draw_axes(image, draw, labels, series, width, height, title_height)
+    slot = (box[2] - box[0]) / max(len(labels), 1)
+    bar_width = 0.8 * slot / max(len(series), 1)
+    zero = float(to_y(0))
+    for i, (_, values) in enumerate(series):
+        offset = bar_width * i - (bar_width * len(series) / 2)
+        tops = to_y(np.nan_to_num(values[:len(centres)]))
+        for x, y in zip(centres + offset, tops):
+            draw.rectangle((x, min(y, zero), x + bar_width - 1, max(y, zero)), fill=PALETTE[i % len(PALETTE)])
+    if series:
+        _draw_legend(draw, [name for name, _ in series], box)
+
+
+def _line(image, draw, labels, series, width, height, title_height) -> None:
+    box, to_y, centres = _draw_axes(image, draw, labels, series, width, height, title_height)
+    for i, (_, values) in enumerate(series):
+        colour = PALETTE[i % len(PALETTE)]
+        n = min(len(values), len(centres))
+        points = [(float(x), float(y)) for x, y, v in zip(centres[:n], to_y(values[:n]), values[:n]) if not np.isnan(v)]
+        if len(points) > 1:
+            draw.line(points, fill=colour, width=2, joint="curve")
+        for x, y in points:
+            draw.ellipse((x - 4, y - 4, x + 4, y + 4), fill=colour)
+    if series:
+        _draw_legend(draw, [name for name, _ in series], box)
+
+
+def _pie(image, draw, labels, series, width, height, title_height) -> None:
+    font = _font(12)
+    values = np.nan_to_num(series[0][1]) if series else np.array([])
+    values = np.clip(values, 0, None)
+    total = values.sum()
+    if total <= 0:
+        return
+    radius = min(width, height - title_height) * 0.32
+    cx, cy = width / 2, title_height + (height - title_height) / 2
+    # Start at 12 o'clock and go counter-clockwise, like matplotlib's startangle=90
+    ends = -90 - np.cumsum(values) / total * 360
+    starts = np.concatenate([[-90.0], ends[:-1]])
+    for i, (start, end, value) in enumerate(zip(starts, ends, values)):
+        if value <= 0:
+            continue
+        draw.pieslice((cx - radius, cy - radius, cx + radius, cy + radius), end, start, fill=PALETTE[i % len(PALETTE)])
+        middle = math.radians((start + end) / 2)
+        percent = f"{value / total * 100:.1f}%"
+        pw, ph = _text_size(draw, percent, font)
+        draw.text((cx + math.cos(middle) * radius * 0.6 - pw / 2, cy + math.sin(middle) * radius * 0.6 - ph / 2), percent, font=font, fill=TEXT)
+        if i < len(labels):
+            text = str(labels[i])
+            lw, lh = _text_size(draw, text, font)
+            lx = cx + math.cos(middle) * radius * 1.12
+            ly = cy + math.sin(middle) * radius * 1.12 - lh / 2
+            draw.text((lx if math.cos(middle) >= 0 else lx - lw, ly), text, font=font, fill=TEXT)
+
+
+def render_fast_chart(
+    graph_data: Dict[str, Any],
+    target: Any,
+    graph_type: str = "auto",
+    width: int = 800,
+    height: int = 600
+) -> None:
+    """
+    Render Chart.js-style graph_data ({"labels", "datasets": [{"label", "data"}], "title"})
+    as a PNG to a path or file object.
+
+    Draws straight onto a Pillow canvas with NumPy for the geometry, skipping
+    matplotlib's figure setup and layout passes. Supports bar, line and pie;
+    other types are drawn as bars, like the matplotlib engine.
+    """
+    if graph_type == "auto":
+        graph_type = graph_data.get('type', 'bar')
+
+    labels = [str(label) for label in graph_data.get('labels', [])]
+    series = _series(graph_data.get('datasets', []))
+
+    image = Image.new('RGB', (width, height), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+
+    title_height = 12
+    if 'title' in graph_data:
+        title_font = _font(16)
+        tw, th = _text_size(draw, str(graph_data['title']), title_font)
+        draw.text(((width - tw) / 2, 10), str(graph_data['title']), font=title_font, fill=TEXT)
+        title_height = th + 22
+
+    if graph_type == "line":
+        _line(image, draw, labels, series, width, height, title_height)
+    elif graph_type == "pie":
+        _pie(image, draw, labels, series, width, height, title_height)
+    else:
+        _bar(image, draw, labels, series, width, height, title_height)
+
+    image.save(target, format='PNG', compress_level=1)
@@ -1,157 +1,376 @@
-import matplotlib
-matplotlib.use('Agg')  # Non-GUI backend
-import matplotlib.pyplot as plt
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
-import base64
 from typing import Dict, Any, List, Literal
 
+from services.admission import CapacityPool, Overloaded
+from services.graph_store import GraphStore
+from services.singleflight import SingleFlight
+from services.telemetry import tracer
+
+logger = logging.getLogger(__name__)
+
+GRAPH_STYLE = 'seaborn-v0_8-darkgrid'
+
+
+class RenderUnavailable(Exception):
+    """Raised when the render queue is full, a render times out or a worker dies"""
+
+
+def _init_worker(style: str) -> None:
+    """Runs once in each worker process: import matplotlib, apply the style and warm the font cache"""
+    import matplotlib
+    matplotlib.use('Agg')  # Non-GUI backend
+    import matplotlib.style
+    matplotlib.style.use(style)
+    _save_matplotlib_graph(
+        {'labels': ['warm-up'], 'datasets': [{'label': 'warm-up', 'data': [1]}], 'title': 'warm-up'},
+        BytesIO(), 'bar', 200, 150
+    )
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _render_in_worker(
+    graph_data: Dict[str, Any],
+    filepath: str,
+    graph_type: str,
+    width: int,
+    height: int
+) -> None:
+    _save_matplotlib_graph(graph_data, filepath, graph_type, width, height)
+
+
+def _save_matplotlib_graph(
+    graph_data: Dict[str, Any],
+    target: Any,
+    graph_type: str,
+    width: int,
+    height: int
+) -> None:
+    """
+    Save graph using Matplotlib's object-oriented API.
+    Each call owns its Figure, so no pyplot global state is touched.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    try:
+        # Create figure
+        fig = Figure(figsize=(width/100, height/100), dpi=100)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+
+        # Extract data
+        labels = graph_data.get('labels', [])
+        datasets = graph_data.get('datasets', [])
+
+        # Auto-detect type
+        if graph_type == "auto":
+            graph_type = graph_data.get('type', 'bar')
+
+        # Create chart based on type
+        if graph_type == "bar":
+            _create_matplotlib_bar(ax, labels, datasets)
+        elif graph_type == "line":
+            _create_matplotlib_line(ax, labels, datasets)
+        elif graph_type == "pie":
+            _create_matplotlib_pie(ax, labels, datasets)
+        else:
+            _create_matplotlib_bar(ax, labels, datasets)
+
+        # Set title
+        if 'title' in graph_data:
+            ax.set_title(graph_data['title'], fontsize=14, fontweight='bold')
+
+        fig.tight_layout()
+
+        # Save to file
+        fig.savefig(target, format='png', bbox_inches='tight', dpi=100)
+
+    except Exception as e:
+        logger.warning("Error generating Matplotlib graph: %s", e)
+        if isinstance(target, str):
+            _save_error_image(str(e), target)
+
+
+def _create_matplotlib_bar(ax, labels: List, datasets: List[Dict]):
+    """Create bar chart with matplotlib"""
+    import numpy as np
+
+    x = np.arange(len(labels))
+    width = 0.8 / len(datasets) if datasets else 0.8
+
+    for i, dataset in enumerate(datasets):
+        offset = width * i - (width * len(datasets) / 2) + width / 2
+        ax.bar(
+            x + offset,
+            dataset.get('data', []),
+            width,
+            label=dataset.get('label', f'Dataset {i+1}'),
+            alpha=0.8
+        )
+
+    ax.set_xticks(x)
+    ax.set_xticklabels(labels, rotation=45, ha='right')
+    ax.legend()
+    ax.grid(axis='y', alpha=0.3)
+
+
+def _create_matplotlib_line(ax, labels: List, datasets: List[Dict]):
+    """Create line chart with matplotlib"""
+    for dataset in datasets:
+        ax.plot(
+            labels,
+            dataset.get('data', []),
+            marker='o',
+            label=dataset.get('label', 'Data'),
+            linewidth=2
+        )
+
+    ax.legend()
+    ax.grid(alpha=0.3)
+    for tick in ax.get_xticklabels():
+        tick.set_rotation(45)
+        tick.set_horizontalalignment('right')
+
+
+def _create_matplotlib_pie(ax, labels: List, datasets: List[Dict]):
+    """Create pie chart with matplotlib"""
+    dataset = datasets[0] if datasets else {}
+
+    ax.pie(
+        dataset.get('data', []),
+        labels=labels,
+        autopct='%1.1f%%',
+        startangle=90
+    )
+    ax.axis('equal')
+
+
+def _save_error_image(error_msg: str, filepath: str) -> None:
+    """Generate error placeholder image and save to file"""
+    from PIL import Image, ImageDraw
+
+    img = Image.new('RGB', (800, 600), color='white')
+    draw = ImageDraw.Draw(img)
+
+    # Draw error message
+    text = f"Error generating graph:\n{error_msg[:100]}"
+    draw.text((50, 250), text, fill='red')
+
+    # Save to file
+    img.save(filepath, format='PNG')
+
+
 class GraphService:
-    def __init__(self):
-        # Set default style
-        plt.style.use('seaborn-v0_8-darkgrid')
-    
+    """
+    Renders charts in a pool of worker processes.
+
+    Workers import matplotlib and apply the style once at start-up, so requests
+    only pay for drawing. The event loop never blocks on a render: callers await
+    the worker's result, with a bounded number of renders waiting and a timeout.
+    Images are content-addressed in a GraphStore, so a repeated chart is not redrawn.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_queue: int = 32,
+        render_timeout: float = 30.0,
+        output_dir: str = "static/images",
+        style: str = GRAPH_STYLE,
+        store: GraphStore | None = None
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.render_timeout = render_timeout
+        self.store = store or GraphStore(output_dir)
+        self.output_dir = self.store.directory
+        self.style = style
+        self._executor: ProcessPoolExecutor | None = None
+        # One slot per worker; up to max_queue renders are in flight, counting the running ones
+        self.pool = CapacityPool("render", workers, max_queue=max(max_queue - workers, 0), max_wait=render_timeout)
+        self.rendered = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.flight = SingleFlight("generate_graph_file")
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: workers start clean instead of inheriting the server's threads and sockets
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.style,)
+            )
+        return self._executor
+
+    async def warm_up(self) -> None:
+        """
+        Start every worker process now rather than on the first chart request; each
+        applies the style and draws a throwaway chart (_init_worker). The fast engine's
+        module is imported alongside, off the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(
+            asyncio.to_thread(importlib.import_module, "services.fast_chart"),
+            *(loop.run_in_executor(executor, _ping) for _ in range(self.workers))
+        )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(
+        self,
+        graph_data: Dict[str, Any],
+        graph_type: str = "auto",
+        engine: Literal["matplotlib", "fast"] = "matplotlib",
+        width: int = 800,
+        height: int = 600
+    ) -> str:
+        """
+        Render with the chosen engine, or reuse the stored image of an identical chart;
+        concurrent requests for the same chart share one render.
+        matplotlib renders in the worker pool, "fast" (Pillow/NumPy) in a thread; both take
+        a slot in the render pool.
+        Returns the filename of the saved image, or raises RenderUnavailable.
+        """
+        filename = self.store.filename_for(graph_data, graph_type, engine, width, height)
+        with tracer.span("render", engine, graph_type=graph_type) as span:
+            if self.store.lookup(filename):
+                span["outcome"] = "stored"
+                return filename
+            span["outcome"] = "rendered"
+            return await self.flight.do(
+                filename, lambda: self._render(graph_data, filename, graph_type, engine, width, height)
+            )
+
+    async def _render(
+        self,
+        graph_data: Dict[str, Any],
+        filename: str,
+        graph_type: str,
+        engine: Literal["matplotlib", "fast"],
+        width: int,
+        height: int
+    ) -> str:
+        """
+        Render under a render-pool slot: matplotlib in a worker process, "fast" in a thread.
+        The slot is held until the render itself finishes, not until the caller stops
+        waiting, so renders abandoned on timeout or cancellation still count against
+        the pool and its queue bound.
+        """
+        try:
+            started = await self.pool.acquire()
+        except Overloaded as e:
+            self.rejected += 1
+            raise RenderUnavailable(str(e))
+
+        filepath = self.store.temp_path(filename)
+        loop = asyncio.get_running_loop()
+        try:
+            if engine == "fast":
+                from services.fast_chart import render_fast_chart
+                future = loop.run_in_executor(None, render_fast_chart, graph_data, filepath, graph_type, width, height)
+            else:
+                future = loop.run_in_executor(
+                    self._get_executor(), _render_in_worker, graph_data, filepath, graph_type, width, height
+                )
+        except BaseException:
+            self.pool.release(None, started)
+            raise
+        future.add_done_callback(lambda f: self._finished(f, started))
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.render_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            # The render may still finish writing the temp file; the sweeper removes it later
+            raise RenderUnavailable(f"Render timed out after {self.render_timeout:g}s")
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next request
+            self._executor = None
+            self.store.discard(filepath)
+            raise RenderUnavailable("Render worker crashed")
+        except Exception as e:
+            if engine != "fast":
+                raise
+            # matplotlib workers save their own error image; the fast engine's is saved here
+            logger.warning("Error generating fast graph: %s", e)
+            _save_error_image(str(e), filepath)
+
+        self.store.commit(filepath, filename)
+        self.rendered += 1
+        return filename
+
+    def _finished(self, future: asyncio.Future, started: float) -> None:
+        """The render is done (or was dropped at shutdown): give its slot back"""
+        if not future.cancelled():
+            # Retrieved here too, as an abandoned render's error has no other reader
+            future.exception()
+        self.pool.release(None, started)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pool_size': self.workers,
+            'pool_started': self._executor is not None,
+            'in_flight': self.pool.active + self.pool.queued,
+            'queue_depth': self.pool.queued,
+            'max_queue': self.max_queue,
+            'rendered': self.rendered,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'store': self.store.stats()
+        }
+
     def generate_graph_file(
         self,
         graph_data: Dict[str, Any],
         output_dir: str = "static/images",
         graph_type: str = "auto",
-        engine: Literal["matplotlib"] = "matplotlib",  # Only matplotlib supported
+        engine: Literal["matplotlib", "fast"] = "matplotlib",
         width: int = 800,
         height: int = 600
     ) -> str:
         """
-        Generate graph and save to file
-        
+        Generate graph and save to file, in the calling process
+
         Args:
             graph_data: Data from Claude containing labels, datasets, etc.
             output_dir: Directory to save image
             graph_type: bar, line, pie, scatter, etc.
-            engine: matplotlib only
+            engine: matplotlib, or fast (Pillow/NumPy)
             width, height: Image dimensions
-            
+
         Returns:
-            Filename of the saved image
+            Filename of the saved image, named by a hash of its inputs
         """
-        import uuid
-        import os
-        
         # Ensure directory exists
         os.makedirs(output_dir, exist_ok=True)
-        
-        filename = f"{uuid.uuid4()}.png"
+
+        filename = GraphStore.filename_for(graph_data, graph_type, engine, width, height)
         filepath = os.path.join(output_dir, filename)
-        
-        # Always use matplotlib
-        self._save_matplotlib_graph(graph_data, filepath, graph_type, width, height)
-            
+
+        if engine == "fast":
+            from services.fast_chart import render_fast_chart
+            render_fast_chart(graph_data, filepath, graph_type, width, height)
+        else:
+            import matplotlib
+            matplotlib.use('Agg')  # Non-GUI backend
+            import matplotlib.style
+            matplotlib.style.use(self.style)
+            _save_matplotlib_graph(graph_data, filepath, graph_type, width, height)
+
         return filename
-    
-    def _save_matplotlib_graph(
-        self,
-        graph_data: Dict[str, Any],
-        filepath: str,
-        graph_type: str,
-        width: int,
-        height: int
-    ) -> None:
-        """Save graph using Matplotlib"""
-        
-        try:
-            # Create figure
-            fig, ax = plt.subplots(figsize=(width/100, height/100), dpi=100)
-            
-            # Extract data
-            labels = graph_data.get('labels', [])
-            datasets = graph_data.get('datasets', [])
-            
-            # Auto-detect type
-            if graph_type == "auto":
-                graph_type = graph_data.get('type', 'bar')
-            
-            # Create chart based on type
-            if graph_type == "bar":
-                self._create_matplotlib_bar(ax, labels, datasets)
-            elif graph_type == "line":
-                self._create_matplotlib_line(ax, labels, datasets)
-            elif graph_type == "pie":
-                self._create_matplotlib_pie(ax, labels, datasets)
-            else:
-                self._create_matplotlib_bar(ax, labels, datasets)
-            
-            # Set title
-            if 'title' in graph_data:
-                ax.set_title(graph_data['title'], fontsize=14, fontweight='bold')
-            
-            plt.tight_layout()
-            
-            # Save to file
-            plt.savefig(filepath, format='png', bbox_inches='tight', dpi=100)
-            plt.close(fig)
-            
-        except Exception as e:
-            print(f"Error generating Matplotlib graph: {e}")
-            plt.close('all')
-            self._save_error_image(str(e), filepath)
-    
-    def _create_matplotlib_bar(self, ax, labels: List, datasets: List[Dict]):
-        """Create bar chart with matplotlib"""
-        import numpy as np
-        
-        x = np.arange(len(labels))
-        width = 0.8 / len(datasets) if datasets else 0.8
-        
-        for i, dataset in enumerate(datasets):
-            offset = width * i - (width * len(datasets) / 2) + width / 2
-            ax.bar(
-                x + offset,
-                dataset.get('data', []),
-                width,
-                label=dataset.get('label', f'Dataset {i+1}'),
-                alpha=0.8
-            )
-        
-        ax.set_xticks(x)
-        ax.set_xticklabels(labels, rotation=45, ha='right')
-        ax.legend()
-        ax.grid(axis='y', alpha=0.3)
-    
-    def _create_matplotlib_line(self, ax, labels: List, datasets: List[Dict]):
-        """Create line chart with matplotlib"""
-        for dataset in datasets:
-            ax.plot(
-                labels,
-                dataset.get('data', []),
-                marker='o',
-                label=dataset.get('label', 'Data'),
-                linewidth=2
-            )
-        
-        ax.legend()
-        ax.grid(alpha=0.3)
-        plt.xticks(rotation=45, ha='right')
-    
-    def _create_matplotlib_pie(self, ax, labels: List, datasets: List[Dict]):
-        """Create pie chart with matplotlib"""
-        dataset = datasets[0] if datasets else {}
-        
-        ax.pie(
-            dataset.get('data', []),
-            labels=labels,
-            autopct='%1.1f%%',
-            startangle=90
-        )
-        ax.axis('equal')
-    
-    def _save_error_image(self, error_msg: str, filepath: str) -> None:
-        """Generate error placeholder image and save to file"""
-        from PIL import Image, ImageDraw, ImageFont
-        
-        img = Image.new('RGB', (800, 600), color='white')
-        draw = ImageDraw.Draw(img)
-        
-        # Draw error message
-        text = f"Error generating graph:\n{error_msg[:100]}"
-        draw.text((50, 250), text, fill='red')
-        
-        # Save to file
-        img.save(filepath, format='PNG')
\ No newline at end of file
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import re
+import time
+import uuid
+from typing import Any, Dict
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from services.cache_service import cache_key
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed chart files: <32 hex chars of the input hash>.png
+GRAPH_NAME_RE = re.compile(r'^[0-9a-f]{32}\.png$')
+
+
+class GraphStore:
+    """
+    Content-addressed image store for rendered charts.
+
+    A chart's filename is a hash of everything that affects its pixels, so an
+    identical chart is served from disk without rendering. Files are written to a
+    temporary name and renamed into place, and a sweeper keeps the directory
+    within a size and age budget, evicting the least recently used files first.
+    """
+
+    def __init__(
+        self,
+        directory: str = "static/images",
+        max_bytes: int = 512 * 1024 * 1024,
+        max_age: float = 7 * 24 * 3600,
+        sweep_interval: float = 600.0
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.last_sweep: Dict[str, Any] | None = None
+
+    @staticmethod
+    def filename_for(graph_data: Dict[str, Any], graph_type: str, engine: str, width: int, height: int) -> str:
+        return cache_key("graph", graph_data, graph_type, engine, width, height)[:32] + ".png"
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def lookup(self, filename: str) -> bool:
+        """True if the chart is already on disk; marks it as recently used"""
+        try:
+            os.utime(self.path(filename))
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def temp_path(self, filename: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return self.path(f".{filename}.{uuid.uuid4().hex}.tmp")
+
+    def commit(self, temp_path: str, filename: str) -> None:
+        """Atomically move a finished render into place"""
+        os.replace(temp_path, self.path(filename))
+
+    def discard(self, temp_path: str) -> None:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+    def sweep(self) -> Dict[str, Any]:
+        """Delete expired charts, then the least recently used ones until under max_bytes"""
+        now = time.time()
+        files = []
+        removed = 0
+        freed = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            entries = []
+
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            is_temp = entry.name.startswith(".") and entry.name.endswith(".tmp")
+            if not (entry.name.endswith(".png") or is_temp):
+                continue  # leave placeholder.jpg and anything else alone
+            stat = entry.stat()
+            # Abandoned temp files only count once they are clearly not in progress
+            expired = now - stat.st_mtime > (3600 if is_temp else self.max_age)
+            if expired:
+                removed, freed = self._remove(entry.path, stat.st_size, removed, freed)
+            elif not is_temp:
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        kept = len(files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            removed, freed = self._remove(path, size, removed, freed)
+            total -= size
+            kept -= 1
+
+        self.evicted += removed
+        self.last_sweep = {
+            'at': now,
+            'removed': removed,
+            'bytes_freed': freed,
+            'files': kept,
+            'bytes': total
+        }
+        return self.last_sweep
+
+    @staticmethod
+    def _remove(path: str, size: int, removed: int, freed: int):
+        try:
+            os.remove(path)
+            return removed + 1, freed + size
+        except FileNotFoundError:
+            return removed, freed
+
+    async def run_sweeper(self) -> None:
+        """Background task: sweep now and then every sweep_interval seconds"""
+        while True:
+            try:
+                result = await asyncio.to_thread(self.sweep)
+                if result['removed']:
+                    logger.info("Graph store sweep removed %d files (%d bytes)", result['removed'], result['bytes_freed'])
+            except Exception as e:
+                logger.warning("Graph store sweep failed: %s", e)
+            await asyncio.sleep(self.sweep_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'evicted': self.evicted,
+            'max_bytes': self.max_bytes,
+            'max_age_seconds': self.max_age,
+            'last_sweep': self.last_sweep
+        }
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles with long-lived caching for content-addressed charts: their ETag is the
+    content hash and they are marked immutable, since a given name never changes.
+    """
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope,
+        status_code: int = 200
+    ) -> Response:
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        name = os.path.basename(full_path)
+        if GRAPH_NAME_RE.match(name):
+            response.headers["etag"] = f'"{name[:-4]}"'
+            response.headers["cache-control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["cache-control"] = "public, max-age=3600"
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,360 @@
+import asyncio
+import codecs
+import csv
+import io
+import logging
+import random
+import re
+import time
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List
+
+import httpx
+
+from services.query_service import QueryError, QueryService
+from services.table_catalog import TABLE_NAME_RE
+from services.telemetry import ingest_rows
+
+logger = logging.getLogger(__name__)
+
+# create_leads_table's columns, in insert order; id is derived from the upload and row number
+LEAD_COLUMNS = ("date", "lead_owner", "source", "deal_stage", "account_id", "first_name", "last_name", "company")
+INSERT_COLUMNS = ["id", *LEAD_COLUMNS]
+# Normalised CSV headers that name a lead column under another name
+HEADER_ALIASES = {
+    "lead_date": "date", "created": "date", "created_at": "date",
+    "owner": "lead_owner", "lead_source": "source", "stage": "deal_stage",
+    "account": "account_id", "accountid": "account_id", "firstname": "first_name",
+    "lastname": "last_name", "company_name": "company",
+}
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%Y/%m/%d", "%m-%d-%Y", "%d.%m.%Y")
+ISO_DATETIME_RE = re.compile(r'^(\d{4}-\d{2}-\d{2})[T ]')
+# Row ids are uuid5(namespace, "<upload id>:<row number>"), so a re-sent row is recognised as a duplicate
+ROW_ID_NAMESPACE = uuid.UUID("6f1c2a53-9c1e-4d8b-a2f4-3e5b7c9d0a11")
+
+
+class IngestError(Exception):
+    """Raised when an upload can't start: unreadable CSV, no lead columns, no rows, or a bad upload id"""
+
+
+def normalize_header(name: str) -> str | None:
+    """The lead column a CSV header names ("Lead Owner" -> lead_owner), or None"""
+    key = re.sub(r'[^a-z0-9]+', '_', name.strip().lower()).strip('_')
+    key = HEADER_ALIASES.get(key, key)
+    return key if key in LEAD_COLUMNS else None
+
+
+@lru_cache(maxsize=8192)
+def normalize_date(value: str) -> str | None:
+    """
+    An ISO date for the date column, or None if the value isn't a date in a known format.
+    Cached: an upload repeats a few hundred distinct dates, and strptime dominates parsing.
+    """
+    match = ISO_DATETIME_RE.match(value)
+    if match:
+        value = match.group(1)
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+class CsvRecordStream:
+    """
+    Parses CSV incrementally from byte chunks.
+
+    Only the unfinished last record is held back between chunks. A newline ends a
+    record when it falls outside quotes, which is tracked by quote parity, so
+    quoted fields may span lines and chunk boundaries.
+    """
+
+    def __init__(self, encoding: str = "utf-8-sig", max_record_bytes: int = 1024 * 1024):
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self.max_record_bytes = max_record_bytes
+        self.pending = ""
+        self.quoted = False  # inside a quoted field at the end of pending
+
+    def feed(self, data: bytes, final: bool = False) -> List[List[str]]:
+        """Add a chunk; returns the records it completed"""
+        text = self.decoder.decode(data, final)
+        scanned = len(self.pending)
+        self.pending += text
+        if final:
+            complete, self.pending, self.quoted = self.pending, "", False
+        else:
+            boundary = -1
+            quoted = self.quoted
+            for match in re.finditer(r'["\n]', text):
+                if match.group() == '"':
+                    quoted = not quoted
+                elif not quoted:
+                    boundary = scanned + match.start()
+            self.quoted = quoted
+            complete, self.pending = self.pending[:boundary + 1], self.pending[boundary + 1:]
+            if len(self.pending) > self.max_record_bytes:
+                raise IngestError(f"A record is longer than {self.max_record_bytes} bytes (unclosed quote?)")
+        if not complete:
+            return []
+        try:
+            return [record for record in csv.reader(io.StringIO(complete)) if record]
+        except csv.Error as e:
+            raise IngestError(f"Invalid CSV: {e}") from e
+
+
+class CsvIngestor:
+    """
+    Streams CSV uploads into new lead tables.
+
+    The body is parsed as it arrives. Rows are normalised to the create_leads_table
+    schema and inserted in batches, with up to max_in_flight batches in flight. When
+    the database falls behind, reading stops until a batch finishes, so memory stays
+    bounded whatever the file size.
+
+    Row ids are derived from the upload id and row number, and inserts skip rows
+    that already exist, so a failed upload can be sent again with resume: rows up
+    to the last contiguous committed one are skipped, and any later rows that did
+    land are not duplicated. The master_uploads row is added only once every row
+    is in, so a partial table never shows up in the catalog.
+    """
+
+    def __init__(
+        self,
+        query_service: QueryService,
+        batch_size: int = 1000,
+        max_in_flight: int = 4,
+        max_retries: int = 3,
+        backoff_base: float = 0.25,
+        keep: int = 100
+    ):
+        self.query_service = query_service
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.keep = keep
+        # Progress of the latest uploads by upload id, oldest first
+        self.uploads: Dict[str, Dict[str, Any]] = {}
+
+    def progress(self, upload_id: str) -> Dict[str, Any] | None:
+        return self.uploads.get(upload_id)
+
+    def _start(self, filename: str, upload_id: str | None, resume: bool) -> Dict[str, Any]:
+        """The progress record for a new or resumed upload"""
+        if upload_id is not None and not TABLE_NAME_RE.match(upload_id):
+            raise IngestError("upload_id may only contain letters, digits and underscores")
+        previous = self.uploads.get(upload_id) if upload_id else None
+        if resume:
+            if upload_id is None:
+                raise IngestError("resume needs the upload_id of the failed upload")
+            if previous is not None and previous["status"] != "failed":
+                raise IngestError(f"Upload {upload_id} is {previous['status']}, not failed")
+        elif previous is not None:
+            raise IngestError(f"Upload {upload_id} already exists")
+        if upload_id is None:
+            # Same ids the frontend used: milliseconds since the epoch
+            upload_id = str(time.time_ns() // 1_000_000)
+            while upload_id in self.uploads:
+                upload_id = str(int(upload_id) + 1)
+
+        self.uploads.pop(upload_id, None)
+        while len(self.uploads) >= self.keep:
+            self.uploads.pop(next(iter(self.uploads)))
+        progress = self.uploads[upload_id] = {
+            "upload_id": upload_id,
+            "table_name": f"leads_{upload_id}",
+            "filename": filename,
+            "status": "running",
+            "resumed_from": previous["rows_committed"] if previous else 0,
+            # A resume without a record (e.g. after a restart) assumes the table was created
+            "table_created": previous["table_created"] if previous else resume,
+            "bytes_read": 0,
+            "rows_read": 0,
+            "rows_inserted": 0,
+            "rows_committed": previous["rows_committed"] if previous else 0,  # every row before this is stored
+            "rows_skipped": 0,  # rows with neither a date nor a lead owner
+            "invalid_dates": 0,  # dates in no known format, stored as null
+            "unmapped_columns": [],
+            "batches": 0,
+            "elapsed_ms": 0.0,
+            "rows_per_second": None,
+            "error": None,
+        }
+        return progress
+
+    async def ingest(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        upload_id: str | None = None,
+        resume: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Ingest one CSV body. Returns the upload's progress, with status "complete",
+        or "failed" and the error when a batch couldn't be stored (resume from there).
+        Raises IngestError for a file that can't be ingested at all.
+        """
+        progress = self._start(filename, upload_id, resume)
+        start = time.perf_counter()
+        try:
+            await self._run(chunks, progress)
+        except IngestError as e:
+            progress["status"], progress["error"] = "failed", str(e)
+            raise
+        except (QueryError, httpx.HTTPError) as e:
+            progress["status"], progress["error"] = "failed", str(e) or type(e).__name__
+            logger.warning("Upload %s failed after %d rows: %s", progress["upload_id"], progress["rows_committed"], e)
+        except BaseException as e:
+            # The client went away, or an unexpected bug: keep the progress resumable
+            progress["status"], progress["error"] = "failed", str(e) or type(e).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            progress["elapsed_ms"] = round(elapsed * 1000, 2)
+            progress["rows_per_second"] = round(progress["rows_inserted"] / elapsed, 1) if elapsed else None
+        return progress
+
+    async def _run(self, chunks: AsyncIterator[bytes], progress: Dict[str, Any]) -> None:
+        table_name = progress["table_name"]
+        parser = CsvRecordStream()
+        skip_until = progress["rows_committed"]
+        slots = asyncio.Semaphore(self.max_in_flight)
+        in_flight: set = set()
+        finished: Dict[int, int] = {}  # batch start row -> end row, for batches past rows_committed
+        failure: List[BaseException] = []
+        header: List[str | None] | None = None
+        batch: List[Dict[str, Any]] = []
+        batch_start = skip_until
+        row_number = 0
+
+        async def send(first: int, end: int, rows: List[Dict[str, Any]]) -> None:
+            try:
+                await self._insert(table_name, rows)
+            except BaseException as e:
+                failure.append(e)
+                return
+            finally:
+                slots.release()
+            progress["rows_inserted"] += len(rows)
+            ingest_rows.inc(len(rows), outcome="inserted")
+            finished[first] = end
+            while progress["rows_committed"] in finished:
+                progress["rows_committed"] = finished.pop(progress["rows_committed"])
+
+        async def dispatch(end: int) -> None:
+            nonlocal batch, batch_start
+            if not progress["table_created"]:
+                await self.query_service.create_leads_table(table_name)
+                progress["table_created"] = True
+            # Backpressure: wait for a free slot before reading further
+            await slots.acquire()
+            if failure:
+                slots.release()
+                raise failure[0]
+            task = asyncio.ensure_future(send(batch_start, end, batch))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            progress["batches"] += 1
+            batch, batch_start = [], end
+
+        def take(records: List[List[str]]) -> None:
+            nonlocal header, row_number
+            for record in records:
+                if header is None:
+                    header = [normalize_header(name) for name in record]
+                    if not any(header):
+                        raise IngestError(f"No lead columns in the CSV header; expected some of {', '.join(LEAD_COLUMNS)}")
+                    progress["unmapped_columns"] = [name for name, column in zip(record, header) if column is None]
+                    continue
+                row_number += 1
+                progress["rows_read"] = row_number
+                if row_number <= skip_until:
+                    continue
+                row = self._row(header, record, progress)
+                if row is None:
+                    progress["rows_skipped"] += 1
+                    ingest_rows.inc(outcome="skipped")
+                    continue
+                row["id"] = str(uuid.uuid5(ROW_ID_NAMESPACE, f"{progress['upload_id']}:{row_number}"))
+                batch.append(row)
+
+        try:
+            async for chunk in chunks:
+                progress["bytes_read"] += len(chunk)
+                for record in parser.feed(chunk):
+                    take([record])
+                    if len(batch) >= self.batch_size:
+                        await dispatch(row_number)
+            take(parser.feed(b"", final=True))
+            if header is None or row_number == 0:
+                raise IngestError("CSV file is empty")
+            if batch:
+                await dispatch(row_number)
+            elif not progress["table_created"]:
+                raise IngestError("CSV file has no rows with a date or lead owner")
+            if in_flight:
+                await asyncio.wait(list(in_flight))
+            if failure:
+                raise failure[0]
+            # Any rows after the last batch were skipped ones
+            progress["rows_committed"] = row_number
+        finally:
+            for task in list(in_flight):
+                task.cancel()
+
+        await self.query_service.register_upload(progress["filename"], progress["upload_id"])
+        progress["status"] = "complete"
+        logger.info(
+            "Upload %s: %d rows into %s in %d batches",
+            progress["upload_id"], progress["rows_inserted"], table_name, progress["batches"]
+        )
+
+    @staticmethod
+    def _row(header: List[str | None], record: List[str], progress: Dict[str, Any]) -> Dict[str, Any] | None:
+        """One CSV record as a lead row, or None for a row with neither a date nor a lead owner"""
+        row = dict.fromkeys(LEAD_COLUMNS)
+        for column, value in zip(header, record):
+            if column is not None:
+                row[column] = value.strip() or None
+        if row["date"] is not None:
+            date = normalize_date(row["date"])
+            if date is None:
+                progress["invalid_dates"] += 1
+            row["date"] = date
+        if row["date"] is None and row["lead_owner"] is None:
+            return None
+        return row
+
+    async def _insert(self, table_name: str, rows: List[Dict[str, Any]]) -> None:
+        """
+        Insert one batch, retrying connection errors, 5xx answers and the 404 PostgREST
+        returns until its schema cache has picked up a table created a moment ago.
+        """
+        attempt = 0
+        while True:
+            try:
+                return await self.query_service.insert_rows(table_name, rows, INSERT_COLUMNS)
+            except (QueryError, httpx.HTTPError) as e:
+                status = getattr(e, "status_code", None)
+                retryable = isinstance(e, httpx.HTTPError) or status == 404 or (status or 0) >= 500
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                delay = random.uniform(0, self.backoff_base * 2 ** attempt)
+                logger.warning("Insert into %s failed (%s), retry %d in %.2fs", table_name, e, attempt, delay)
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """Upload counts by status, and the rows and throughput of the latest uploads"""
+        by_status: Dict[str, int] = {}
+        for progress in self.uploads.values():
+            by_status[progress["status"]] = by_status.get(progress["status"], 0) + 1
+        return {
+            "batch_size": self.batch_size,
+            "max_in_flight": self.max_in_flight,
+            "uploads": by_status,
+            "recent": list(self.uploads.values())[-10:],
+        }
@@ -0,0 +1,115 @@
+import re
+from typing import Any, Dict
+
+# Words that only make sense as a question about the lead tables
+DATA_TERMS_RE = re.compile(
+    r"\b(leads?|deals?|sources?|stages?|owners?|compan(?:y|ies)|accounts?|pipeline|conversions?|"
+    r"qualified|won|lost|disqualified|contacted|proposals?|on hold|re-engagement|referrals?|linkedin|"
+    r"webinars?|ads|campaigns?|prospects?|customers?|records?|rows?|data(?:set)?|table|uploads?|"
+    r"how many|count|total|number of|average|avg|percent(?:age)?|top|most|least|highest|lowest|"
+    r"trend|breakdown|distribution|list|compare|month|week|year|quarter)\b"
+)
+GREETING_RE = re.compile(
+    r"^(hi|hello|hey|hiya|yo|howdy|greetings|good (?:morning|afternoon|evening)|"
+    r"thanks|thank you|thx|cheers|bye|goodbye|see you|ok|okay|cool|great|nice)"
+    r"(?: there| team| all| everyone| again| so much| a lot)?$"
+)
+SMALL_TALK_RE = re.compile(
+    r"^(how are you(?: doing| today)?|how's it going|what's up|whats up|who are you|what are you|"
+    r"what can you do|what do you do|how do you work|what is this|help|can you help(?: me)?)$"
+)
+# Questions about the assistant itself, whatever follows: "what can you do with my data"
+CAPABILITY_RE = re.compile(r"^(what can you do|what do you do|how do you work|what can i ask)\b")
+THANKS_RE = re.compile(r"^(thanks|thank you|thx|cheers)")
+
+CHART_TYPE_RES = [
+    ("pie", re.compile(r"\bpie\b|\bdonut\b|\bdoughnut\b")),
+    ("line", re.compile(r"\bline (?:chart|graph|plot)\b")),
+    ("scatter", re.compile(r"\bscatter\b|\bcorrelat\w*\b")),
+    ("bar", re.compile(r"\bbar (?:chart|graph)\b|\bhistogram\b|\bcolumn chart\b")),
+]
+TIME_RE = re.compile(
+    r"\b(trends?|over time|timeline|growth|monthly|weekly|daily|month over month|week over week|"
+    r"(?:by|per|each|every) (?:day|week|month|quarter|year)|over the (?:last|past) \w+ (?:days|weeks|months))\b"
+)
+GROUP_RE = re.compile(
+    r"\b(per|each|across|breakdown|break down|distribution|compare|comparison|versus|vs|split)\b"
+    # "by" groups only when a dimension (the upload columns), a period or a measure follows:
+    # "leads by source" or "companies by number of leads", not "leads created by John"
+    r"|\bby (?:the |each |lead |deal )?(?:sources?|stages?|owners?|compan(?:y|ies)|accounts?|status(?:es)?|"
+    r"first names?|last names?|dates?|days?|weeks?|months?|quarters?|years?|number|count|total|volume)\b"
+)
+VISUAL_RE = re.compile(r"\b(visuali[sz]e|chart|graph|plot|draw)\b")
+PROPORTION_RE = re.compile(r"\b(percent(?:age)?s?|proportions?|shares?|ratio)\b|%")
+SINGLE_VALUE_RE = re.compile(
+    r"^(how many|what(?: is|'s) the (?:total|number|count|average)|what is our total|"
+    r"count (?:the |all )?|total (?:number|count)|number of|is there|are there|do we have|does)\b"
+)
+LIST_RE = re.compile(
+    r"^(list|give me (?:a |the )?list|show (?:me )?(?:all |the )?(?:records|rows|details)|"
+    r"which (?:leads|deals|accounts|companies) (?:are|were|have)|who are the)\b"
+)
+
+CHAT_RESPONSE = (
+    "Hello! I'm here to help you analyze your lead data. You can ask me questions like "
+    "'How many qualified leads do we have?' or 'Show me the trend of leads over the last month'."
+)
+THANKS_RESPONSE = (
+    "You're welcome! Ask me anything else about your leads, for example "
+    "'Which source brings the most qualified leads?'"
+)
+
+
+def normalize(question: str) -> str:
+    text = question.strip().lower()
+    text = re.sub(r"[!?.,;:]+", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class RuleClassifier:
+    """
+    Keyword/regex versions of the intent and graph rules in ClaudeService's prompts.
+
+    Each method returns a decision only when a rule clearly applies, and None
+    when the question is ambiguous so the caller asks the model instead.
+    Decisions take microseconds; benchmarks/eval_intent.py measures how often
+    they fire and how often they agree with the labeled question set.
+    """
+
+    def classify_intent(self, question: str) -> Dict[str, Any] | None:
+        """{"classification": "analyze" | "chat", "response": str | None}, or None if unsure"""
+        text = normalize(question)
+        if not text:
+            return None
+        if GREETING_RE.match(text) or SMALL_TALK_RE.match(text) or CAPABILITY_RE.match(text):
+            response = THANKS_RESPONSE if THANKS_RE.match(text) else CHAT_RESPONSE
+            return {"classification": "chat", "response": response}
+        if DATA_TERMS_RE.search(text):
+            # "thanks, that is the most helpful" or "thanks, now count the leads": the model decides
+            if THANKS_RE.match(text):
+                return None
+            return {"classification": "analyze", "response": None}
+        return None
+
+    def graph_decision(self, question: str) -> Dict[str, Any] | None:
+        """{"include_graph", "graph_type", "reasoning"}, or None if unsure"""
+        text = normalize(question)
+        for graph_type, pattern in CHART_TYPE_RES:
+            if pattern.search(text):
+                return self._decision(True, graph_type, f"Asked for a {graph_type} chart")
+        grouped = GROUP_RE.search(text)
+        if TIME_RE.search(text):
+            return self._decision(True, "line", "Trend over time")
+        if LIST_RE.match(text) and not grouped:
+            return self._decision(False, "none", "Asked for a list of records")
+        if grouped and PROPORTION_RE.search(text):
+            return self._decision(True, "pie", "Proportions across categories")
+        if grouped or VISUAL_RE.search(text):
+            return self._decision(True, "bar", "Comparison across categories")
+        if SINGLE_VALUE_RE.match(text) and not PROPORTION_RE.search(text):
+            return self._decision(False, "none", "Asked for a single number")
+        return None
+
+    @staticmethod
+    def _decision(include_graph: bool, graph_type: str, reasoning: str) -> Dict[str, Any]:
+        return {"include_graph": include_graph, "graph_type": graph_type, "reasoning": f"Rule: {reasoning}"}
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from services.query_service import QueryService
+from services.table_catalog import TableCatalog
+from services.validation_service import UnsafeQuery, tokenize
+
+logger = logging.getLogger(__name__)
+
+# The fixed schema create_leads_table uses, for tables the catalog has no columns for
+LEADS_COLUMNS = [
+    ('id', 'uuid'), ('date', 'date'), ('lead_owner', 'text'), ('source', 'text'), ('deal_stage', 'text'),
+    ('account_id', 'text'), ('first_name', 'text'), ('last_name', 'text'), ('company', 'text'),
+]
+
+# Columns questions group and filter by; indexed so GROUP BY can scan the index alone
+INDEXED_COLUMNS = ('date', 'source', 'deal_stage', 'lead_owner')
+
+SQLITE_TYPES = {
+    'integer': 'INTEGER', 'bigint': 'INTEGER', 'smallint': 'INTEGER', 'boolean': 'INTEGER',
+    'numeric': 'REAL', 'real': 'REAL', 'double precision': 'REAL',
+}
+
+# Postgres syntax SQLite would reject or, worse, run with different meaning
+POSTGRES_ONLY_RE = re.compile(
+    r"::|~|\bilike\b|\bsimilar\s+to\b|\binterval\b|\bdate_trunc\b|\bextract\b|\bto_char\b"
+    r"|\bdate_part\b|\bage\s*\(|\bnow\s*\(|\barray_agg\b|\bstring_agg\b|\bpercentile_\w+\b",
+    re.IGNORECASE
+)
+# SQLite runs these with another meaning: CAST('2024-01-15' AS DATE) is the integer 2024, and
+# CURRENT_DATE is a UTC string, so CURRENT_DATE - 30 is a number and comparisons with it match
+# whatever sorts after it as text
+DATE_TYPES = {'date', 'timestamp', 'timestamptz', 'time', 'timetz'}
+CURRENT_TIME_WORDS = {'current_date', 'current_timestamp', 'current_time', 'localtime', 'localtimestamp'}
+FUNCTION_COLUMN_RE = re.compile(r'^\s*(\w+)\s*\(.*\)\s*$', re.DOTALL)
+# Keywords that end an ORDER BY list at its own nesting level
+ORDER_BY_END = {'limit', 'offset', 'fetch', 'for', 'union', 'intersect', 'except', 'window', 'rows', 'range', 'groups'}
+
+
+class LocalUnsupported(Exception):
+    """The local engine can't answer this query; run it on the database instead"""
+
+
+class LocalEngine:
+    """
+    In-process SQLite mirror of the lead tables.
+
+    Lead tables only change on upload, so each one is snapshotted once per upload
+    version and queries against it run in-process instead of as an RPC round trip.
+    sync() follows the table catalog: new uploads are loaded, replaced or deleted
+    ones are dropped. ORDER BY terms are given Postgres's NULL placement
+    (postgres_null_order). Anything the mirror can't answer exactly (a table that isn't
+    loaded yet, Postgres-only syntax or semantics (needs_postgres), a SQLite error)
+    raises LocalUnsupported and
+    the caller falls back to the database.
+    """
+
+    def __init__(
+        self,
+        query_service: QueryService,
+        catalog: TableCatalog,
+        max_table_rows: int = 200000,
+        page_size: int = 1000,
+        sync_interval: float = 30.0
+    ):
+        self.query_service = query_service
+        self.catalog = catalog
+        self.max_table_rows = max_table_rows
+        self.page_size = page_size
+        self.sync_interval = sync_interval
+        # table_name -> loaded upload version
+        self.versions: Dict[str, str] = {}
+        # Opened on first use, so a process that forks workers holds no connection
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._sync_lock = asyncio.Lock()
+        self.hits = 0
+        self.fallbacks = 0
+        self.loaded_rows = 0
+        self._loads = 0
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """The in-memory database. Callers hold _lock."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+            # Postgres LIKE is case-sensitive; SQLite's isn't by default
+            self._conn.execute("PRAGMA case_sensitive_like = ON")
+        return self._conn
+
+    def supports(self, table_name: str, version: str | None) -> bool:
+        return version is not None and self.versions.get(table_name) == version
+
+    async def execute(self, sql: str, table_name: str, version: str | None) -> List[Dict[str, Any]]:
+        """Run a validated SELECT against the mirror, or raise LocalUnsupported"""
+        if not self.supports(table_name, version):
+            self.fallbacks += 1
+            raise LocalUnsupported(f"{table_name} is not loaded at version {version}")
+        try:
+            if needs_postgres(sql):
+                self.fallbacks += 1
+                raise LocalUnsupported("Query uses Postgres-only syntax")
+            sql = postgres_null_order(sql)
+        except UnsafeQuery as e:
+            self.fallbacks += 1
+            raise LocalUnsupported(str(e))
+        try:
+            rows = await asyncio.to_thread(self._query, sql)
+        except sqlite3.Error as e:
+            self.fallbacks += 1
+            raise LocalUnsupported(f"SQLite: {e}")
+        self.hits += 1
+        return rows
+
+    def _query(self, sql: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            cursor = self._db.execute(sql)
+            names = [_postgres_column_name(d[0]) for d in cursor.description or []]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    async def sync(self) -> None:
+        """Bring the mirror in line with the catalog: load new versions, drop stale tables"""
+        async with self._sync_lock:
+            await self.catalog.refresh()
+            wanted = {
+                name: info for name, info in self.catalog.tables.items()
+                if info['row_count'] is not None and info['row_count'] <= self.max_table_rows
+            }
+            for name in [name for name in self.versions if name not in wanted]:
+                await asyncio.to_thread(self._drop, name)
+            for name, info in wanted.items():
+                if self.versions.get(name) == info['version']:
+                    continue
+                start = time.perf_counter()
+                try:
+                    rows = await self._fetch_rows(name)
+                except Exception as e:
+                    logger.warning("Local engine: could not snapshot %s: %s", name, e)
+                    continue
+                columns = [(c['name'], c['type']) for c in info['columns']] or LEADS_COLUMNS
+                await asyncio.to_thread(self.load_table, name, info['version'], columns, rows)
+                logger.info("Local engine: loaded %s (%d rows) in %.0fms", name, len(rows), (time.perf_counter() - start) * 1000)
+
+    async def _fetch_rows(self, table_name: str) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        while True:
+            page = await self.query_service.get_table_rows(table_name, offset=len(rows), limit=self.page_size)
+            rows.extend(page)
+            if len(page) < self.page_size:
+                return rows
+
+    def load_table(self, table_name: str, version: str, columns: List[Tuple[str, str]], rows: List[Dict[str, Any]]) -> None:
+        """Replace a table's snapshot; queries keep seeing the old one until it's swapped in"""
+        staging = f"{table_name}__loading"
+        column_defs = ", ".join(f'"{name}" {SQLITE_TYPES.get(pg_type, "TEXT")}' for name, pg_type in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        values = [tuple(row.get(name) for name, _ in columns) for row in rows]
+        with self._lock:
+            self._db.execute(f'DROP TABLE IF EXISTS "{staging}"')
+            self._db.execute(f'CREATE TABLE "{staging}" ({column_defs})')
+            self._db.executemany(f'INSERT INTO "{staging}" VALUES ({placeholders})', values)
+            self._loads += 1
+            for name in INDEXED_COLUMNS:
+                if any(column == name for column, _ in columns):
+                    self._db.execute(f'CREATE INDEX "ix{self._loads}_{name}" ON "{staging}" ("{name}")')
+            self._db.execute(f'ANALYZE "{staging}"')
+            self._db.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            self._db.execute(f'ALTER TABLE "{staging}" RENAME TO "{table_name}"')
+            self._db.commit()
+            self.versions[table_name] = version
+            self.loaded_rows += len(rows)
+
+    def _drop(self, table_name: str) -> None:
+        with self._lock:
+            self._db.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            self._db.commit()
+            self.versions.pop(table_name, None)
+
+    def invalidate(self, table_name: str | None = None) -> None:
+        """Stop answering from a table's snapshot (e.g. rows were edited); the next sync reloads it"""
+        for name in [table_name] if table_name else list(self.versions):
+            if name in self.versions:
+                self._drop(name)
+
+    async def run_sync_loop(self) -> None:
+        """Background task: sync now and then every sync_interval seconds"""
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning("Local engine sync failed: %s", e)
+            await asyncio.sleep(self.sync_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'tables': len(self.versions),
+            'hits': self.hits,
+            'fallbacks': self.fallbacks,
+            'loaded_rows': self.loaded_rows
+        }
+
+
+def _postgres_column_name(name: str) -> str:
+    """Name an unaliased result column the way Postgres would (COUNT(*) -> count)"""
+    match = FUNCTION_COLUMN_RE.match(name)
+    return match.group(1).lower() if match else name
+
+
+def needs_postgres(sql: str) -> bool:
+    """
+    Whether SQLite would reject the query or, worse, run it with a different meaning:
+    Postgres-only functions and operators (POSTGRES_ONLY_RE), casts to date and time
+    types, and any use of CURRENT_DATE and its relatives (arithmetic, comparisons).
+    Raises UnsafeQuery if the SQL can't be tokenized.
+    """
+    if POSTGRES_ONLY_RE.search(sql):
+        return True
+    tokens = [(kind, text.lower()) for kind, text in tokenize(sql) if kind not in ("space", "comment")]
+    for i, (kind, text) in enumerate(tokens):
+        if kind != "word":
+            continue
+        if text in CURRENT_TIME_WORDS:
+            return True
+        if text == "cast" and i + 1 < len(tokens) and tokens[i + 1][1] == "(":
+            depth = 0
+            for j in range(i + 1, len(tokens)):
+                if tokens[j][1] == "(":
+                    depth += 1
+                elif tokens[j][1] == ")":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                elif depth == 1 and tokens[j][1] == "as" and j + 1 < len(tokens) and tokens[j + 1][1] in DATE_TYPES:
+                    return True
+    return False
+
+
+def postgres_null_order(sql: str) -> str:
+    """
+    The query with an explicit NULLS FIRST / NULLS LAST on every ORDER BY term that has
+    none, matching Postgres: NULLs sort last ascending and first descending, where SQLite
+    sorts them first ascending. Without it, ORDER BY ... LIMIT on a nullable column
+    returns different rows locally. Covers subqueries and window ORDER BYs too.
+    """
+    tokens = tokenize(sql)
+    # Text to add after a token, by token index
+    inserts: Dict[int, str] = {}
+    # Open ORDER BY lists, innermost last: {"depth", "last" (index of the term's last token), "nulls", "desc"}
+    open_lists: List[Dict[str, Any]] = []
+    depth = 0
+    previous_word = None
+
+    def end_term(clause: Dict[str, Any]) -> None:
+        if clause["last"] is not None and not clause["nulls"]:
+            inserts[clause["last"]] = " NULLS FIRST" if clause["desc"] else " NULLS LAST"
+        clause.update(last=None, nulls=False, desc=False)
+
+    for i, (kind, text) in enumerate(tokens):
+        if kind in ("space", "comment"):
+            continue
+        word = text.lower() if kind == "word" else None
+        clause = open_lists[-1] if open_lists else None
+        at_clause_level = clause is not None and depth == clause["depth"]
+
+        if at_clause_level and (text in (",", ";", ")") or word in ORDER_BY_END):
+            end_term(clause)
+            if text != ",":
+                open_lists.pop()
+            # Still part of an enclosing ORDER BY term, e.g. a subquery's LIMIT or closing paren
+            for open_clause in open_lists:
+                if open_clause is not clause:
+                    open_clause["last"] = i
+        elif word == "by" and previous_word == "order":
+            open_lists.append({"depth": depth, "last": None, "nulls": False, "desc": False})
+        elif at_clause_level and word == "nulls":
+            clause["nulls"] = True
+        else:
+            if at_clause_level and word in ("asc", "desc"):
+                clause["desc"] = word == "desc"
+            for open_clause in open_lists:
+                open_clause["last"] = i
+
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        previous_word = word
+
+    for clause in reversed(open_lists):
+        end_term(clause)
+    return "".join(text + inserts.get(i, "") for i, (kind, text) in enumerate(tokens))
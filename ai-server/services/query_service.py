@@ -1,22 +1,271 @@
-from supabase import create_client, Client
-from typing import List, Dict, Any
+import asyncio
+import httpx
+import logging
+import time
+from typing import AsyncIterator, List, Dict, Any, Tuple
+
+from services.admission import CapacityPool
+from services.singleflight import SingleFlight
+from services.telemetry import result_rows, sql_governor, tracer
+
+logger = logging.getLogger(__name__)
+
+
+class QueryError(Exception):
+    """Raised when PostgREST rejects or fails a query"""
+
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
 
 class QueryService:
-    def __init__(self, supabase_url: str, supabase_key: str):
-        self.client: Client = create_client(supabase_url, supabase_key)
-    
-    def get_available_tables(self) -> List[str]:
+    def __init__(
+        self,
+        supabase_url: str,
+        supabase_key: str | None,
+        rest_path: str = "/rest/v1",
+        max_concurrency: int = 8,
+        timeout: float = 15.0,
+        max_connections: int = 20
+    ):
+        # Talk to PostgREST directly so any PostgREST in front of the same schema
+        # (Supabase, or a local PostgREST + Postgres) works as a backend
+        self.headers = {"Content-Type": "application/json"}
+        if supabase_key:
+            self.headers["apikey"] = supabase_key
+            self.headers["Authorization"] = f"Bearer {supabase_key}"
+        self.base_url = supabase_url.rstrip("/") + rest_path
+        self.max_connections = max_connections
+        # Created on first use (see client), so importing the server opens nothing
+        self._client: httpx.AsyncClient | None = None
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        # Identical SQL running concurrently (e.g. a team dashboard refresh) hits the database once
+        self.flight = SingleFlight("execute_query")
+        # Query RPCs in flight across all requests, one per pooled connection; a query that
+        # would wait longer than its timeout for a connection fails fast (Overloaded)
+        self.pool = CapacityPool("db", max_connections, max_wait=timeout)
+        # Cleared when the database has no execute_governed_query RPC (readonly_json.sql not re-run)
+        self.governed_rpc = True
+        self.cost_checked = 0
+        self.over_budget = 0
+        self.max_cost_seen = 0.0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The pooled PostgREST client, created on first use"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=30.0
+                )
+            )
+        return self._client
+
+    @client.setter
+    def client(self, client: httpx.AsyncClient) -> None:
+        self._client = client
+
+    async def aclose(self) -> None:
+        """Close the pooled HTTP connections"""
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def get_available_tables(self) -> List[str]:
         """Get list of lead tables"""
-        result = self.client.table('master_uploads')\
-            .select('table_name')\
-            .execute()
-        print(result)
+        data = await self.get_uploads()
         # pad table_name with 'leads_' prefix
-        return ['leads_' + row['table_name'] for row in result.data]
-    
-    def execute_query(self, sql: str) -> List[Dict[str, Any]]:
-        """Execute a read-only SQL query"""
-        result = self.client.rpc('execute_readonly_query', {
-            'query': sql
-        }).execute()
-        return result.data
\ No newline at end of file
+        return ['leads_' + row['table_name'] for row in data]
+
+    async def get_uploads(self, created_after: str | None = None) -> List[Dict[str, Any]]:
+        """Get master_uploads rows, oldest first, optionally only those newer than a created_at watermark"""
+        params = {"select": "id,filename,table_name,created_at", "order": "created_at.asc"}
+        if created_after:
+            params["created_at"] = f"gt.{created_after}"
+        with tracer.span("db", "get_uploads"):
+            response = await self.client.get("/master_uploads", params=params)
+            return self._json_or_raise(response)
+
+    async def get_table_rows(self, table_name: str, offset: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Read one page of a table's rows in primary key order (for snapshots)"""
+        with tracer.span("db", "get_table_rows"):
+            response = await self.client.get(
+                f"/{table_name}",
+                params={"select": "*", "order": "id.asc", "offset": offset, "limit": limit}
+            )
+            return self._json_or_raise(response)
+
+    async def create_leads_table(self, table_name: str) -> None:
+        """Create a lead table with the fixed upload schema (the create_leads_table RPC)"""
+        with tracer.span("db", "create_leads_table"):
+            response = await self.client.post("/rpc/create_leads_table", json={"table_name": table_name})
+            self._json_or_raise(response, empty_ok=True)
+
+    async def insert_rows(self, table_name: str, rows: List[Dict[str, Any]], columns: List[str]) -> None:
+        """
+        Bulk insert rows that all carry the same columns.
+        Rows whose primary key already exists are skipped, so a batch can be sent again safely.
+        """
+        with tracer.span("db", "insert_rows", rows=len(rows)):
+            response = await self.client.post(
+                f"/{table_name}",
+                params={"columns": ",".join(columns)},
+                json=rows,
+                headers={"Prefer": "return=minimal,resolution=ignore-duplicates"}
+            )
+            self._json_or_raise(response, empty_ok=True)
+
+    async def register_upload(self, filename: str, table_name: str) -> None:
+        """Add the master_uploads row that makes an upload's table visible"""
+        with tracer.span("db", "register_upload"):
+            response = await self.client.post(
+                "/master_uploads",
+                json={"filename": filename, "table_name": table_name},
+                headers={"Prefer": "return=minimal"}
+            )
+            self._json_or_raise(response, empty_ok=True)
+
+    async def execute_query(
+        self,
+        sql: str,
+        timeout: float | None = None,
+        max_cost: float | None = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Execute a read-only SQL query; concurrent calls with the same SQL share one round trip.
+        With max_cost, the database EXPLAINs the query first and refuses it (QueryError)
+        when the planner's cost estimate is over budget.
+        """
+
+        async def run() -> List[Dict[str, Any]]:
+            async with self.pool.slot(timeout=timeout):
+                if max_cost is not None and self.governed_rpc:
+                    response = await self.client.post(
+                        "/rpc/execute_governed_query",
+                        json={"query": sql, "max_cost": max_cost},
+                        timeout=timeout or self.timeout
+                    )
+                    if not self._missing_function(response):
+                        return self._governed_rows(self._json_or_raise(response), max_cost)
+                    logger.warning("execute_governed_query is missing; running queries without a cost budget")
+                    self.governed_rpc = False
+                response = await self.client.post(
+                    "/rpc/execute_readonly_query",
+                    json={"query": sql},
+                    timeout=timeout or self.timeout
+                )
+                return self._json_or_raise(response)
+
+        with tracer.span("db", "execute_query") as span:
+            rows = await self.flight.do(f"{max_cost}:{' '.join(sql.split())}", run)
+            span["rows"] = len(rows) if isinstance(rows, list) else None
+            result_rows.observe(span["rows"] or 0, source="supabase")
+            return rows
+
+    def _governed_rows(self, body: Dict[str, Any], max_cost: float) -> List[Dict[str, Any]]:
+        """The rows of an execute_governed_query answer, or QueryError when it was over budget"""
+        self.cost_checked += 1
+        self.max_cost_seen = max(self.max_cost_seen, body['cost'])
+        if body['rejected']:
+            self.over_budget += 1
+            sql_governor.inc(outcome="over_budget")
+            raise QueryError(f"Estimated cost {body['cost']:,.0f} exceeds the budget of {max_cost:,.0f}")
+        return body['rows']
+
+    async def execute_many(
+        self,
+        queries: List[Dict[str, Any]],
+        max_concurrency: int | None = None,
+        timeout: float | None = None,
+        max_cost: float | None = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Run a question's queries concurrently.
+
+        A failing or timed-out query doesn't fail the batch: every entry comes back,
+        in input order, as {"query", "data", "error", "elapsed_ms"} with either
+        data or error set.
+        """
+        results = [None] * len(queries)
+        async for index, result in self.iter_many(queries, max_concurrency, timeout, max_cost):
+            results[index] = result
+        return results
+
+    async def iter_many(
+        self,
+        queries: List[Dict[str, Any]],
+        max_concurrency: int | None = None,
+        timeout: float | None = None,
+        max_cost: float | None = None
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Like execute_many, but yields (index, result) as each query finishes.
+        Closing the iterator early cancels the queries still running.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+        timeout = timeout or self.timeout
+
+        async def run(index: int, query: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    data = await asyncio.wait_for(
+                        self.execute_query(query['sql'], timeout=timeout, max_cost=max_cost),
+                        timeout=timeout
+                    )
+                    error = None
+                except asyncio.TimeoutError:
+                    data, error = None, f"Query timed out after {timeout:g}s"
+                except (QueryError, httpx.HTTPError) as e:
+                    data, error = None, str(e) or type(e).__name__
+                return index, {
+                    'query': query,
+                    'data': data,
+                    'error': error,
+                    'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+                }
+
+        tasks = [asyncio.ensure_future(run(i, query)) for i, query in enumerate(queries)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "governed_rpc": self.governed_rpc,
+            "cost_checked": self.cost_checked,
+            "over_budget": self.over_budget,
+            "max_cost_seen": round(self.max_cost_seen, 2),
+        }
+
+    @staticmethod
+    def _missing_function(response: httpx.Response) -> bool:
+        """PostgREST's answer for an RPC the schema doesn't have"""
+        if response.status_code != 404:
+            return False
+        try:
+            return response.json().get('code') == "PGRST202"
+        except ValueError:
+            return False
+
+    @staticmethod
+    def _json_or_raise(response: httpx.Response, empty_ok: bool = False) -> Any:
+        """Return the JSON body, or raise QueryError with PostgREST's message"""
+        if response.is_success:
+            if empty_ok and not response.content:
+                return None
+            return response.json()
+        try:
+            message = response.json().get('message') or response.text
+        except ValueError:
+            message = response.text
+        raise QueryError(f"{response.status_code}: {message}", status_code=response.status_code)
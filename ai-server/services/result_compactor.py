@@ -0,0 +1,129 @@
+import json
+import re
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+ISO_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English/JSON text (~4 characters per token)"""
+    return (len(text) + 3) // 4
+
+
+def compact_json(value: Any) -> str:
+    return json.dumps(value, default=str, separators=(",", ":"))
+
+
+class ResultCompactor:
+    """
+    Shrinks query results before they are put in the analysis prompt.
+
+    Each result is sent column-wise ({"columns", "rows"}) rather than as one
+    object per row, capped at max_rows rows with long text cut to max_cell_chars.
+    When rows are dropped, a summary of every column over *all* rows is added
+    (non-null and distinct counts, top values, numeric stats, date range), so
+    totals and distributions stay exact even though the rows don't.
+    """
+
+    def __init__(self, max_rows: int = 50, max_cell_chars: int = 200, top_k: int = 5):
+        self.max_rows = max_rows
+        self.max_cell_chars = max_cell_chars
+        self.top_k = top_k
+
+    def compact(self, query_results: List[Dict], max_tokens: int | None = None) -> Tuple[List[Dict], Dict[str, Any]]:
+        """
+        Compact [{"query", "data"}] results. With max_tokens, fewer rows per result are kept
+        (halving down to one) until the results fit; the column summaries keep them exact.
+        Returns the compacted results and {"rows_in", "rows_out", "tokens_raw", "tokens_compact", "max_rows"}.
+        """
+        max_rows = self.max_rows
+        compacted = [self._compact_one(result, max_rows) for result in query_results]
+        while max_tokens is not None and max_rows > 1 and estimate_tokens(compact_json(compacted)) > max_tokens:
+            max_rows //= 2
+            compacted = [self._compact_one(result, max_rows) for result in query_results]
+        stats = {
+            'rows_in': sum(len(r['data'] or []) for r in query_results),
+            'rows_out': sum(len(r['rows']) for r in compacted),
+            'tokens_raw': sum(self._estimate_raw_tokens(r['data'] or []) for r in query_results),
+            'tokens_compact': estimate_tokens(compact_json(compacted)),
+            'max_rows': max_rows
+        }
+        return compacted, stats
+
+    def _compact_one(self, result: Dict, max_rows: int) -> Dict[str, Any]:
+        rows = result['data'] or []
+        if rows and not isinstance(rows[0], dict):
+            rows = [{'value': row} for row in rows]
+
+        columns: List[str] = []
+        for row in rows:
+            for column in row:
+                if column not in columns:
+                    columns.append(column)
+
+        kept = rows[:max_rows]
+        compacted = {
+            'query': result['query'],
+            'row_count': len(rows),
+            'columns': columns,
+            'rows': [[self._cell(row.get(column)) for column in columns] for row in kept]
+        }
+        if len(rows) > len(kept):
+            compacted['truncated'] = True
+            compacted['column_summaries'] = {
+                column: self.summarize([row.get(column) for row in rows]) for column in columns
+            }
+        return compacted
+
+    @staticmethod
+    def _estimate_raw_tokens(rows: List[Any], sample: int = 200) -> int:
+        """Prompt size the rows would have had uncompacted, extrapolated from a sample"""
+        if len(rows) <= sample:
+            return estimate_tokens(compact_json(rows))
+        return estimate_tokens(compact_json(rows[:sample])) * len(rows) // sample
+
+    def _cell(self, value: Any) -> Any:
+        if isinstance(value, str) and len(value) > self.max_cell_chars:
+            return value[:self.max_cell_chars] + "…"
+        if isinstance(value, (dict, list)):
+            text = compact_json(value)
+            return text if len(text) <= self.max_cell_chars else text[:self.max_cell_chars] + "…"
+        return value
+
+    def summarize(self, values: List[Any]) -> Dict[str, Any]:
+        """Summary of one column: counts plus numeric, date or top-value statistics"""
+        present = [v for v in values if v is not None]
+        summary: Dict[str, Any] = {'non_null': len(present), 'nulls': len(values) - len(present)}
+        if not present:
+            return summary
+
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+            numbers = np.asarray(present, dtype=float)
+            summary.update({
+                'min': _number(numbers.min()),
+                'max': _number(numbers.max()),
+                'mean': round(float(numbers.mean()), 4),
+                'median': _number(np.median(numbers)),
+                'sum': _number(numbers.sum())
+            })
+            return summary
+
+        counts = Counter(v if isinstance(v, str) else compact_json(v) for v in present)
+        summary['distinct'] = len(counts)
+
+        if all(isinstance(v, str) and ISO_DATE_RE.match(v) for v in present):
+            days = np.asarray([v[:10] for v in present], dtype='datetime64[D]')
+            summary['min'] = str(days.min())
+            summary['max'] = str(days.max())
+            return summary
+
+        summary['top'] = [[self._cell(value), count] for value, count in counts.most_common(self.top_k)]
+        return summary
+
+
+def _number(value: Any) -> int | float:
+    value = float(value)
+    return int(value) if value.is_integer() else round(value, 4)
@@ -0,0 +1,398 @@
+import asyncio
+import logging
+import re
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from services.query_service import QueryService
+from services.table_catalog import TableCatalog
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = ('date', 'source', 'deal_stage', 'lead_owner', 'company')
+
+# Cubes built up front for every upload; any other grouping is rolled up from the base on demand
+PRECOMPUTED = [
+    ('source',), ('deal_stage',), ('lead_owner',), ('company',),
+    ('date:day',), ('date:week',), ('date:month',),
+    ('source', 'deal_stage'), ('deal_stage', 'date:month'), ('source', 'date:month'), ('lead_owner', 'deal_stage'),
+]
+
+LITERAL = r"'(?:[^']|'')*'"
+QUERY_RE = re.compile(
+    r'^select\s+(?P<select>.+?)\s+from\s+"?(?P<table>\w+)"?'
+    r'(?:\s+where\s+(?P<where>.+?))?'
+    r'(?:\s+group\s+by\s+(?P<group>.+?))?'
+    r'(?:\s+order\s+by\s+(?P<order>.+?))?'
+    r'(?:\s+limit\s+(?P<limit>\d+))?\s*;?$',
+    re.IGNORECASE | re.DOTALL
+)
+ALIAS_RE = re.compile(r'^(?P<expr>.+?)(?:\s+as\s+"?(?P<alias>\w+)"?)?$', re.IGNORECASE | re.DOTALL)
+COUNT_RE = re.compile(r'^count\s*\(\s*(?:\*|1|"?id"?)\s*\)$', re.IGNORECASE)
+COLUMN_RE = re.compile(r'^"?(?P<column>\w+)"?$')
+DATE_TRUNC_RE = re.compile(
+    r"^date_trunc\s*\(\s*'(?P<bucket>day|week|month)'\s*,\s*\"?date\"?\s*\)(?P<cast>\s*::\s*date)?$", re.IGNORECASE
+)
+TO_CHAR_RE = re.compile(r"^to_char\s*\(\s*\"?date\"?\s*,\s*'(?P<format>YYYY-MM|YYYY-MM-DD)'\s*\)$", re.IGNORECASE)
+CONDITION_RE = re.compile(
+    rf'^"?(?P<column>\w+)"?\s*(?:(?P<op>=|<>|!=|>=|<=|>|<)\s*(?P<value>{LITERAL})'
+    rf'|(?P<negate>not\s+)?in\s*\((?P<values>{LITERAL}(?:\s*,\s*{LITERAL})*)\)'
+    r'|is\s+(?P<null>not\s+)?null)$',
+    re.IGNORECASE
+)
+ORDER_RE = re.compile(r'^(?P<expr>.+?)(?:\s+(?P<direction>asc|desc))?$', re.IGNORECASE | re.DOTALL)
+
+
+class Unsupported(Exception):
+    """The query is outside what the rollups can answer exactly"""
+
+
+def _split(text: str, separator: str = ",") -> List[str]:
+    """Split on a separator outside parentheses and string literals"""
+    parts, depth, quoted, current = [], 0, False, ""
+    pattern = re.compile(rf"\s+{separator}\s+", re.IGNORECASE) if separator.isalpha() else None
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0:
+            if pattern is None and char == separator:
+                parts.append(current.strip())
+                current, i = "", i + 1
+                continue
+            match = pattern.match(text, i) if pattern else None
+            if match:
+                parts.append(current.strip())
+                current, i = "", match.end()
+                continue
+        current += char
+        i += 1
+    parts.append(current.strip())
+    return parts
+
+
+def _literal(text: str) -> str:
+    return text[1:-1].replace("''", "'")
+
+
+class TableRollup:
+    """
+    One upload's counts, dictionary-encoded: for each dimension an int32 code per
+    (date, source, deal_stage, lead_owner, company) group, plus the group's row count.
+    """
+
+    def __init__(self, version: str, base_rows: List[Dict[str, Any]]):
+        self.version = version
+        self.values: Dict[str, List[Any]] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        for dimension in DIMENSIONS:
+            column = [row.get(dimension) for row in base_rows]
+            values = sorted({v for v in column if v is not None})
+            if any(v is None for v in column):
+                values.append(None)
+            index = {v: i for i, v in enumerate(values)}
+            self.values[dimension] = values
+            self.codes[dimension] = np.fromiter((index[v] for v in column), dtype=np.int32, count=len(column))
+        self.counts = np.fromiter((int(row['n']) for row in base_rows), dtype=np.int64, count=len(base_rows))
+        self.total = int(self.counts.sum())
+        self.cubes: Dict[Tuple[str, ...], List[Tuple[Tuple[Any, ...], int]]] = {}
+        for key in PRECOMPUTED:
+            self.cubes[key] = self.group(key, None)
+
+    def nbytes(self) -> int:
+        return self.counts.nbytes + sum(codes.nbytes for codes in self.codes.values())
+
+    def dimension(self, key: str) -> Tuple[np.ndarray, List[Any]]:
+        """Codes and values for a dimension, or a date bucket like "date:month" """
+        if ":" not in key:
+            return self.codes[key], self.values[key]
+        bucket = key.split(":")[1]
+        dates = self.values['date']
+        days = np.array([d if d is not None else 'NaT' for d in dates], dtype='datetime64[D]')
+        if bucket == "month":
+            starts = days.astype('datetime64[M]').astype('datetime64[D]')
+        elif bucket == "week":
+            # Postgres weeks start on Monday; day 0 (1970-01-01) was a Thursday
+            offsets = (days.astype(np.int64) + 3) % 7
+            starts = days - offsets.astype('timedelta64[D]')
+        else:
+            starts = days
+        labels = [str(d) if d is not None else None for d in (s if not np.isnat(s) else None for s in starts)]
+        values = sorted({v for v in labels if v is not None})
+        if None in labels:
+            values.append(None)
+        index = {v: i for i, v in enumerate(values)}
+        mapping = np.array([index[v] for v in labels], dtype=np.int32)
+        return mapping[self.codes['date']], values
+
+    def group(self, keys: Tuple[str, ...], mask: np.ndarray | None) -> List[Tuple[Tuple[Any, ...], int]]:
+        """Sum counts by the given dimensions over the rows selected by mask"""
+        counts = self.counts if mask is None else self.counts[mask]
+        if not keys:
+            return [((), int(counts.sum()))]
+        columns, values = [], []
+        for key in keys:
+            codes, dim_values = self.dimension(key)
+            columns.append(codes if mask is None else codes[mask])
+            values.append(dim_values)
+        if not counts.size:
+            return []
+        groups, inverse = np.unique(np.stack(columns), axis=1, return_inverse=True)
+        sums = np.bincount(inverse.ravel(), weights=counts, minlength=groups.shape[1])
+        return [
+            (tuple(values[d][groups[d, g]] for d in range(len(keys))), int(sums[g]))
+            for g in range(groups.shape[1])
+        ]
+
+
+class RollupStore:
+    """
+    Count cubes per upload, so group-by-and-count questions skip SQL.
+
+    Once per upload version, one GROUP BY over the fixed dimensions (date, source,
+    deal_stage, lead_owner, company) is fetched and dictionary-encoded. Common
+    cubes, including day/week/month date buckets, are built up front; other
+    groupings are rolled up from the base in NumPy. answer() recognises generated
+    queries of the form SELECT dims, COUNT(*) ... WHERE simple filters GROUP BY
+    dims ORDER BY ... LIMIT n, and returns None for anything else. ORDER BY may
+    name the count and dates but not the text dimensions, whose order depends on
+    the database collation.
+    """
+
+    def __init__(self, query_service: QueryService, catalog: TableCatalog, sync_interval: float = 30.0):
+        self.query_service = query_service
+        self.catalog = catalog
+        self.sync_interval = sync_interval
+        self.tables: Dict[str, TableRollup] = {}
+        self._sync_lock = asyncio.Lock()
+        self.precomputed_hits = 0
+        self.computed_hits = 0
+        self.fallthrough: Dict[str, int] = {'not_built': 0, 'unsupported': 0}
+
+    async def sync(self) -> None:
+        """Build rollups for new upload versions and drop those of removed tables"""
+        async with self._sync_lock:
+            await self.catalog.refresh()
+            for name in [name for name in self.tables if name not in self.catalog.tables]:
+                del self.tables[name]
+            for name, info in self.catalog.tables.items():
+                existing = self.tables.get(name)
+                if existing is not None and existing.version == info['version']:
+                    continue
+                if not set(DIMENSIONS) <= {c['name'] for c in info['columns']}:
+                    continue
+                start = time.perf_counter()
+                try:
+                    base = await self.query_service.execute_query(
+                        f'SELECT "date", source, deal_stage, lead_owner, company, COUNT(*) AS n '
+                        f'FROM "{name}" GROUP BY 1, 2, 3, 4, 5'
+                    )
+                except Exception as e:
+                    logger.warning("Rollups: could not build %s: %s", name, e)
+                    continue
+                rollup = await asyncio.to_thread(TableRollup, info['version'], base)
+                self.tables[name] = rollup
+                logger.info(
+                    "Rollups: built %s (%d groups, %d bytes) in %.0fms",
+                    name, len(base), rollup.nbytes(), (time.perf_counter() - start) * 1000
+                )
+
+    def invalidate(self, table_name: str | None = None) -> None:
+        if table_name is None:
+            self.tables = {}
+        else:
+            self.tables.pop(table_name, None)
+
+    async def run_sync_loop(self) -> None:
+        """Background task: sync now and then every sync_interval seconds"""
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning("Rollup sync failed: %s", e)
+            await asyncio.sleep(self.sync_interval)
+
+    def answer(self, sql: str, table_name: str, version: str | None) -> List[Dict[str, Any]] | None:
+        """Rows the query would return from Postgres, or None if it has to run as SQL"""
+        rollup = self.tables.get(table_name)
+        if rollup is None or rollup.version != version:
+            self.fallthrough['not_built'] += 1
+            return None
+        try:
+            rows, precomputed = self._answer(" ".join(sql.split()), table_name, rollup)
+        except Unsupported:
+            self.fallthrough['unsupported'] += 1
+            return None
+        if precomputed:
+            self.precomputed_hits += 1
+        else:
+            self.computed_hits += 1
+        return rows
+
+    def overview(self, table_name: str, version: str | None) -> Dict[str, Any] | None:
+        """Whole-table counts by source, deal stage and month, for the analysis prompt"""
+        rollup = self.tables.get(table_name)
+        if rollup is None or rollup.version != version:
+            return None
+
+        def cube(key):
+            return {str(values[0])[:7] if key[0] == 'date:month' else values[0]: n for values, n in rollup.cubes[key]}
+
+        return {
+            'total_rows': rollup.total,
+            'by_source': cube(('source',)),
+            'by_deal_stage': cube(('deal_stage',)),
+            'by_month': cube(('date:month',))
+        }
+
+    def _answer(self, sql: str, table_name: str, rollup: TableRollup) -> Tuple[List[Dict[str, Any]], bool]:
+        query = QUERY_RE.match(sql)
+        if not query or query['table'] != table_name:
+            raise Unsupported()
+
+        # SELECT list: dimensions (or date buckets) and at most one COUNT(*)
+        items = []  # (output name, dimension key or None for the count, formatter)
+        for part in _split(query['select']):
+            item = ALIAS_RE.match(part)
+            expr, alias = item['expr'].strip(), item['alias']
+            items.append((*self._select_item(expr, alias), expr.lower()))
+        dims = [key for _, key, _, _ in items if key is not None]
+        if sum(1 for _, key, _, _ in items if key is None) > 1 or len(set(dims)) != len(dims):
+            raise Unsupported()
+
+        # GROUP BY must name exactly the selected dimensions
+        grouped = []
+        for part in _split(query['group']) if query['group'] else []:
+            index = self._item_index(part, items)
+            if items[index][1] is None:
+                raise Unsupported()
+            grouped.append(items[index][1])
+        if set(grouped) != set(dims) or len(grouped) != len(dims):
+            raise Unsupported()
+
+        mask = self._where(query['where'], rollup) if query['where'] else None
+        key = tuple(dims)
+        precomputed = mask is None and (key in rollup.cubes or key == ())
+        if mask is None and key in rollup.cubes:
+            groups = rollup.cubes[key]
+        else:
+            groups = rollup.group(key, mask)
+        if not dims and not groups:
+            groups = [((), 0)]
+
+        rows = []
+        for values, count in groups:
+            by_key = dict(zip(key, values))
+            rows.append({
+                name: count if dim is None else formatter(by_key[dim])
+                for name, dim, formatter, _ in items
+            })
+
+        # Postgres leaves the order unspecified without ORDER BY; sort for stable answers
+        order_terms = [(item_name, False) for item_name, _, _, _ in reversed(items)]
+        if query['order']:
+            order_terms = []
+            for part in _split(query['order']):
+                term = ORDER_RE.match(part)
+                index = self._item_index(term['expr'].strip(), items)
+                dimension = items[index][1]
+                if dimension is not None and dimension.split(":")[0] != 'date':
+                    # Postgres sorts text by the database collation, not by code point as Python does
+                    raise Unsupported()
+                order_terms.insert(0, (items[index][0], (term['direction'] or "asc").lower() == "desc"))
+        for name, descending in order_terms:
+            # Postgres puts NULLs last ascending and first descending
+            present = [row for row in rows if row[name] is not None]
+            nulls = [row for row in rows if row[name] is None]
+            present.sort(key=lambda row: row[name], reverse=descending)
+            rows = nulls + present if descending else present + nulls
+
+        if query['limit']:
+            rows = rows[:int(query['limit'])]
+        return rows, precomputed
+
+    @staticmethod
+    def _select_item(expr: str, alias: str | None):
+        if COUNT_RE.match(expr):
+            return alias or "count", None, None
+        column = COLUMN_RE.match(expr)
+        if column and column['column'] in DIMENSIONS:
+            return alias or column['column'], column['column'], lambda v: v
+        trunc = DATE_TRUNC_RE.match(expr)
+        if trunc:
+            if trunc['cast']:
+                return alias or "date_trunc", f"date:{trunc['bucket'].lower()}", lambda v: v
+            # date_trunc on a date returns timestamptz (the server's time zone is UTC)
+            return alias or "date_trunc", f"date:{trunc['bucket'].lower()}", \
+                lambda v: f"{v}T00:00:00+00:00" if v is not None else None
+        to_char = TO_CHAR_RE.match(expr)
+        if to_char:
+            if to_char['format'].upper() == "YYYY-MM":
+                return alias or "to_char", "date:month", lambda v: v[:7] if v is not None else None
+            return alias or "to_char", "date:day", lambda v: v
+        raise Unsupported()
+
+    @staticmethod
+    def _item_index(term: str, items) -> int:
+        """Resolve a GROUP BY / ORDER BY term: ordinal, alias or the select expression"""
+        if term.isdigit() and 1 <= int(term) <= len(items):
+            return int(term) - 1
+        bare = term.strip('"')
+        for i, (name, _, _, expr) in enumerate(items):
+            if bare == name or term.lower() == expr or (COUNT_RE.match(term) and COUNT_RE.match(expr)):
+                return i
+        raise Unsupported()
+
+    @staticmethod
+    def _where(where: str, rollup: TableRollup) -> np.ndarray:
+        if re.search(r"\bor\b", re.sub(LITERAL, "''", where), re.IGNORECASE):
+            raise Unsupported()
+        mask = np.ones(rollup.counts.shape, dtype=bool)
+        for part in _split(where, "and"):
+            condition = CONDITION_RE.match(part.strip())
+            if not condition or condition['column'] not in DIMENSIONS:
+                raise Unsupported()
+            column = condition['column']
+            values = rollup.values[column]
+            codes = rollup.codes[column]
+            if condition['op']:
+                literal = _literal(condition['value'])
+                op = condition['op']
+                if op in ("=", "<>", "!="):
+                    selected = np.array([v is not None and v == literal for v in values], dtype=bool)
+                    if op != "=":
+                        selected = np.array([v is not None for v in values], dtype=bool) & ~selected
+                else:
+                    if column != 'date' or not re.fullmatch(r"\d{4}-\d{2}-\d{2}", literal):
+                        raise Unsupported()
+                    compare = {'>': str.__gt__, '<': str.__lt__, '>=': str.__ge__, '<=': str.__le__}[op]
+                    selected = np.array([v is not None and compare(v, literal) for v in values], dtype=bool)
+            elif condition['values']:
+                literals = {_literal(v) for v in re.findall(LITERAL, condition['values'])}
+                selected = np.array([v is not None and v in literals for v in values], dtype=bool)
+                if condition['negate']:
+                    selected = np.array([v is not None for v in values], dtype=bool) & ~selected
+            else:
+                selected = np.array([(v is not None) == bool(condition['null']) for v in values], dtype=bool)
+            mask &= selected[codes] if len(values) else np.zeros(codes.shape, dtype=bool)
+        return mask
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.precomputed_hits + self.computed_hits
+        lookups = hits + sum(self.fallthrough.values())
+        return {
+            'tables': len(self.tables),
+            'bytes': sum(rollup.nbytes() for rollup in self.tables.values()),
+            'hits': hits,
+            'precomputed_hits': self.precomputed_hits,
+            'computed_hits': self.computed_hits,
+            'fallthrough': dict(self.fallthrough),
+            'hit_rate': round(hits / lookups, 4) if lookups else None
+        }
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+from services.local_engine import _postgres_column_name, needs_postgres, postgres_null_order
+from services.telemetry import session_queries
+from services.validation_service import UnsafeQuery, tokenize
+
+
+class Session:
+    """One conversation: its most recent turns, each with the result tables it fetched"""
+
+    def __init__(self):
+        self.turns: List[Dict[str, Any]] = []
+        self.next_turn = 1
+        self.nbytes = 0
+        self.touched = time.monotonic()
+
+    def results(self, table_name: str, version: str) -> Dict[str, Dict[str, Any]]:
+        """Result tables fetched from this upload version, by name"""
+        return {
+            result["name"]: result
+            for turn in self.turns if turn["table_name"] == table_name and turn["version"] == version
+            for result in turn["results"]
+        }
+
+
+class SessionStore:
+    """
+    Recent query results per conversation, so follow-up questions can reuse them.
+
+    Each turn's results are kept as small tables named turn<N>_<i>. The planner
+    is shown them (schema_context) and may query them instead of the lead table;
+    such queries run in-process on SQLite (answer). When SQLite can't run one,
+    inline() turns it into SQL the database can run by adding the results' own
+    queries as CTEs. Sessions keep their last max_turns turns, expire after ttl
+    seconds idle, and are evicted least recently used beyond max_sessions or
+    max_bytes of result rows.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_turns: int = 5,
+        ttl: float = 1800.0,
+        max_result_rows: int = 10000
+    ):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self.ttl = ttl
+        # A result with this many rows may have been cut short by the SQL LIMIT, so it isn't kept
+        self.max_result_rows = max_result_rows
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        self.outcomes = {"local": 0, "inlined": 0, "sql": 0}
+        self.saved_ms = 0.0
+        # Mean milliseconds a query takes on the database, smoothed; what a local answer saves
+        self.remote_ms: float | None = None
+
+    def get(self, session_id: str) -> Session | None:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if time.monotonic() - session.touched > self.ttl:
+            self._drop(session_id)
+            return None
+        self._sessions.move_to_end(session_id)
+        session.touched = time.monotonic()
+        return session
+
+    def results(self, session_id: str | None, table_name: str, version: str) -> Dict[str, Dict[str, Any]]:
+        """The session's reusable result tables for this upload version, by name"""
+        session = self.get(session_id) if session_id else None
+        return session.results(table_name, version) if session is not None else {}
+
+    def schema_context(self, session_id: str | None, table_name: str, version: str) -> str | None:
+        """The session's reusable results, described for the model prompts"""
+        results = self.results(session_id, table_name, version)
+        if not results:
+            return None
+        lines = [
+            f"Earlier in this conversation these results were fetched. Each is a table you can query by name. "
+            f"When one holds the rows the question needs, filter or re-aggregate it instead of querying "
+            f"{table_name}; query {table_name} only for data they don't have. Use plain SQL on them "
+            f"(no Postgres-only functions or casts)."
+        ]
+        for name, result in results.items():
+            sql = " ".join(result["sql"].split())
+            lines.append(
+                f'- {name} ({len(result["rows"])} rows; columns: {", ".join(result["columns"])}), '
+                f'for "{result["question"]}": {sql[:300]}'
+            )
+        return "\n".join(lines)
+
+    def references(self, session_id: str | None, table_name: str, version: str, sql: str) -> List[str]:
+        """Names of the session's result tables the query reads"""
+        results = self.results(session_id, table_name, version)
+        if not results:
+            return []
+        try:
+            words = {text.lower() for kind, text in tokenize(sql) if kind == "word"}
+        except UnsafeQuery:
+            return []
+        return [name for name in results if name in words]
+
+    async def answer(self, session_id: str, table_name: str, version: str, sql: str) -> List[Dict[str, Any]] | None:
+        """Run a query over the session's results in-process, or None when SQLite can't answer it exactly"""
+        names = self.references(session_id, table_name, version, sql)
+        if not names:
+            return None
+        results = self.results(session_id, table_name, version)
+        try:
+            # The prompt asks for plain SQL on session results; this is what enforces it
+            if needs_postgres(sql):
+                return None
+            sql = postgres_null_order(sql)
+            return await asyncio.to_thread(self._query, [results[name] for name in names], sql)
+        except (sqlite3.Error, UnsafeQuery):
+            return None
+
+    @staticmethod
+    def _query(results: List[Dict[str, Any]], sql: str) -> List[Dict[str, Any]]:
+        db = sqlite3.connect(":memory:")
+        try:
+            db.execute("PRAGMA case_sensitive_like = ON")
+            for result in results:
+                columns = result["columns"]
+                quoted = ", ".join('"' + c.replace('"', '""') + '"' for c in columns)
+                db.execute(f'CREATE TABLE "{result["name"]}" ({quoted})')
+                db.executemany(
+                    f'INSERT INTO "{result["name"]}" VALUES ({", ".join("?" for _ in columns)})',
+                    [tuple(_sqlite_value(row.get(c)) for c in columns) for row in result["rows"]]
+                )
+            cursor = db.execute(sql)
+            names = [_postgres_column_name(d[0]) for d in cursor.description or []]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+        finally:
+            db.close()
+
+    def inline(self, session_id: str | None, table_name: str, version: str, sql: str) -> str:
+        """
+        The query with the result tables it reads defined as CTEs over their own SQL,
+        so the database can run it; unchanged when it reads none
+        """
+        names = self.references(session_id, table_name, version, sql)
+        if not names:
+            return sql
+        results = self.results(session_id, table_name, version)
+        ctes = ", ".join(f'{name} AS ({results[name]["sql"]})' for name in names)
+        body = sql.strip().rstrip(";")
+        match = re.match(r"with(\s+recursive)?\s", body, re.IGNORECASE)
+        if match:
+            # Merge into the query's own WITH; RECURSIVE has to stay first
+            return f"WITH{' RECURSIVE' if match.group(1) else ''} {ctes}, {body[match.end():]}"
+        return f"WITH {ctes} {body}"
+
+    def record(
+        self,
+        session_id: str,
+        question: str,
+        table_name: str,
+        version: str,
+        executed: List[Dict[str, Any]]
+    ) -> int:
+        """
+        Keep a turn's successful results; returns the turn number.
+        executed holds {"sql", "data"} per query, where sql is what the database would run
+        and data is None for a query that failed.
+        """
+        session = self.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = Session()
+        turn = session.next_turn
+        session.next_turn += 1
+        results = []
+        for i, item in enumerate(executed, 1):
+            rows = item["data"]
+            if not isinstance(rows, list) or not rows or len(rows) >= self.max_result_rows:
+                continue
+            results.append({
+                "name": f"turn{turn}_{i}",
+                "question": question,
+                "sql": item["sql"],
+                "columns": list(rows[0].keys()),
+                "rows": rows,
+                "nbytes": len(json.dumps(rows, default=str)),
+            })
+        session.turns.append({"turn": turn, "table_name": table_name, "version": version, "results": results})
+        added = sum(r["nbytes"] for r in results)
+        session.nbytes += added
+        self._bytes += added
+        while len(session.turns) > self.max_turns:
+            removed = sum(r["nbytes"] for r in session.turns.pop(0)["results"])
+            session.nbytes -= removed
+            self._bytes -= removed
+        self._evict(keep=session_id)
+        return turn
+
+    def observe_remote(self, ms: float) -> None:
+        """A query's time on the database, to estimate what local answers save"""
+        self.remote_ms = ms if self.remote_ms is None else 0.9 * self.remote_ms + 0.1 * ms
+
+    def count(self, outcome: str, local_ms: float = 0.0) -> float:
+        """Count how a session query was answered; returns the estimated milliseconds saved"""
+        self.outcomes[outcome] += 1
+        session_queries.inc(outcome=outcome)
+        saved = max((self.remote_ms or 0.0) - local_ms, 0.0) if outcome == "local" else 0.0
+        self.saved_ms += saved
+        return saved
+
+    def forget(self, session_id: str) -> bool:
+        if session_id not in self._sessions:
+            return False
+        self._drop(session_id)
+        return True
+
+    def _evict(self, keep: str) -> None:
+        now = time.monotonic()
+        for session_id in [s for s, session in self._sessions.items() if now - session.touched > self.ttl]:
+            self._drop(session_id)
+        while (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes) and len(self._sessions) > 1:
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                break
+            self._drop(session_id)
+            self.evictions += 1
+
+    def _drop(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id)
+        self._bytes -= session.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        answered = sum(self.outcomes.values())
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "queries": dict(self.outcomes),
+            "reuse_rate": round(self.outcomes["local"] / answered, 3) if answered else None,
+            "saved_ms": round(self.saved_ms, 1),
+            "remote_query_ms": round(self.remote_ms, 1) if self.remote_ms is not None else None,
+        }
+
+
+def _sqlite_value(value: Any) -> Any:
+    """SQLite takes scalars only; nested JSON values are stored as text"""
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
@@ -0,0 +1,60 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one shared task.
+
+    The first caller starts the work; callers arriving while it runs await the
+    same task. Each waiter is shielded, so cancelling one waiter (e.g. a client
+    disconnect) never cancels the work the others are waiting on. Only when the
+    last waiter goes away is the shared work cancelled too.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # key -> [task, number of waiters]
+        self._inflight: Dict[str, List[Any]] = {}
+        self.started = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(fn())
+            entry = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if entry[1] == 1 and not task.done():
+                # Nobody else is waiting for this result
+                task.cancel()
+                self.abandoned += 1
+            raise
+        finally:
+            entry[1] -= 1
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        entry = self._inflight.get(key)
+        if entry is not None and entry[0] is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'in_flight': len(self._inflight),
+            'started': self.started,
+            'coalesced': self.coalesced,
+            'abandoned': self.abandoned
+        }
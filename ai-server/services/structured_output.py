@@ -0,0 +1,197 @@
+import json
+from typing import Any, Dict, List
+
+# JSON types as Python types; bool is excluded from the numbers explicitly
+JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+class StructuredOutputError(ValueError):
+    """The model's answer is missing, isn't JSON, or doesn't match the tool's input schema"""
+
+
+def tool(name: str, description: str, properties: Dict[str, Any], required: List[str]) -> Dict[str, Any]:
+    """An Anthropic tool definition whose input schema is the answer we want back"""
+    return {
+        "name": name,
+        "description": description,
+        "input_schema": {"type": "object", "properties": properties, "required": required},
+    }
+
+
+INTENT_PROPERTIES = {
+    "classification": {"type": "string", "enum": ["analyze", "chat"]},
+    "response": {
+        "type": ["string", "null"],
+        "description": "For chat: the reply to the user. For analyze: null."
+    },
+}
+GRAPH_PROPERTIES = {
+    "include_graph": {"type": "boolean"},
+    "graph_type": {"type": "string", "enum": ["bar", "line", "pie", "scatter", "none"]},
+    "reasoning": {"type": "string"},
+}
+QUERIES_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "sql": {"type": "string", "description": "One PostgreSQL SELECT statement"},
+            "description": {"type": "string", "description": "What this calculates"},
+            "metric_name": {"type": "string"},
+        },
+        "required": ["sql"],
+    },
+}
+PLAN_PROPERTIES = {
+    **INTENT_PROPERTIES,
+    **GRAPH_PROPERTIES,
+    "queries": {**QUERIES_SCHEMA, "description": 'The SQL queries; [] for "chat"'},
+}
+STATISTICS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "metric_name": {"type": "string"},
+            "value": {"type": "number"},
+            "unit": {"type": "string"},
+            "breakdown": {"type": ["object", "null"]},
+        },
+        "required": ["metric_name", "value", "unit"],
+    },
+}
+GRAPH_DATA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string"},
+        "labels": {"type": "array"},
+        "datasets": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"label": {"type": "string"}, "data": {"type": "array", "items": {"type": "number"}}},
+                "required": ["data"],
+            },
+            "minItems": 1,
+        },
+    },
+    "required": ["labels", "datasets"],
+}
+
+INTENT_TOOL = tool(
+    "classify_intent",
+    "Record whether the question asks for data analysis or is conversation.",
+    INTENT_PROPERTIES,
+    ["classification", "response"],
+)
+GRAPH_TOOL = tool(
+    "graph_decision",
+    "Record whether a chart would help answer the question, and which one.",
+    GRAPH_PROPERTIES,
+    ["include_graph", "graph_type", "reasoning"],
+)
+QUERIES_TOOL = tool(
+    "sql_queries",
+    "Record the SQL queries that answer the question with specific numbers.",
+    {"queries": {**QUERIES_SCHEMA, "minItems": 1}},
+    ["queries"],
+)
+PLAN_TOOL = tool(
+    "plan",
+    "Record the intent, graph decision and SQL queries for the question.",
+    PLAN_PROPERTIES,
+    ["classification", "include_graph", "graph_type", "queries"],
+)
+BATCH_PLAN_TOOL = tool(
+    "plans",
+    "Record one plan per question, in the order the questions were given.",
+    {
+        "plans": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"index": {"type": "integer"}, **PLAN_PROPERTIES},
+                "required": ["index", "classification", "include_graph", "graph_type", "queries"],
+            },
+        }
+    },
+    ["plans"],
+)
+
+
+def analysis_tool(include_graph: bool) -> Dict[str, Any]:
+    """The analysis answer: summary and statistics, plus chart data when a graph was asked for"""
+    properties = {
+        "summary": {"type": "string", "description": "2-3 sentences presenting the key insights with actual numbers"},
+        "statistics": STATISTICS_SCHEMA,
+    }
+    required = ["summary", "statistics"]
+    if include_graph:
+        properties["graph_data"] = GRAPH_DATA_SCHEMA
+        required.append("graph_data")
+    return tool("analysis", "Record the analysis of the query results.", properties, required)
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> None:
+    """
+    Check a value against the subset of JSON Schema the tools use
+    (type, enum, required, properties, items, minItems). Raises StructuredOutputError.
+    """
+    types = schema.get("type")
+    if types is not None:
+        types = [types] if isinstance(types, str) else types
+        if not any(_is_type(value, t) for t in types):
+            raise StructuredOutputError(f"{path}: expected {' or '.join(types)}, got {type(value).__name__}")
+    if "enum" in schema and value not in schema["enum"]:
+        raise StructuredOutputError(f"{path}: {value!r} is not one of {schema['enum']}")
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                raise StructuredOutputError(f"{path}: missing '{key}'")
+        for key, subschema in schema.get("properties", {}).items():
+            if key in value:
+                validate(value[key], subschema, f"{path}.{key}")
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            raise StructuredOutputError(f"{path}: expected at least {schema['minItems']} items")
+        if "items" in schema:
+            for i, item in enumerate(value):
+                validate(item, schema["items"], f"{path}[{i}]")
+
+
+def _is_type(value: Any, name: str) -> bool:
+    if name in ("number", "integer") and isinstance(value, bool):
+        return False
+    return isinstance(value, JSON_TYPES[name])
+
+
+def tool_input(response: Any, tool: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The validated input of the response's call to the tool.
+    A plain JSON text answer (with or without a ```json fence) is accepted as well.
+    """
+    value = None
+    for block in response.content:
+        if getattr(block, "type", None) == "tool_use" and block.name == tool["name"]:
+            value = block.input
+            break
+    else:
+        text = "".join(getattr(block, "text", "") for block in response.content).strip()
+        if "```" in text:
+            text = text.split("```json" if "```json" in text else "```")[1].split("```")[0].strip()
+        if not text:
+            raise StructuredOutputError(f"no call to {tool['name']} (stop reason: {getattr(response, 'stop_reason', None)})")
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise StructuredOutputError(f"answer is not JSON: {e}") from e
+    validate(value, tool["input_schema"])
+    return value
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import re
+import time
+from typing import Dict, Any
+
+from services.query_service import QueryService
+
+logger = logging.getLogger(__name__)
+
+# Same rule create_leads_table enforces; names are interpolated into the stats queries
+TABLE_NAME_RE = re.compile(r'^[a-zA-Z0-9_]+$')
+
+
+class TableCatalog:
+    """
+    In-process catalog of the lead tables listed in master_uploads.
+
+    Lookups are plain dictionary reads. The catalog refreshes itself when its TTL
+    expires by fetching only uploads newer than the newest created_at it has seen,
+    and reconciles the full list (deleted uploads, edited row counts) every
+    full_refresh_interval seconds or after invalidate().
+    """
+
+    def __init__(
+        self,
+        query_service: QueryService,
+        ttl: float = 60.0,
+        full_refresh_interval: float = 600.0,
+        miss_refresh_interval: float = 2.0
+    ):
+        self.query_service = query_service
+        self.ttl = ttl
+        self.full_refresh_interval = full_refresh_interval
+        self.miss_refresh_interval = miss_refresh_interval
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        self.watermark: str | None = None
+        self._refreshed_at = 0.0
+        self._full_refreshed_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self, table_name: str) -> Dict[str, Any] | None:
+        """
+        Look up a table: {"table_name", "upload_id", "filename", "created_at",
+        "version", "columns": [{"name", "type"}], "row_count"}, or None if unknown
+        """
+        now = time.monotonic()
+        if now - self._refreshed_at > self.ttl:
+            await self.refresh()
+        elif table_name not in self.tables and now - self._refreshed_at > self.miss_refresh_interval:
+            # Possibly uploaded since the last refresh; the watermark keeps this cheap
+            await self.refresh()
+        return self.tables.get(table_name)
+
+    async def exists(self, table_name: str) -> bool:
+        return await self.get(table_name) is not None
+
+    def invalidate(self, table_name: str | None = None) -> None:
+        """Drop one table (or everything) so the next lookup reloads it"""
+        if table_name is None:
+            self.tables = {}
+            self.watermark = None
+            self._full_refreshed_at = 0.0
+        else:
+            self.tables.pop(table_name, None)
+            # Force a full reconcile so the dropped table is reloaded if it still exists
+            self._full_refreshed_at = 0.0
+        self._refreshed_at = 0.0
+
+    async def refresh(self) -> None:
+        """Incremental refresh from the created_at watermark, or a full reload when due"""
+        async with self._lock:
+            now = time.monotonic()
+            if now - self._refreshed_at <= self.miss_refresh_interval:
+                # Another request refreshed while we waited for the lock
+                return
+            full = self.watermark is None or now - self._full_refreshed_at > self.full_refresh_interval
+
+            uploads = await self.query_service.get_uploads(None if full else self.watermark)
+            uploads = [row for row in uploads if TABLE_NAME_RE.match(row['table_name'])]
+            entries = {
+                'leads_' + row['table_name']: {
+                    'table_name': 'leads_' + row['table_name'],
+                    'upload_id': row['id'],
+                    'filename': row['filename'],
+                    'created_at': row['created_at'],
+                    'version': f"{row['id']}@{row['created_at']}",
+                    'columns': [],
+                    'row_count': None
+                }
+                for row in uploads
+            }
+            await self._load_stats(entries)
+
+            if full:
+                self.tables = entries
+                self._full_refreshed_at = now
+            else:
+                self.tables = {**self.tables, **entries}
+            if uploads:
+                self.watermark = max(self.watermark or '', *(row['created_at'] for row in uploads))
+            self._refreshed_at = now
+
+    async def _load_stats(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        """Fill in column lists and row counts with one query each"""
+        if not entries:
+            return
+        names = list(entries)
+        quoted = ", ".join(f"'{name}'" for name in names)
+
+        columns = await self.query_service.execute_query(
+            "SELECT table_name, column_name, data_type FROM information_schema.columns "
+            f"WHERE table_schema = 'public' AND table_name IN ({quoted}) "
+            "ORDER BY table_name, ordinal_position"
+        )
+        for row in columns:
+            entries[row['table_name']]['columns'].append({'name': row['column_name'], 'type': row['data_type']})
+
+        # Tables listed in master_uploads but missing from the database can't be queried
+        existing = [name for name in names if entries[name]['columns']]
+        for name in set(names) - set(existing):
+            logger.warning("Catalog: %s is listed in master_uploads but has no columns, skipping", name)
+            del entries[name]
+        if not existing:
+            return
+
+        counts = await self.query_service.execute_query(" UNION ALL ".join(
+            f"SELECT '{name}' AS table_name, COUNT(*) AS row_count FROM \"{name}\"" for name in existing
+        ))
+        for row in counts:
+            entries[row['table_name']]['row_count'] = row['row_count']
+
+    def schema_context(self, table_name: str) -> str | None:
+        """Describe a table's real schema for the model prompts"""
+        info = self.tables.get(table_name)
+        if not info or not info['columns']:
+            return None
+        columns = ", ".join(f"{c['name']} ({c['type']})" for c in info['columns'])
+        rows = f"{info['row_count']:,} rows" if info['row_count'] is not None else "row count unknown"
+        return f"Table {table_name} ({rows}) with columns: {columns}"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'tables': len(self.tables),
+            'watermark': self.watermark,
+            'age_seconds': round(time.monotonic() - self._refreshed_at, 1) if self._refreshed_at else None
+        }
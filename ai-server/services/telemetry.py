@@ -0,0 +1,296 @@
+import json
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+logger = logging.getLogger("ai-server.telemetry")
+
+# Seconds; covers in-process lookups (sub-millisecond) up to slow model calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in Prometheus' layout"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label set -> [per-bucket counts, sum, count]
+        self._values: Dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        lines = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+# A collector returns (name, type, help, [(labels, value)]) for values read at scrape time
+Collector = Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]]]
+
+
+class Registry:
+    """Metrics exported on /metrics in the Prometheus text format"""
+
+    def __init__(self, namespace: str = "ai_server"):
+        self.namespace = namespace
+        self._metrics: List[Any] = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = Counter(f"{self.namespace}_{name}", help)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(f"{self.namespace}_{name}", help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+                continue
+            for name, kind, help, samples in families:
+                name = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(_labels(labels))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+requests_total = registry.counter("requests_total", "Requests by endpoint and status")
+request_seconds = registry.histogram("request_duration_seconds", "End-to-end request latency")
+span_seconds = registry.histogram("span_duration_seconds", "Pipeline stages and LLM, DB and render calls")
+span_errors = registry.counter("span_errors_total", "Spans that ended with an exception")
+llm_tokens = registry.counter("llm_tokens_total", "Anthropic tokens by operation and direction")
+llm_request_tokens = registry.histogram(
+    "llm_input_tokens", "Input tokens per model call", buckets=TOKEN_BUCKETS
+)
+llm_cost = registry.counter("llm_cost_usd_total", "Estimated Anthropic spend in USD by operation and model")
+llm_structured = registry.counter(
+    "llm_structured_output_total", "Structured model answers by operation and outcome: ok, repaired, failed"
+)
+result_rows = registry.histogram("query_result_rows", "Rows returned per query", buckets=ROW_BUCKETS)
+sql_governor = registry.counter(
+    "sql_governor_total", "Generated queries by governor outcome: passed, rewritten, rejected_<rule>, over_budget"
+)
+pool_wait = registry.histogram("pool_wait_seconds", "Time spent queued for an analyze, LLM, DB or render slot")
+pool_rejections = registry.counter("pool_rejections_total", "Work refused by a capacity pool, by pool and reason")
+session_queries = registry.counter(
+    "session_queries_total", "Follow-up queries by how they were answered: local (earlier results), inlined, sql"
+)
+ingest_rows = registry.counter("ingest_rows_total", "Uploaded CSV rows by outcome: inserted, skipped")
+slow_requests = registry.counter("slow_requests_total", "Requests slower than SLOW_REQUEST_MS")
+
+
+class Trace:
+    """The spans recorded while one request ran, with offsets from its start"""
+
+    def __init__(self, name: str, **attrs: Any):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.status = "ok"
+
+    def add(self, kind: str, name: str, start: float, ms: float, attrs: Dict[str, Any], error: str | None) -> None:
+        entry = {"kind": kind, "name": name, "start_ms": round((start - self.start) * 1000, 2), "ms": round(ms, 2)}
+        if attrs:
+            entry["attrs"] = attrs
+        if error:
+            entry["error"] = error
+        self.spans.append(entry)
+
+    def timeline(self, total_ms: float) -> Dict[str, Any]:
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "total_ms": round(total_ms, 2),
+            **self.attrs,
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"])
+        }
+
+
+current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+
+
+class Tracer:
+    """
+    Request traces and spans.
+
+    trace() wraps a request; span() wraps a stage or an outbound call inside it.
+    Spans always feed the span_duration_seconds histogram; they are also added
+    to the current request's timeline, which is logged as one JSON line when the
+    request takes longer than slow_request_ms and kept for /metrics/slow.
+    Tasks started inside a trace inherit it, so concurrent queries land in the
+    same timeline.
+    """
+
+    def __init__(self, slow_request_ms: float | None = None, keep_slow: int = 50):
+        self.slow_request_ms = slow_request_ms
+        self.recent_slow: deque = deque(maxlen=keep_slow)
+
+    @contextmanager
+    def trace(self, name: str, **attrs: Any) -> Iterator[Trace]:
+        trace = Trace(name, **attrs)
+        token = current_trace.set(trace)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.status = getattr(e, "status_code", None) or type(e).__name__
+            raise
+        finally:
+            current_trace.reset(token)
+            self.finish(trace)
+
+    def finish(self, trace: Trace) -> None:
+        seconds = time.perf_counter() - trace.start
+        requests_total.inc(endpoint=trace.name, status=trace.status)
+        request_seconds.observe(seconds, endpoint=trace.name)
+        if self.slow_request_ms is not None and seconds * 1000 >= self.slow_request_ms:
+            slow_requests.inc(endpoint=trace.name)
+            timeline = trace.timeline(seconds * 1000)
+            self.recent_slow.append(timeline)
+            logger.warning("Slow request: %s", json.dumps(timeline, default=str))
+
+    @contextmanager
+    def span(self, kind: str, name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+        """Yields the span's attributes, so the caller can add results (rows, tokens, outcome)"""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            self.record(kind, name, ms, start=start, error=error, **attrs)
+
+    def record(self, kind: str, name: str, ms: float, start: float | None = None,
+               error: str | None = None, timeline: bool = True, **attrs: Any) -> None:
+        """
+        A span measured elsewhere (e.g. sub-timings reported by a service).
+        timeline=False only feeds the histogram, for timings already covered by other spans.
+        """
+        span_seconds.observe(ms / 1000, kind=kind, name=name)
+        if error:
+            span_errors.inc(kind=kind, name=name, error=error)
+        trace = current_trace.get()
+        if trace is not None and timeline:
+            trace.add(kind, name, start if start is not None else time.perf_counter() - ms / 1000, ms, attrs, error)
+
+
+tracer = Tracer()
+
+
+def record_usage(operation: str, usage: Any) -> Dict[str, int]:
+    """Count the tokens on an Anthropic response's usage block"""
+    if usage is None:
+        return {}
+    counts = {
+        "input": getattr(usage, "input_tokens", None) or 0,
+        "output": getattr(usage, "output_tokens", None) or 0,
+        "cache_read": getattr(usage, "cache_read_input_tokens", None) or 0,
+        "cache_write": getattr(usage, "cache_creation_input_tokens", None) or 0,
+    }
+    for direction, n in counts.items():
+        if n:
+            llm_tokens.inc(n, operation=operation, direction=direction)
+    llm_request_tokens.observe(counts["input"], operation=operation)
+    return {f"{direction}_tokens": n for direction, n in counts.items() if n}
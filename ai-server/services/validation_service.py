@@ -1,24 +1,284 @@
 import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from services.telemetry import sql_governor
+
+# One token per match; anything no alternative matches (a stray quote, `$`, `\`) is rejected
+TOKEN_RE = re.compile(r"""
+      (?P<space>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<string>[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*')
+    | (?P<quoted>"(?:[^"]|"")+")
+    | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)
+    | (?P<word>[A-Za-z_][A-Za-z_0-9]*)
+    | (?P<op>::|<=|>=|<>|!=|\|\||[-+*/%<>=~!@#^&|?:])
+    | (?P<punct>[(),.;\[\]])
+""", re.VERBOSE | re.DOTALL)
+
+# Statements and clauses that write, lock, or reach outside the query
+FORBIDDEN_KEYWORDS = {
+    'insert', 'update', 'delete', 'merge', 'drop', 'create', 'alter', 'truncate', 'grant',
+    'revoke', 'copy', 'execute', 'exec', 'call', 'do', 'into', 'lock', 'vacuum', 'reindex', 'cluster',
+    'refresh', 'listen', 'notify', 'unlisten', 'prepare', 'deallocate', 'set', 'reset', 'begin',
+    'commit', 'rollback', 'savepoint', 'xp_cmdshell',
+}
+# Functions that sleep, touch files or other sessions, or change settings
+FORBIDDEN_FUNCTIONS = {
+    'pg_sleep', 'pg_sleep_for', 'pg_sleep_until', 'pg_read_file', 'pg_read_binary_file', 'pg_ls_dir',
+    'pg_stat_file', 'pg_terminate_backend', 'pg_cancel_backend', 'pg_reload_conf', 'pg_rotate_logfile',
+    'lo_import', 'lo_export', 'lo_get', 'dblink', 'dblink_exec', 'set_config', 'query_to_xml',
+    'query_to_json', 'pg_advisory_lock', 'pg_advisory_xact_lock', 'txid_current', 'nextval', 'setval',
+}
+SYSTEM_SCHEMAS = {'pg_catalog', 'information_schema', 'pg_toast'}
+# Keywords that end a FROM list at the same nesting level
+FROM_END = {'where', 'group', 'order', 'limit', 'offset', 'having', 'window', 'union', 'intersect', 'except', 'fetch'}
+
+
+class UnsafeQuery(ValueError):
+    """A generated query that mustn't run; kind is the rule it broke"""
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+
+
+def tokenize(sql: str) -> List[Tuple[str, str]]:
+    """Split SQL into (kind, text) tokens; raises UnsafeQuery on anything it can't tokenize"""
+    tokens = []
+    position = 0
+    while position < len(sql):
+        match = TOKEN_RE.match(sql, position)
+        if match is None or match.lastgroup == "op" and sql.startswith("/*", position):
+            if sql.startswith("/*", position):
+                raise UnsafeQuery("syntax", "Unterminated comment")
+            if sql[position] in "'\"":
+                raise UnsafeQuery("syntax", "Unterminated quoted string or identifier")
+            raise UnsafeQuery("syntax", f"Unexpected character {sql[position]!r}")
+        tokens.append((match.lastgroup, match.group()))
+        position = match.end()
+    return tokens
+
+
+def _name(token: Tuple[str, str]) -> str:
+    """An identifier as Postgres resolves it: unquoted names fold to lower case"""
+    kind, text = token
+    return text[1:-1].replace('""', '"') if kind == "quoted" else text.lower()
+
 
 class ValidationService:
-    DANGEROUS_PATTERNS = [
-        r'\b(insert|update|delete|drop|create|alter|truncate)\b',
-        r';.*?--',  # Multiple statements
-        r'xp_cmdshell',
-        r'exec\s+\(',
-    ]
-    
+    """
+    Tokenizes and checks generated SQL before it runs, and bounds what it may cost.
+
+    A query must be one SELECT (or WITH ... SELECT) statement that only reads the
+    question's table (plus its own CTEs), calls no side-effecting functions, and
+    doesn't cross join two tables without a condition. Follow-up questions may also
+    read the conversation's earlier results (extra_tables, see SessionStore). The statement's outer LIMIT
+    is added or lowered to max_rows. max_cost is the planner cost budget the
+    database checks with EXPLAIN before running a query (see QueryService).
+
+    Results are cached per (sql, table, extra tables), so a repeated plan is checked once.
+    """
+
+    def __init__(self, max_rows: int = 10000, max_cost: float | None = None, max_entries: int = 1024):
+        self.max_rows = max_rows
+        self.max_cost = max_cost
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[Tuple[str, str | None, frozenset], Dict[str, Any] | UnsafeQuery]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.outcomes: Dict[str, int] = {}
+
     def is_safe_query(self, sql: str) -> bool:
         """Validate SQL query is safe to execute"""
-        sql_lower = sql.lower().strip()
-        
-        # Must start with SELECT
-        if not sql_lower.startswith('select'):
+        try:
+            self.govern(sql)
+        except UnsafeQuery:
             return False
-        
-        # Check for dangerous patterns
-        for pattern in self.DANGEROUS_PATTERNS:
-            if re.search(pattern, sql_lower, re.IGNORECASE):
-                return False
-        
-        return True
\ No newline at end of file
+        return True
+
+    def govern(self, sql: str, table_name: str | None = None, extra_tables: frozenset = frozenset()) -> Dict[str, Any]:
+        """
+        Check a query and return {"sql", "original_sql", "rewrites"}, where sql is the
+        query to run and rewrites lists what was changed. Raises UnsafeQuery.
+        """
+        key = (sql, table_name, extra_tables)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            try:
+                cached = self._govern(sql, table_name, extra_tables)
+            except UnsafeQuery as e:
+                cached = e
+            self._cache[key] = cached
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+        if isinstance(cached, UnsafeQuery):
+            self._count(f"rejected_{cached.kind}")
+            raise cached
+        self._count("rewritten" if cached["rewrites"] else "passed")
+        return cached
+
+    def _count(self, outcome: str) -> None:
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        sql_governor.inc(outcome=outcome)
+
+    def _govern(self, sql: str, table_name: str | None, extra_tables: frozenset) -> Dict[str, Any]:
+        tokens = tokenize(sql)
+        # Significant tokens, with their index in tokens so the LIMIT can be rewritten in place
+        significant = [(i, token) for i, token in enumerate(tokens) if token[0] not in ("space", "comment")]
+        while significant and significant[-1][1] == ("punct", ";"):
+            significant.pop()
+        if not significant:
+            raise UnsafeQuery("statement", "Empty query")
+        first = _name(significant[0][1])
+        if significant[0][1][0] != "word" or first not in ("select", "with"):
+            raise UnsafeQuery("statement", "Only SELECT queries are allowed")
+
+        ctes = set()
+        tables = []
+        # One scope per parenthesis level: FROM-list state, base tables and how they were joined
+        scopes = [self._scope()]
+        limit_at = None  # index into tokens of the outer LIMIT's (or FETCH FIRST's) row count
+        limit_clause = "LIMIT"
+        bounded = False  # the outer query already has a LIMIT or FETCH FIRST
+        for position, (_, token) in enumerate(significant):
+            kind, text = token
+            scope = scopes[-1]
+            previous = significant[position - 1][1] if position else None
+            following = significant[position + 1][1] if position + 1 < len(significant) else None
+
+            if token == ("punct", ";"):
+                raise UnsafeQuery("statement", "Only one statement is allowed")
+            if token == ("punct", "("):
+                # A derived table; its alias isn't a table name
+                scope["expect_table"] = False
+                scopes.append(self._scope())
+                continue
+            if token == ("punct", ")"):
+                if len(scopes) == 1:
+                    raise UnsafeQuery("syntax", "Unbalanced parentheses")
+                self._close(scopes.pop())
+                continue
+            if token == ("punct", ",") and scope["in_from"]:
+                scope["expect_table"] = True
+                scope["comma_join"] = True
+                continue
+            if kind not in ("word", "quoted"):
+                continue
+
+            name = _name(token)
+            if following == ("punct", "(") and (name in FORBIDDEN_FUNCTIONS or name.startswith("pg_")):
+                raise UnsafeQuery("function", f"{name}() is not allowed")
+            if kind == "word":
+                if name in FORBIDDEN_KEYWORDS:
+                    raise UnsafeQuery("keyword", f"{name.upper()} is not allowed")
+                if name == "for" and following is not None and _name(following) in ("share", "no", "key"):
+                    raise UnsafeQuery("keyword", "Row locks are not allowed")
+
+            if scope["expect_table"]:
+                scope["expect_table"] = False
+                if name == "lateral":
+                    scope["expect_table"] = True
+                    continue
+                if following == ("punct", "("):
+                    continue  # a table function such as generate_series(...)
+                table = self._table_name(significant, position)
+                tables.append(table)
+                if table not in ctes:
+                    scope["base_tables"] += 1
+                    if scope["comma_join"] or scope["join_cross"]:
+                        scope["unconditioned"] = True
+                scope["join_cross"] = False
+                continue
+            if kind == "quoted":
+                continue
+
+            # WITH name [(columns)] AS (...), name AS (...): remember the CTE names
+            if first == "with" and len(scopes) == 1 and not scope["main"] and previous is not None \
+                    and _name(previous) in ("with", "recursive", ",") and following is not None \
+                    and _name(following) in ("as", "("):
+                ctes.add(name)
+                continue
+
+            if name == "select":
+                scope["select"] = True
+                if len(scopes) == 1:
+                    scope["main"] = True
+            elif name == "from" and scope["select"]:
+                # Only a SELECT's FROM lists tables; EXTRACT(... FROM ...) and friends don't
+                scope.update(in_from=True, expect_table=True)
+            elif name in FROM_END:
+                scope["in_from"] = False
+                if name == "where":
+                    scope["where"] = True
+            elif name == "join":
+                scope["expect_table"] = True
+                scope["join_cross"] = _name(previous) == "cross"
+
+            if len(scopes) == 1 and scope["main"] and name in ("limit", "fetch"):
+                bounded = True
+                limit_clause = "LIMIT" if name == "limit" else "FETCH FIRST"
+                value = significant[position + (1 if name == "limit" else 2)] \
+                    if position + (1 if name == "limit" else 2) < len(significant) else None
+                if value is not None and (value[1][0] == "number" or _name(value[1]) == "all"):
+                    limit_at = value[0]
+                elif name == "limit":
+                    raise UnsafeQuery("syntax", "LIMIT must be a number")
+
+        if len(scopes) != 1:
+            raise UnsafeQuery("syntax", "Unbalanced parentheses")
+        self._close(scopes[0])
+
+        for table in tables:
+            schema, _, name = table.rpartition(".")
+            if schema in SYSTEM_SCHEMAS or name.startswith("pg_"):
+                raise UnsafeQuery("table", f"System table {table} is not allowed")
+            if table_name is not None and table not in ctes and table not in extra_tables and name != table_name:
+                raise UnsafeQuery("table", f"Only {table_name} may be queried, not {table}")
+
+        rewrites = []
+        parts = [" " if kind == "comment" else text for kind, text in tokens[:significant[-1][0] + 1]]
+        limit = tokens[limit_at][1] if limit_at is not None else None
+        if limit is not None and (limit.lower() == "all" or float(limit) > self.max_rows):
+            rewrites.append(f"lowered {limit_clause} {limit} to {self.max_rows}")
+            parts[limit_at] = str(self.max_rows)
+        rewritten = "".join(parts).strip()
+        if not bounded:
+            rewritten = f"{rewritten} LIMIT {self.max_rows}"
+            rewrites.append(f"added LIMIT {self.max_rows}")
+        return {"sql": rewritten, "original_sql": sql, "rewrites": rewrites}
+
+    @staticmethod
+    def _scope() -> Dict[str, Any]:
+        return {
+            "main": False, "select": False, "in_from": False, "expect_table": False, "where": False,
+            "comma_join": False, "join_cross": False, "base_tables": 0, "unconditioned": False,
+        }
+
+    @staticmethod
+    def _close(scope: Dict[str, Any]) -> None:
+        """A level that joins two tables with neither a join condition nor a WHERE is a cross product"""
+        if scope["base_tables"] >= 2 and scope["unconditioned"] and not scope["where"]:
+            raise UnsafeQuery("cross_join", "Cross join of two tables without a join condition")
+
+    @staticmethod
+    def _table_name(significant: List[Tuple[int, Tuple[str, str]]], position: int) -> str:
+        """The possibly schema-qualified name starting at position"""
+        parts = [_name(significant[position][1])]
+        while position + 2 < len(significant) and significant[position + 1][1] == ("punct", "."):
+            position += 2
+            parts.append(_name(significant[position][1]))
+        return ".".join(parts)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_rows": self.max_rows,
+            "max_cost": self.max_cost,
+            "cache": {"entries": len(self._cache), "hits": self.hits, "misses": self.misses},
+            "outcomes": dict(self.outcomes),
+        }
@@ -0,0 +1,14 @@
+import os
+import sys
+
+AI_SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, AI_SERVER)
+sys.path.insert(0, os.path.join(AI_SERVER, "benchmarks"))
+
+# Settings main.py reads at import time; the tests swap its clients for the stand-ins
+os.environ.setdefault("ANTHROPIC_API_KEY", "offline")
+os.environ.setdefault("SUPABASE_URL", "http://postgrest.local")
+os.environ.setdefault("SUPABASE_KEY", "offline")
+os.environ.setdefault("CACHE_DIR", "")
+# main.py serves ./static
+os.chdir(AI_SERVER)
@@ -0,0 +1,67 @@
+import asyncio
+
+import httpx
+
+from services.claude_service import ClaudeService
+from services.intent_rules import RuleClassifier
+from standins import SAMPLE_CSV, TABLE, FakeAnthropic, FakePostgrest, install, load_sample
+
+
+def test_rules_analyze_overrides_model_chat_before_validation():
+    """A model "chat" plan the rules call "analyze" has no queries, so it is planned again"""
+    service = ClaudeService("offline", rules=RuleClassifier())
+    replanned = []
+
+    async def plan_batch_call(questions, table_name, schema):
+        return {0: {"classification": "chat", "response": "Hi", "include_graph": False, "queries": []}}
+
+    async def plan_analysis(question, table_name, mode="planner", schema=None):
+        replanned.append(question)
+        return {
+            "intent": {"classification": "analyze", "response": None},
+            "graph_decision": None,
+            "queries": [{"sql": f"SELECT COUNT(*) FROM {table_name}"}],
+            "mode": mode,
+            "timings": {},
+        }
+
+    service._plan_batch_call = plan_batch_call
+    service.plan_analysis = plan_analysis
+    plans = asyncio.run(service.plan_batch(["How many leads do we have?"], TABLE))
+
+    assert replanned == ["How many leads do we have?"]
+    assert plans[0]["intent"]["classification"] == "analyze"
+    assert plans[0]["queries"]
+
+
+def test_batch_analyze_plan_without_queries_does_not_fail_the_batch():
+    import main
+
+    install(main, FakeAnthropic(0, jitter=0.0), FakePostgrest(load_sample(SAMPLE_CSV), latency_ms=0))
+
+    async def plan_batch(questions, table_name, schema=None, chunk_size=10):
+        return [
+            {
+                "intent": {"classification": "analyze", "response": None},
+                "graph_decision": {"include_graph": False, "graph_type": "none", "reasoning": ""},
+                "queries": [],
+            }
+            for _ in questions
+        ]
+
+    main.claude_service.plan_batch = plan_batch
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(
+                "/analyze/batch", json={"questions": ["How many leads do we have?"], "table_name": TABLE}
+            )
+
+    try:
+        response = asyncio.run(run())
+    finally:
+        del main.claude_service.plan_batch
+
+    assert response.status_code == 200
+    assert response.json()["results"][0]["error"] is None
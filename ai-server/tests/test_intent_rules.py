@@ -0,0 +1,33 @@
+import pytest
+
+from services.intent_rules import RuleClassifier
+
+
+@pytest.mark.parametrize("question", [
+    "How many leads were created by John?",
+    "Show leads owned by Sarah",
+])
+def test_by_a_person_is_not_a_grouping(question):
+    decision = RuleClassifier().graph_decision(question)
+    assert decision is None or decision["graph_type"] != "bar"
+
+
+@pytest.mark.parametrize("question", [
+    "Show me leads by source",
+    "Leads by deal stage",
+    "Top 5 companies by number of leads",
+])
+def test_by_a_dimension_is_a_bar_chart(question):
+    assert RuleClassifier().graph_decision(question)["graph_type"] == "bar"
+
+
+def test_capability_question_is_chat_despite_data_words():
+    decision = RuleClassifier().classify_intent("What can you do with my data?")
+    assert decision["classification"] == "chat"
+
+
+def test_thanks_with_data_words_is_left_to_the_model():
+    rules = RuleClassifier()
+    assert rules.classify_intent("thanks, that is the most helpful") is None
+    assert rules.classify_intent("Thanks!")["classification"] == "chat"
+    assert rules.classify_intent("How many leads do we have?")["classification"] == "analyze"
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from services.local_engine import LocalEngine, LocalUnsupported, needs_postgres
+
+ROWS = [
+    {"id": "1", "date": "2024-01-15", "source": "Web"},
+    {"id": "2", "date": "2020-06-01", "source": "Ads"},
+]
+
+
+def engine() -> LocalEngine:
+    local = LocalEngine(query_service=None, catalog=None)
+    local.load_table("leads_t", "v1", [("id", "uuid"), ("date", "date"), ("source", "text")], ROWS)
+    return local
+
+
+@pytest.mark.parametrize("sql", [
+    # SQLite: the integer year 2024
+    "SELECT CAST(date AS DATE) AS day, COUNT(*) FROM leads_t GROUP BY 1",
+    "SELECT COUNT(*) FROM leads_t WHERE CAST(date AS timestamp) > '2024-01-01'",
+    # SQLite: a number, so the filter matches every row
+    "SELECT COUNT(*) FROM leads_t WHERE date >= CURRENT_DATE - 30",
+    # SQLite: a UTC text comparison, not the database's date
+    "SELECT COUNT(*) FROM leads_t WHERE date < current_date",
+    "SELECT COUNT(*) FROM leads_t WHERE date > CURRENT_TIMESTAMP",
+])
+def test_postgres_date_semantics_go_to_the_database(sql):
+    local = engine()
+    with pytest.raises(LocalUnsupported):
+        asyncio.run(local.execute(sql, "leads_t", "v1"))
+    assert local.fallbacks == 1
+
+
+def test_date_alias_and_text_casts_stay_local():
+    assert not needs_postgres("SELECT date AS date, CAST(source AS TEXT) AS source FROM leads_t")
+    rows = asyncio.run(engine().execute("SELECT MIN(date) AS date FROM leads_t", "leads_t", "v1"))
+    assert rows == [{"date": "2020-06-01"}]
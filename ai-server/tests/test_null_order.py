@@ -0,0 +1,48 @@
+import asyncio
+
+from services.local_engine import LocalEngine, postgres_null_order
+from services.session_store import SessionStore
+
+ROWS = [
+    {"id": "1", "company": "Acme", "amount": 3},
+    {"id": "2", "company": None, "amount": None},
+    {"id": "3", "company": "Zenith", "amount": 1},
+    {"id": "4", "company": "Bolt", "amount": 2},
+]
+# What Postgres returns: NULLs last ascending, first descending
+EXPECTED = {
+    "SELECT company FROM leads_t ORDER BY company LIMIT 2": ["Acme", "Bolt"],
+    "SELECT company FROM leads_t ORDER BY company ASC LIMIT 4": ["Acme", "Bolt", "Zenith", None],
+    "SELECT company FROM leads_t ORDER BY amount DESC LIMIT 2": [None, "Acme"],
+    "SELECT company FROM leads_t ORDER BY company NULLS FIRST LIMIT 2": [None, "Acme"],
+    "SELECT company FROM (SELECT company, amount FROM leads_t ORDER BY amount LIMIT 3) s ORDER BY company DESC":
+        ["Zenith", "Bolt", "Acme"],
+}
+
+
+def test_local_engine_matches_postgres_null_order():
+    engine = LocalEngine(query_service=None, catalog=None)
+    engine.load_table("leads_t", "v1", [("id", "uuid"), ("company", "text"), ("amount", "integer")], ROWS)
+
+    for sql, expected in EXPECTED.items():
+        rows = asyncio.run(engine.execute(sql, "leads_t", "v1"))
+        assert [row["company"] for row in rows] == expected, sql
+
+
+def test_session_results_match_postgres_null_order():
+    store = SessionStore()
+    store.record("s", "earlier question", "leads_t", "v1", [{"sql": "SELECT company, amount FROM leads_t", "data": ROWS}])
+
+    for sql, expected in EXPECTED.items():
+        if "(SELECT" in sql:
+            continue
+        rows = asyncio.run(store.answer("s", "leads_t", "v1", sql.replace("leads_t", "turn1_1")))
+        assert [row["company"] for row in rows] == expected, sql
+
+
+def test_rewrite_leaves_explicit_and_nested_terms_alone():
+    sql = "SELECT a, ROW_NUMBER() OVER (ORDER BY b DESC) FROM t ORDER BY COALESCE(a, c), d NULLS FIRST"
+    assert postgres_null_order(sql) == (
+        "SELECT a, ROW_NUMBER() OVER (ORDER BY b DESC NULLS FIRST) FROM t "
+        "ORDER BY COALESCE(a, c) NULLS LAST, d NULLS FIRST"
+    )
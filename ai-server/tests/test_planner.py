@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from services.claude_service import ClaudeService
+from services.structured_output import StructuredOutputError
+from standins import TABLE
+
+
+def parallel_service(intent):
+    service = ClaudeService("offline")
+
+    async def classify_intent(question):
+        return intent
+
+    async def should_generate_graph(question):
+        return {"include_graph": False, "graph_type": "none", "reasoning": ""}
+
+    async def generate_queries(question, table_name, schema=None):
+        raise StructuredOutputError("queries: [] should be non-empty")
+
+    service.classify_intent = classify_intent
+    service.should_generate_graph = should_generate_graph
+    service.generate_queries = generate_queries
+    return service
+
+
+def test_chat_ignores_failed_sql_generation():
+    service = parallel_service({"classification": "chat", "response": "Hello!"})
+
+    plan = asyncio.run(service.plan_analysis("Hello!", TABLE, mode="parallel"))
+
+    assert plan["intent"]["classification"] == "chat"
+    assert plan["queries"] == []
+
+
+def test_analyze_still_raises_failed_sql_generation():
+    service = parallel_service({"classification": "analyze", "response": None})
+
+    with pytest.raises(StructuredOutputError):
+        asyncio.run(service.plan_analysis("How many leads do we have?", TABLE, mode="parallel"))
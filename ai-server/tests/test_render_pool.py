@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+import pytest
+
+import services.fast_chart
+from services.graph_service import GraphService, RenderUnavailable
+from services.graph_store import GraphStore
+
+CHART = {"labels": ["a", "b"], "datasets": [{"label": "n", "data": [1, 2]}]}
+
+
+def test_fast_renders_take_a_render_slot(tmp_path):
+    service = GraphService(workers=1, store=GraphStore(str(tmp_path)))
+
+    async def run():
+        await service.render(CHART, "bar", engine="fast")
+        return service.pool.admitted, service.pool.active
+
+    assert asyncio.run(run()) == (1, 0)
+
+
+def test_slot_is_held_until_an_abandoned_render_finishes(tmp_path, monkeypatch):
+    def slow_render(graph_data, filepath, graph_type, width, height):
+        time.sleep(0.5)
+        with open(filepath, "wb") as f:
+            f.write(b"png")
+
+    monkeypatch.setattr(services.fast_chart, "render_fast_chart", slow_render)
+    service = GraphService(workers=1, render_timeout=0.1, store=GraphStore(str(tmp_path)))
+
+    async def run():
+        with pytest.raises(RenderUnavailable):
+            await service.render(CHART, "bar", engine="fast")
+        # The caller gave up, but the render is still running
+        held = service.pool.active
+        await asyncio.sleep(0.6)
+        return held, service.pool.active
+
+    assert asyncio.run(run()) == (1, 0)
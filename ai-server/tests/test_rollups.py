@@ -0,0 +1,37 @@
+from services.rollups import RollupStore, TableRollup
+
+TABLE = "leads_sample"
+
+
+def store():
+    rollups = RollupStore(query_service=None, catalog=None)
+    rollups.tables[TABLE] = TableRollup("v1", [
+        {"date": "2025-01-03", "source": "Webinar", "deal_stage": "Qualified", "lead_owner": "ana", "company": "Acme", "n": 3},
+        {"date": "2025-02-10", "source": "ads", "deal_stage": "Lost", "lead_owner": "Bob", "company": "acme", "n": 5},
+        {"date": "2025-02-11", "source": "Referral", "deal_stage": "Qualified", "lead_owner": "Ana", "company": None, "n": 1},
+    ])
+    return rollups
+
+
+def test_order_by_text_column_runs_as_sql():
+    rollups = store()
+    for sql in (
+        f"SELECT source, COUNT(*) FROM {TABLE} GROUP BY source ORDER BY source",
+        f"SELECT lead_owner, COUNT(*) AS n FROM {TABLE} GROUP BY lead_owner ORDER BY 1 DESC LIMIT 2",
+        f"SELECT company, COUNT(*) AS n FROM {TABLE} GROUP BY company ORDER BY n DESC, company",
+    ):
+        assert rollups.answer(sql, TABLE, "v1") is None
+    assert rollups.fallthrough["unsupported"] == 3
+
+
+def test_order_by_count_and_date_is_answered():
+    rollups = store()
+    rows = rollups.answer(
+        f"SELECT source, COUNT(*) AS n FROM {TABLE} GROUP BY source ORDER BY n DESC LIMIT 2", TABLE, "v1"
+    )
+    assert rows == [{"source": "ads", "n": 5}, {"source": "Webinar", "n": 3}]
+    rows = rollups.answer(
+        f"SELECT TO_CHAR(date, 'YYYY-MM') AS month, COUNT(*) AS n FROM {TABLE} GROUP BY 1 ORDER BY 1",
+        TABLE, "v1"
+    )
+    assert rows == [{"month": "2025-01", "n": 3}, {"month": "2025-02", "n": 6}]
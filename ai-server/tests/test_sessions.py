@@ -0,0 +1,57 @@
+import asyncio
+
+import httpx
+
+from standins import SAMPLE_CSV, TABLE, FakeAnthropic, FakePostgrest, install, load_sample
+
+
+def test_turn_whose_queries_all_failed_is_not_kept(monkeypatch):
+    import main
+
+    postgrest = FakePostgrest(load_sample(SAMPLE_CSV), latency_ms=0)
+    install(main, FakeAnthropic(0, jitter=0.0), postgrest)
+
+    async def failing_rpc(request: httpx.Request) -> httpx.Response:
+        if "/rpc/" in request.url.path:
+            return httpx.Response(500, json={"message": "database unavailable"})
+        return await postgrest.handle(request)
+
+    # Answered from rollups or the mirror, the queries couldn't fail
+    monkeypatch.setattr(main, "rollup_store", None)
+    monkeypatch.setattr(main, "local_engine", None)
+
+    async def run():
+        # The catalog loads its stats over the RPC too; load it before the database fails
+        assert await main.table_catalog.get(TABLE) is not None
+        monkeypatch.setattr(main.query_service, "client", httpx.AsyncClient(
+            transport=httpx.MockTransport(failing_rpc), base_url="http://postgrest.local/rest/v1"
+        ))
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/analyze", json={
+                "question": "Breakdown of deals per stage (failing)", "table_name": TABLE, "session_id": "failed-turn"
+            })
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 502
+    assert main.session_store.get("failed-turn") is None
+
+
+def test_follow_up_with_postgres_date_semantics_is_inlined_not_answered_locally():
+    from services.session_store import SessionStore
+
+    store = SessionStore()
+    rows = [{"date": "2024-01-15", "count": 3}, {"date": "2020-06-01", "count": 5}]
+    store.record("s", "Leads per day", TABLE, "v1", [
+        {"sql": f"SELECT date, COUNT(*) AS count FROM {TABLE} GROUP BY date", "data": rows}
+    ])
+
+    for sql in (
+        "SELECT SUM(count) FROM turn1_1 WHERE date >= CURRENT_DATE - 30",
+        "SELECT CAST(date AS DATE) AS day, count FROM turn1_1",
+    ):
+        assert asyncio.run(store.answer("s", TABLE, "v1", sql)) is None
+        assert store.inline("s", TABLE, "v1", sql).startswith("WITH turn1_1 AS (SELECT date")
+    # Plain SQL on the same results is still answered in-process
+    assert asyncio.run(store.answer("s", TABLE, "v1", "SELECT SUM(count) AS total FROM turn1_1")) == [{"total": 8}]
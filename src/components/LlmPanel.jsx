@@ -11,6 +11,8 @@ const LlmPanel = ({ table_id }) => {
     ]);
     const [inputValue, setInputValue] = useState('');
     const [isLoading, setIsLoading] = useState(false);
+    // One session per panel, so follow-up questions can build on earlier answers
+    const [sessionId] = useState(() => crypto.randomUUID());
     const tableName = "leads_" + table_id;
 
     const handleSendMessage = async () => {
@@ -22,7 +24,7 @@ const LlmPanel = ({ table_id }) => {
         setIsLoading(true);
 
         try {
-            const data = await analyzeData(inputValue, tableName);
+            const data = await analyzeData(inputValue, tableName, undefined, sessionId);
             setMessages(prev => [
                 ...prev,
                 {
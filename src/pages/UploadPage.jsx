@@ -1,8 +1,7 @@
 import { useState } from "react";
 import { Box, Heading, Button, Text, Input, FormControl, FormLabel, useToast, Progress } from "@chakra-ui/react";
 import { Link } from "react-router-dom";
-import Papa from "papaparse";
-import { createMasterEntry, createTableSchema, insertTableData } from "../services/api";
+import { fetchUploadProgress, uploadCsv } from "../services/api";
 import UploadsTable from "../components/UploadsTable";
 
 const UploadPage = () => {
@@ -10,107 +9,62 @@ const UploadPage = () => {
     const [loading, setLoading] = useState(false);
     const [progress, setProgress] = useState(0);
     const [uploadKey, setUploadKey] = useState(0);
+    const [failedUpload, setFailedUpload] = useState(null);
     const toast = useToast();
 
     const handleFileChange = (e) => {
         setFile(e.target.files[0]);
     };
 
-    const sanitizeHeader = (header) => {
-        // Sanitize headers to be safe column names (alphanumeric + underscores)
-        return header.trim().toLowerCase().replace(/[^a-z0-9_]/g, "_");
-    };
-
     const handleUpload = async () => {
         if (!file) return;
 
         setLoading(true);
-        setProgress(10);
-
-        Papa.parse(file, {
-            header: true,
-            skipEmptyLines: true,
-            complete: async (results) => {
-                try {
-                    const { data } = results;
-
-                    if (data.length === 0) {
-                        throw new Error("CSV file is empty");
-                    }
-
-                    setProgress(30);
-
-                    // 1. Create Metadata Entry in Master Table
-                    const uploadId = new Date().getTime().toString();
-                    const tableName = `leads_${uploadId}`;
-
-                    // Store only the ID in the master table (as requested)
-                    await createMasterEntry(file.name, uploadId);
-
-                    setProgress(50);
-
-                    // 2. Create Table with Fixed Schema using RPC
-                    await createTableSchema(tableName);
-
-                    setProgress(70);
-
-                    // 3. Prepare and Insert Data
-                    // Map CSV columns to our fixed DB columns
-                    // CSV: Date,Lead Owner,Source,Deal Stage,Account Id,First Name,Last Name,Company
-                    // DB: date, lead_owner, source, deal_stage, account_id, first_name, last_name, company
-                    const formattedData = data.map(row => {
-                        // Helper to safe get value
-                        const getVal = (key) => row[key] || row[Object.keys(row).find(k => k.trim().toLowerCase() === key.toLowerCase())] || null;
-
-                        return {
-                            date: getVal("Date"),
-                            lead_owner: getVal("Lead Owner"),
-                            source: getVal("Source"),
-                            deal_stage: getVal("Deal Stage"),
-                            account_id: getVal("Account Id"),
-                            first_name: getVal("First Name"),
-                            last_name: getVal("Last Name"),
-                            company: getVal("Company")
-                        };
-                    }).filter(row => row.date || row.lead_owner); // Filter out potentially empty parsing artifacts
-
-                    // Insert in batches
-                    await insertTableData(tableName, formattedData);
-
-                    setProgress(100);
-                    toast({
-                        title: "Upload Successful",
-                        description: `File uploaded with ID: ${uploadId}`,
-                        status: "success",
-                        duration: 5000,
-                        isClosable: true,
-                    });
-                    setUploadKey(prev => prev + 1);
-
-                } catch (error) {
-                    console.error("Upload failed:", error);
-                    toast({
-                        title: "Upload Failed",
-                        description: error.message || "An unexpected error occurred",
-                        status: "error",
-                        duration: 5000,
-                        isClosable: true,
-                    });
-                } finally {
-                    setLoading(false);
-                    setFile(null); // Reset file input
-                }
-            },
-            error: (error) => {
-                console.error("CSV Parse Error:", error);
-                setLoading(false);
-                toast({
-                    title: "CSV Parse Error",
-                    status: "error",
-                    isClosable: true,
-                });
+        setProgress(5);
+
+        // A failed upload of the same file is resumed: rows already stored are skipped
+        const resume = failedUpload !== null
+            && failedUpload.name === file.name
+            && failedUpload.size === file.size;
+        const uploadId = resume ? failedUpload.id : new Date().getTime().toString();
+
+        // The server parses and inserts the file as it streams in; poll how far it got
+        const poll = setInterval(async () => {
+            const status = await fetchUploadProgress(uploadId).catch(() => null);
+            if (status && file.size) {
+                setProgress(5 + Math.round(90 * Math.min(status.bytes_read / file.size, 1)));
             }
-        });
+        }, 500);
+
+        try {
+            const result = await uploadCsv(file, uploadId, resume);
+
+            setFailedUpload(null);
+            setProgress(100);
+            toast({
+                title: "Upload Successful",
+                description: `${result.rows_inserted} rows uploaded with ID: ${uploadId}`,
+                status: "success",
+                duration: 5000,
+                isClosable: true,
+            });
+            setUploadKey(prev => prev + 1);
+            setFile(null); // Reset file input
+
+        } catch (error) {
+            console.error("Upload failed:", error);
+            setFailedUpload({ id: uploadId, name: file.name, size: file.size });
+            toast({
+                title: "Upload Failed",
+                description: `${error.message || "An unexpected error occurred"}. Upload the same file again to resume.`,
+                status: "error",
+                duration: 5000,
+                isClosable: true,
+            });
+        } finally {
+            clearInterval(poll);
+            setLoading(false);
+        }
     };
 
     return (
@@ -184,8 +184,10 @@ export const deleteTableRows = async (tableName, rowIds) => {
  * Sends a prompt to the AI server for analysis.
  * @param {string} prompt 
  * @param {string} tableName
+ * @param {boolean} includeGraph
+ * @param {string} sessionId The conversation; follow-up questions may reuse its earlier results
  */
-export const analyzeData = async (prompt, tableName, includeGraph) => {
+export const analyzeData = async (prompt, tableName, includeGraph, sessionId) => {
     const AI_SERVER_URL = import.meta.env.VITE_AI_SERVER_URL || 'http://localhost:8000';
     const response = await fetch(AI_SERVER_URL + '/api/analyze', {
         method: 'POST',
@@ -195,7 +197,8 @@ export const analyzeData = async (prompt, tableName, includeGraph) => {
         body: JSON.stringify({
             question: prompt,
             table_name: tableName,
-            include_graph: includeGraph
+            include_graph: includeGraph,
+            session_id: sessionId
         }),
     });
 
@@ -205,3 +208,48 @@ export const analyzeData = async (prompt, tableName, includeGraph) => {
 
     return await response.json();
 };
+
+/**
+ * Streams a CSV file to the AI server, which inserts the rows in batches and
+ * registers the upload in master_uploads once every row is stored.
+ * @param {File} file 
+ * @param {string} uploadId 
+ * @param {boolean} resume Continue a failed upload with the same id
+ */
+export const uploadCsv = async (file, uploadId, resume = false) => {
+    const AI_SERVER_URL = import.meta.env.VITE_AI_SERVER_URL || 'http://localhost:8000';
+    const params = new URLSearchParams({ filename: file.name, upload_id: uploadId, resume });
+    const response = await fetch(`${AI_SERVER_URL}/api/upload?${params}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'text/csv',
+        },
+        body: file,
+    });
+
+    const result = await response.json().catch(() => ({}));
+    if (!response.ok) {
+        // Failed inserts return the upload's progress; other errors a message
+        const detail = result.detail;
+        throw new Error(
+            (typeof detail === 'string' ? detail : detail?.error) || `AI Server Error: ${response.statusText}`
+        );
+    }
+
+    return result;
+};
+
+/**
+ * Fetches the progress of a running or finished upload, or null if the server doesn't know it.
+ * @param {string} uploadId 
+ */
+export const fetchUploadProgress = async (uploadId) => {
+    const AI_SERVER_URL = import.meta.env.VITE_AI_SERVER_URL || 'http://localhost:8000';
+    const response = await fetch(`${AI_SERVER_URL}/api/upload/${uploadId}`);
+
+    if (!response.ok) {
+        return null;
+    }
+
+    return await response.json();
+};